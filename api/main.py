@@ -1,27 +1,39 @@
 import os
-from typing import List, Optional, Any, Dict
-from fastapi import FastAPI, UploadFile, File, Form, HTTPException, Request
-from fastapi.responses import JSONResponse, HTMLResponse
+import sys
+import json
+import random
+import time
+from typing import List, Optional, Any, Dict, Tuple
+from fastapi import FastAPI, UploadFile, File, Form, HTTPException, Request, Header, BackgroundTasks
+from fastapi.responses import JSONResponse, HTMLResponse, PlainTextResponse, StreamingResponse
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.concurrency import run_in_threadpool
 from fastapi.staticfiles import StaticFiles
 from fastapi.templating import Jinja2Templates
 from pathlib import Path
 
-from src.data_ingestion.data_ingestion import (
-    DocHandler,
-    DocumentComparator,
-    ChatIngestor,
+# Feature modules (LangChain, FAISS, PyMuPDF, pandas, provider SDKs) are imported inside the
+# endpoints that need them, or ahead of time by the optional warm-up, to keep cold starts fast.
+from api.warmup import WARMUP, start_warmup
+from utils.document_ops import FastAPIFileAdapter, InMemoryUpload
+from utils.config_loader import get_config
+from utils.storage_backend import fetch_dir, get_storage
+from utils.session_catalog import SessionCollector, touch_session
+from utils.memory_tracking import open_request_window, close_request_window, configure as configure_memory_tracking
+from utils.metrics import (
+    REGISTRY, HTTP_SECONDS, HTTP_TOTAL, HTTP_IN_FLIGHT, start_request_timings, server_timing_header,
+    request_tags, tag_request,
 )
-from src.document_analyzer.data_analyzer import DocumentAnalyzer
-from src.document_compare.document_comparator import DocumentComparatorLLM
-from src.document_chat.retrieval import ConversationalRAG
-from utils.document_ops import FastAPIFileAdapter,read_pdf_via_handler
 from logger import GLOBAL_LOGGER as log
+from logger.custom_logger import set_level, set_sampling, pipeline_stats
+from model.models import BatchQueryRequest
 
 
 FAISS_BASE = os.getenv("FAISS_BASE", "faiss_index")
 UPLOAD_BASE = os.getenv("UPLOAD_BASE", "data")
 FAISS_INDEX_NAME = os.getenv("FAISS_INDEX_NAME", "index") 
+FAISS_STORAGE_MODE = os.getenv("FAISS_STORAGE_MODE", "session")  # session | consolidated
+ADMIN_TOKEN = os.getenv("ADMIN_TOKEN")
 
 
 # FastAPI app setup
@@ -41,6 +53,114 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+# ---------- Metrics + Server-Timing ----------
+def _profile_trigger(request: Request) -> Optional[str]:
+    """"admin" (X-Profile header with a valid admin token) or "sampled" (profiling.sample_rate), else None."""
+    if request.headers.get("x-profile"):
+        if ADMIN_TOKEN and request.headers.get("x-admin-token") == ADMIN_TOKEN:
+            return "admin"
+        return None
+    block = get_config().get("profiling") or {}
+    rate = float(block.get("sample_rate") or 0)
+    if rate <= 0 or random.random() >= rate:
+        return None
+    endpoints = block.get("endpoints")
+    return "sampled" if not endpoints or request.url.path in endpoints else None
+
+
+async def _after_body(body, done):
+    """Pass a response body through, calling `done()` once it has been sent (or abandoned)."""
+    try:
+        async for chunk in body:
+            yield chunk
+    finally:
+        done()
+
+
+@app.middleware("http")
+async def stage_timing_middleware(request: Request, call_next):
+    timings = start_request_timings(request.url.path)
+    trigger = _profile_trigger(request)
+    profile = None
+    if trigger:
+        from utils.profiler import start_request_profile
+        profile = start_request_profile(trigger)
+    memory = open_request_window(request.url.path)  # None unless memory_tracking is enabled
+
+    def finish(route: str):
+        if profile is not None:
+            profile.finish(route, request_tags())
+        close_request_window(memory, route, request_tags())
+
+    deferred = False
+    HTTP_IN_FLIGHT.inc(method=request.method)
+    start = time.perf_counter()
+    status = 500
+    try:
+        response = await call_next(request)
+        status = response.status_code
+        response.headers["Server-Timing"] = server_timing_header(timings, time.perf_counter() - start)
+        if profile is not None:
+            response.headers["X-Profile-Id"] = profile.id
+        if profile is not None or memory is not None:
+            # profile / memory window end once the body has been sent (covers streamed responses)
+            route = getattr(request.scope.get("route"), "path", request.url.path)
+            response.body_iterator = _after_body(response.body_iterator, lambda: finish(route))
+            deferred = True
+        return response
+    finally:
+        if not deferred and (profile is not None or memory is not None):  # call_next raised
+            finish(request.url.path)
+        # label by route template, not raw path, to keep metric cardinality bounded
+        route = getattr(request.scope.get("route"), "path", "unmatched")
+        HTTP_IN_FLIGHT.dec(method=request.method)
+        HTTP_SECONDS.observe(time.perf_counter() - start, path=route, method=request.method)
+        HTTP_TOTAL.inc(path=route, method=request.method, status=str(status))
+
+
+@app.get("/metrics", response_class=PlainTextResponse)
+def metrics() -> PlainTextResponse:
+    return PlainTextResponse(REGISTRY.render(), media_type="text/plain; version=0.0.4")
+
+
+# ---------- Session garbage collection ----------
+def _evict_chat_session(session_id: str):
+    retrieval = sys.modules.get("src.document_chat.retrieval")  # only if this worker loaded indexes
+    if retrieval is not None:
+        retrieval.drop_cached_index(os.path.join(FAISS_BASE, session_id))
+    if FAISS_STORAGE_MODE == "consolidated":
+        from src.data_ingestion.data_ingestion import consolidated_store
+        consolidated_store(FAISS_BASE).remove_session(session_id)
+    storage = get_storage()
+    if storage is not None:  # expire the shared copy too, or other nodes would fetch it back
+        for base in (FAISS_BASE, UPLOAD_BASE):
+            storage.delete(os.path.join(base, session_id))
+
+
+@app.on_event("startup")
+def start_memory_tracking():
+    configure_memory_tracking(get_config())
+
+
+@app.on_event("startup")
+def start_session_collector():
+    config = get_config()
+    if not (config.get("session_gc") or {}).get("enabled"):
+        return
+    app.state.session_collector = SessionCollector.from_config(config, hooks={"chat": _evict_chat_session})
+    app.state.session_collector.start()
+
+
+@app.on_event("shutdown")
+def stop_session_collector():
+    collector = getattr(app.state, "session_collector", None)
+    if collector:
+        collector.stop()
+    pool = getattr(app.state, "parse_pool", None)
+    if pool:
+        pool.shutdown(cancel_futures=True)
+
+
 # homepage
 @app.get("/", response_class=HTMLResponse)
 async def serve_ui(request: Request):
@@ -56,17 +176,123 @@ def health() -> Dict[str, str]:
     return {"status": "ok", "service": "document-portal"}
 
 
+@app.get("/ready")
+def ready() -> JSONResponse:
+    """Readiness: 200 once warm-up (if enabled) has finished, 503 while warming or after a failure."""
+    state = WARMUP.snapshot()
+    status = 200 if state["state"] in ("ready", "disabled") else 503
+    return JSONResponse(status_code=status, content={"status": state["state"], "warmup": state})
+
+
+@app.on_event("startup")
+def begin_warmup():
+    if os.getenv("PREWARM", "false").lower() in ("1", "true", "yes"):
+        start_warmup(faiss_base=FAISS_BASE, index_name=FAISS_INDEX_NAME,
+                     hot_sessions=int(os.getenv("PREWARM_SESSIONS", "8")))
+
+
+# ---------- Errors ----------
+def _server_error(e: Exception, detail: str) -> HTTPException:
+    """500 for a failed request, or 429 + Retry-After when a provider budget was exhausted."""
+    from utils.rate_limiter import find_rate_limit_error
+
+    limited = find_rate_limit_error(e)
+    if limited is not None:
+        return HTTPException(status_code=429, detail=str(limited),
+                             headers={"Retry-After": str(max(1, round(limited.retry_after)))})
+    return HTTPException(status_code=500, detail=detail)
+
+
+# ---------- ADMIN: LOGGING ----------
+def _require_admin(token: Optional[str]):
+    if not ADMIN_TOKEN or token != ADMIN_TOKEN:
+        raise HTTPException(status_code=403, detail="Admin token required")
+
+
+@app.get("/admin/logging")
+def get_logging(x_admin_token: Optional[str] = Header(None)) -> Dict[str, Any]:
+    _require_admin(x_admin_token)
+    return pipeline_stats()
+
+
+@app.post("/admin/logging")
+def update_logging(
+    level: Optional[str] = Form(None),
+    sample_event: Optional[str] = Form(None),
+    sample_rate: float = Form(1.0),
+    x_admin_token: Optional[str] = Header(None),
+) -> Dict[str, Any]:
+    _require_admin(x_admin_token)
+    try:
+        if level:
+            set_level(level)
+        if sample_event:
+            set_sampling(sample_event, sample_rate)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    log.warning("Logging settings changed", **pipeline_stats())
+    return pipeline_stats()
+
+
+# ---------- ADMIN: LLM USAGE ----------
+@app.get("/admin/usage")
+def get_llm_usage(session_id: Optional[str] = None, day: Optional[str] = None,
+                  x_admin_token: Optional[str] = Header(None)) -> Dict[str, Any]:
+    """LLM calls, tokens and latency per session / endpoint / feature (day is YYYY-MM-DD, UTC)."""
+    _require_admin(x_admin_token)
+    from utils.llm_usage import get_ledger
+    ledger = get_ledger()
+    return {"day_tokens": ledger.day_tokens(day), "usage": ledger.summary(session_id=session_id, day=day)}
+
+
+# ---------- ADMIN: PROFILES ----------
+@app.get("/admin/profiles")
+def list_profiles(x_admin_token: Optional[str] = Header(None)) -> Dict[str, Any]:
+    """Saved request profiles, newest first (send X-Profile: 1 with the admin token to capture one)."""
+    _require_admin(x_admin_token)
+    from utils.profiler import profile_ring
+    return {"profiles": profile_ring().list()}
+
+
+@app.get("/admin/profiles/{name}", response_class=PlainTextResponse)
+def get_profile(name: str, x_admin_token: Optional[str] = Header(None)) -> PlainTextResponse:
+    """One profile in folded-stack format (flamegraph.pl, speedscope)."""
+    _require_admin(x_admin_token)
+    from utils.profiler import profile_ring
+    path = profile_ring().path(name)
+    if path is None:
+        raise HTTPException(status_code=404, detail=f"Profile not found: {name}")
+    return PlainTextResponse(path.read_text(encoding="utf-8"))
+
+
 # ---------- ANALYZE ----------
+def _upload_mode() -> Tuple[bool, bool]:
+    """(parse uploads in memory, keep a copy on disk) from the `uploads` config block."""
+    block = get_config().get("uploads") or {}
+    return bool(block.get("in_memory", False)), bool(block.get("retain", True))
+
+
 @app.post("/analyze")
-async def analyze_document(file: UploadFile = File(...)) -> Any:
+async def analyze_document(background: BackgroundTasks, file: UploadFile = File(...)) -> Any:
     try:
         log.info(f"Received file for analysis: {file.filename}")
-        dh = DocHandler()
-        saved_path = dh.save_pdf(FastAPIFileAdapter(file))
-        text = read_pdf_via_handler(dh, saved_path)
+        from src.data_ingestion.data_ingestion import DocHandler
+        from src.document_analyzer.data_analyzer import DocumentAnalyzer
+        from utils.llm_usage import set_usage_session
+        in_memory, retain = _upload_mode()
+        dh = DocHandler(persist=not in_memory)
+        set_usage_session(dh.session_id)
+        if in_memory:
+            upload = InMemoryUpload(file.filename, FastAPIFileAdapter(file).getbuffer())
+            text, pdf_info = dh.read_document(upload)
+            if retain:
+                background.add_task(dh.save_pdf, upload)  # written after the response is sent
+        else:
+            saved_path = dh.save_pdf(FastAPIFileAdapter(file))
+            text, pdf_info = dh.read_document(saved_path)
 
         analyzer = DocumentAnalyzer()
-        result = analyzer.analyze_document(text)
+        result = await analyzer.aanalyze_document(text, pdf_info)
 
         log.info("Document analysis complete")
         return JSONResponse(content=result)
@@ -75,25 +301,101 @@ async def analyze_document(file: UploadFile = File(...)) -> Any:
         raise
     except Exception as e:
         log.exception("Error during document analysis")
-        raise HTTPException(status_code=500, detail=f"Analysis failed: {e}")
+        raise _server_error(e, f"Analysis failed: {e}")
+
+
+# ---------- ANALYZE: BULK ----------
+def _parse_pool(workers: int):
+    """Process pool for CPU-bound PDF parsing, created on first use and shared by requests."""
+    if workers <= 0:
+        return None
+    pool = getattr(app.state, "parse_pool", None)
+    if pool is None:
+        from concurrent.futures import ProcessPoolExecutor
+        pool = app.state.parse_pool = ProcessPoolExecutor(max_workers=workers)
+    return pool
+
+
+@app.post("/analyze/bulk")
+async def analyze_documents_bulk(files: List[UploadFile] = File(...), max_concurrency: Optional[int] = Form(None)) -> Any:
+    """
+    Analyze many PDFs in one request. Results are streamed as NDJSON, one line per file in
+    completion order, followed by a summary line; a bad file yields an error line only.
+    """
+    try:
+        limits = get_config().get("bulk_analysis") or {}
+        max_files = int(limits.get("max_files", 300))
+        if len(files) > max_files:
+            raise HTTPException(status_code=413, detail=f"At most {max_files} files per request")
+        limit = int(limits.get("max_concurrency", 4))
+        concurrency = max(1, min(max_concurrency or limit, limit))
+        log.info("Received files for bulk analysis", files=len(files), concurrency=concurrency)
+
+        from src.data_ingestion.data_ingestion import DocHandler, read_pdf_document
+        from src.document_analyzer.data_analyzer import DocumentAnalyzer
+        from utils.llm_usage import set_usage_session
+        dh = DocHandler()
+        saved, positions, rejected = [], [], []
+        for i, f in enumerate(files):
+            try:
+                # index prefix: two uploads with the same name must not overwrite each other
+                saved.append((f.filename, dh.save_pdf(FastAPIFileAdapter(f), prefix=f"{i:04d}_")))
+                positions.append(i)
+            except Exception as e:
+                rejected.append({"index": i, "file": f.filename, "status": "error", "error": str(e)})
+
+        analyzer = DocumentAnalyzer()
+        pool = _parse_pool(int(limits.get("parse_workers", 0)))
+
+        async def lines():
+            set_usage_session(dh.session_id)  # the body streams outside the endpoint's context
+            ok = 0
+            for item in rejected:
+                yield json.dumps(item) + "\n"
+            async for item in analyzer.analyze_files(saved, read_pdf_document, concurrency, executor=pool,
+                                                     max_in_flight=limits.get("max_in_flight")):
+                item["index"] = positions[item["index"]]  # position in the upload, not among saved files
+                ok += item["status"] == "ok"
+                yield json.dumps(item) + "\n"
+            log.info("Bulk analysis complete", session_id=dh.session_id, ok=ok, failed=len(files) - ok)
+            yield json.dumps({"done": True, "session_id": dh.session_id, "ok": ok, "failed": len(files) - ok}) + "\n"
+
+        return StreamingResponse(lines(), media_type="application/x-ndjson")
+
+    except HTTPException:
+        raise
+    except Exception as e:
+        log.exception("Error during bulk document analysis")
+        raise _server_error(e, f"Bulk analysis failed: {e}")
 
 
 # ---------- COMPARE ----------
 @app.post("/compare")
-async def compare_documents(reference: UploadFile = File(...), actual: UploadFile = File(...)) -> Any:
+async def compare_documents(background: BackgroundTasks, reference: UploadFile = File(...),
+                            actual: UploadFile = File(...)) -> Any:
     try:
         log.info(f"Comparing files: {reference.filename} vs {actual.filename}")
-        dc = DocumentComparator()
-        
-        ref_path, act_path = dc.save_uploaded_files(
-            FastAPIFileAdapter(reference), FastAPIFileAdapter(actual)
-        )
-        _ = ref_path, act_path
+        from src.data_ingestion.data_ingestion import DocumentComparator
+        from src.document_compare.document_comparator import DocumentComparatorLLM
+        from utils.llm_usage import set_usage_session
+        in_memory, retain = _upload_mode()
+        dc = DocumentComparator(os.path.join(UPLOAD_BASE, "document_compare"), persist=not in_memory)
+        set_usage_session(dc.session_id)
 
-        combined_text = dc.combine_documents()
+        if in_memory:
+            ref, act = (InMemoryUpload(f.filename, FastAPIFileAdapter(f).getbuffer()) for f in (reference, actual))
+            combined_text = dc.combine_uploads([ref, act])
+            if retain:
+                background.add_task(dc.save_uploaded_files, ref, act)
+        else:
+            ref_path, act_path = dc.save_uploaded_files(
+                FastAPIFileAdapter(reference), FastAPIFileAdapter(actual)
+            )
+            _ = ref_path, act_path
+            combined_text = dc.combine_documents()
 
         comp = DocumentComparatorLLM()
-        df = comp.compare_documents(combined_text)
+        df = await run_in_threadpool(comp.compare_documents, combined_text)  # keeps the event loop free
         log.info("Document comparison completed.")
         return {"rows": df.to_dict(orient="records"), "session_id": dc.session_id}
     
@@ -101,10 +403,44 @@ async def compare_documents(reference: UploadFile = File(...), actual: UploadFil
         raise
     except Exception as e:
         log.exception("Comparison failed")
-        raise HTTPException(status_code=500, detail=f"Comparison failed: {e}")
+        raise _server_error(e, f"Comparison failed: {e}")
+
+
+@app.post("/compare/versions")
+async def compare_versions(files: List[UploadFile] = File(...)) -> Any:
+    """Compare N ordered versions (upload order) and return successive-pair change tables."""
+    try:
+        limits = get_config().get("compare_versions") or {}
+        max_versions = int(limits.get("max_versions", 20))
+        if not 2 <= len(files) <= max_versions:
+            raise HTTPException(status_code=400, detail=f"Provide between 2 and {max_versions} versions")
+        log.info("Comparing versions", files=[f.filename for f in files])
+        from src.data_ingestion.data_ingestion import DocumentComparator
+        from src.document_compare.document_comparator import DocumentComparatorLLM
+        from utils.llm_usage import set_usage_session
+        dc = DocumentComparator(os.path.join(UPLOAD_BASE, "document_compare"))
+        set_usage_session(dc.session_id)
+        paths = dc.save_versions([FastAPIFileAdapter(f) for f in files])
+        versions = dc.load_versions(paths)
+
+        comp = DocumentComparatorLLM()
+        pairs = await comp.compare_versions(versions, max_concurrency=int(limits.get("max_concurrency", 4)))
+        return {"session_id": dc.session_id, "versions": [f.filename for f in files], "pairs": pairs}
+
+    except HTTPException:
+        raise
+    except Exception as e:
+        log.exception("Version comparison failed")
+        raise _server_error(e, f"Version comparison failed: {e}")
 
 
 # ---------- CHAT: INDEX ----------
+def _default_top_k() -> int:
+    """`retriever.top_k` from the live config snapshot (hot-reloaded, no restart needed)."""
+    return int((get_config().get("retriever") or {}).get("top_k", 5))
+
+
+
 @app.post("/chat/index")
 async def chat_build_index(
     files: List[UploadFile] = File(...),
@@ -112,10 +448,12 @@ async def chat_build_index(
     use_session_dirs: bool = Form(True),
     chunk_size: int = Form(1000),
     chunk_overlap: int = Form(200),
-    k: int = Form(5),
+    k: Optional[int] = Form(None),
 ) -> Any:
     try:
         log.info(f"Indexing chat session. Session ID: {session_id}, Files: {[f.filename for f in files]}")
+        from src.data_ingestion.data_ingestion import ChatIngestor
+        k = k or _default_top_k()
         wrapped = [FastAPIFileAdapter(f) for f in files]
 
         ci = ChatIngestor(
@@ -123,10 +461,12 @@ async def chat_build_index(
             faiss_base=FAISS_BASE,
             use_session_dirs=use_session_dirs,
             session_id=session_id or None,
+            storage_mode=FAISS_STORAGE_MODE,
         )
+        tag_request(session_id=ci.session_id)
 
-        ci.built_retriver(  
-            wrapped, chunk_size=chunk_size, chunk_overlap=chunk_overlap, k=k
+        await run_in_threadpool(
+            ci.built_retriver, wrapped, chunk_size=chunk_size, chunk_overlap=chunk_overlap, k=k
         )
         log.info(f"Index created successfully for session: {ci.session_id}")
         return {"session_id": ci.session_id, "k": k, "use_session_dirs": use_session_dirs}
@@ -135,30 +475,48 @@ async def chat_build_index(
         raise
     except Exception as e:
         log.exception("Chat index building failed")
-        raise HTTPException(status_code=500, detail=f"Indexing failed: {e}")
+        raise _server_error(e, f"Indexing failed: {e}")
 
 
 # ---------- CHAT: QUERY ----------
+def _session_rag(session_id: Optional[str], use_session_dirs: bool, k: int):
+    """ConversationalRAG bound to a chat session's index (session directory or consolidated store)."""
+    if use_session_dirs and not session_id:
+        raise HTTPException(status_code=400, detail="session_id is required when use_session_dirs=True")
+    tag_request(session_id=session_id)
+
+    from src.data_ingestion.data_ingestion import consolidated_store
+    from src.document_chat.retrieval import ConversationalRAG
+
+    if FAISS_STORAGE_MODE == "consolidated":
+        if not session_id:
+            raise HTTPException(status_code=400, detail="session_id is required in consolidated storage mode")
+        store = consolidated_store(FAISS_BASE)
+        if not store.has_session(session_id):
+            raise HTTPException(status_code=404, detail=f"No indexed data for session: {session_id}")
+        return ConversationalRAG(session_id=session_id, retriever=store.as_retriever(session_id, k=k))
+
+    index_dir = os.path.join(FAISS_BASE, session_id) if use_session_dirs else FAISS_BASE  # type: ignore
+    if not fetch_dir(index_dir):  # served from another node's index via shared storage, if configured
+        raise HTTPException(status_code=404, detail=f"FAISS index not found at: {index_dir}")
+    rag = ConversationalRAG(session_id=session_id)
+    rag.load_retriever_from_faiss(index_dir, k=k, index_name=FAISS_INDEX_NAME)
+    return rag
+
+
 @app.post("/chat/query")
 async def chat_query(
     question: str = Form(...),
     session_id: Optional[str] = Form(None),
     use_session_dirs: bool = Form(True),
-    k: int = Form(5),
+    k: Optional[int] = Form(None),
 ) -> Any:
     try:
         log.info(f"Received chat query: '{question}' | session: {session_id}")
-        if use_session_dirs and not session_id:
-            raise HTTPException(status_code=400, detail="session_id is required when use_session_dirs=True")
-
-        index_dir = os.path.join(FAISS_BASE, session_id) if use_session_dirs else FAISS_BASE  # type: ignore
-        if not os.path.isdir(index_dir):
-            raise HTTPException(status_code=404, detail=f"FAISS index not found at: {index_dir}")
-
-        rag = ConversationalRAG(session_id=session_id)
-        rag.load_retriever_from_faiss(index_dir, k=k, index_name=FAISS_INDEX_NAME) 
-        
-        response = rag.invoke(question, chat_history=[])
+        k = k or _default_top_k()
+        touch_session("chat", session_id)  # marks it in use for the session collector before loading
+        rag = _session_rag(session_id, use_session_dirs, k)
+        response = await run_in_threadpool(rag.invoke, question, chat_history=[])
         log.info("Chat query handled successfully.")
 
         return {
@@ -172,6 +530,54 @@ async def chat_query(
         raise
     except Exception as e:
         log.exception("Chat query failed")
-        raise HTTPException(status_code=500, detail=f"Query failed: {e}")
+        raise _server_error(e, f"Query failed: {e}")
+
+
+# ---------- CHAT: BATCH QUERY ----------
+def _batch_item(index: int, question: str, answer: Any) -> Dict[str, Any]:
+    if isinstance(answer, Exception):
+        return {"index": index, "question": question, "error": str(answer)}
+    return {"index": index, "question": question, "answer": answer or "no answer generated."}
+
+
+@app.post("/chat/query/batch")
+async def chat_query_batch(req: BatchQueryRequest) -> Any:
+    """
+    Answer many standalone questions against one session: the index is loaded once, all
+    questions are embedded in one call and searched together, and answer LLM calls run
+    concurrently (batch_query.max_concurrency). With stream=true, results are sent as NDJSON
+    lines in completion order; otherwise one JSON body in question order.
+    """
+    try:
+        limits = get_config().get("batch_query") or {}
+        max_questions = int(limits.get("max_questions", 200))
+        if len(req.questions) > max_questions:
+            raise HTTPException(status_code=413, detail=f"At most {max_questions} questions per batch")
+        concurrency = max(1, min(req.max_concurrency or int(limits.get("max_concurrency", 4)),
+                                 int(limits.get("max_concurrency", 4))))
+        k = req.k or _default_top_k()
+        log.info("Received batch chat query", session_id=req.session_id, questions=len(req.questions),
+                 concurrency=concurrency, stream=req.stream)
 
+        touch_session("chat", req.session_id)
+        rag = _session_rag(req.session_id, req.use_session_dirs, k)
+        contexts = await run_in_threadpool(rag.retrieve_many, req.questions, k=k)
 
+        if req.stream:
+            async def lines():
+                async for i, answer in rag.aanswers_as_completed(req.questions, contexts, concurrency):
+                    yield json.dumps(_batch_item(i, req.questions[i], answer)) + "\n"
+                log.info("Batch chat query streamed", session_id=req.session_id, questions=len(req.questions))
+            return StreamingResponse(lines(), media_type="application/x-ndjson")
+
+        answers = await rag.abatch_answers(req.questions, contexts, concurrency)
+        results = [_batch_item(i, q, a) for i, (q, a) in enumerate(zip(req.questions, answers))]
+        log.info("Batch chat query handled", session_id=req.session_id, questions=len(results),
+                 failed=sum("error" in r for r in results))
+        return {"results": results, "session_id": req.session_id, "k": k, "engine": "LCEL-RAG"}
+
+    except HTTPException:
+        raise
+    except Exception as e:
+        log.exception("Batch chat query failed")
+        raise _server_error(e, f"Batch query failed: {e}")
@@ -0,0 +1,100 @@
+import importlib
+import threading
+import time
+from pathlib import Path
+from typing import Any, Dict
+
+from logger import GLOBAL_LOGGER as log
+
+# Modules the request handlers import lazily; importing them here moves that cost before readiness.
+HEAVY_MODULES = (
+    "src.data_ingestion.data_ingestion",
+    "src.document_analyzer.data_analyzer",
+    "src.document_compare.document_comparator",
+    "src.document_chat.retrieval",
+)
+
+
+class WarmupState:
+    """Thread-safe record of the pre-warm phase, reported by /ready."""
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._state: Dict[str, Any] = {"state": "disabled", "steps": {}, "error": None}
+
+    def update(self, **fields):
+        with self._lock:
+            self._state.update(fields)
+
+    def step(self, name: str, seconds: float, **info):
+        with self._lock:
+            self._state["steps"][name] = {"seconds": round(seconds, 3), **info}
+
+    def snapshot(self) -> Dict[str, Any]:
+        with self._lock:
+            return {**self._state, "steps": dict(self._state["steps"])}
+
+
+WARMUP = WarmupState()
+
+
+def _import_modules():
+    for name in HEAVY_MODULES:
+        importlib.import_module(name)
+    return {"modules": len(HEAVY_MODULES)}
+
+
+def _build_clients():
+    from utils.model_loader import ModelLoader
+    loader = ModelLoader()
+    loader.load_embeddings()
+    loader.load_llm()
+    return {}
+
+
+def _load_hot_sessions(faiss_base: str, index_name: str, limit: int):
+    """Load the most recently accessed chat indexes into the retrieval cache."""
+    from utils.model_loader import ModelLoader
+    from utils.session_catalog import get_catalog
+    from src.document_chat.retrieval import load_vectorstore
+    from utils.index_generations import IndexGenerations
+
+    embeddings = ModelLoader().load_embeddings()
+    hot = list(reversed(get_catalog().sessions("chat")))[:limit]
+    loaded = 0
+    for s in hot:
+        index_dir = Path(faiss_base) / s["session_id"]
+        if IndexGenerations(index_dir, index_name).current() is not None:
+            load_vectorstore(str(index_dir), embeddings, index_name=index_name)
+            loaded += 1
+    return {"sessions": loaded}
+
+
+def run_warmup(faiss_base: str = "faiss_index", index_name: str = "index", hot_sessions: int = 8):
+    """Import feature modules, build provider clients and load hot sessions, then mark ready."""
+    WARMUP.update(state="warming", started_at=time.time())
+    start = time.perf_counter()
+    steps = (
+        ("imports", _import_modules),
+        ("clients", _build_clients),
+        ("sessions", lambda: _load_hot_sessions(faiss_base, index_name, hot_sessions)),
+    )
+    for name, fn in steps:
+        t0 = time.perf_counter()
+        try:
+            info = fn() or {}
+            WARMUP.step(name, time.perf_counter() - t0, **info)
+        except Exception as e:
+            WARMUP.step(name, time.perf_counter() - t0, error=str(e))
+            WARMUP.update(state="failed", error=f"{name}: {e}")
+            log.error("Warm-up failed", step=name, error=str(e))
+            return
+    WARMUP.update(state="ready", seconds=round(time.perf_counter() - start, 3))
+    log.info("Warm-up complete", **WARMUP.snapshot())
+
+
+def start_warmup(**kwargs) -> threading.Thread:
+    """Run the warm-up in the background so /health and /ready answer while it progresses."""
+    WARMUP.update(state="pending")
+    thread = threading.Thread(target=run_warmup, kwargs=kwargs, name="warmup", daemon=True)
+    thread.start()
+    return thread
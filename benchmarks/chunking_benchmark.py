@@ -0,0 +1,90 @@
+"""
+Chunking throughput: per-call RecursiveCharacterTextSplitter vs the streaming Chunker.
+
+Usage:
+    python -m benchmarks.chunking_benchmark --pages 5000 --workers 4 --out chunking_report.json
+
+Builds a synthetic multi-thousand-page corpus (page-level Documents, like PyPDFLoader output)
+and measures pages/s and chunks/s for the baseline splitter and for the Chunker in
+character and token mode, single process and with a worker pool.
+"""
+import argparse
+import json
+import random
+import time
+from pathlib import Path
+
+from langchain.schema import Document
+from langchain_text_splitters import RecursiveCharacterTextSplitter
+
+from utils.chunking import Chunker
+
+WORDS = ("retrieval augmented generation index vector embedding document page section summary "
+         "analysis comparison version thesis chapter figure table result method dataset model").split()
+
+
+def synthetic_pages(pages: int, words_per_page: int = 550, seed: int = 0):
+    rng = random.Random(seed)
+    docs = []
+    for p in range(pages):
+        paras = []
+        for _ in range(6):
+            sentence_words = [rng.choice(WORDS) for _ in range(words_per_page // 6)]
+            paras.append(" ".join(sentence_words).capitalize() + ".")
+        docs.append(Document(page_content="\n\n".join(paras),
+                             metadata={"source": f"doc_{p // 300}.pdf", "page": p % 300}))
+    return docs
+
+
+def baseline(docs, chunk_size, chunk_overlap):
+    splitter = RecursiveCharacterTextSplitter(chunk_size=chunk_size, chunk_overlap=chunk_overlap)
+    return len(splitter.split_documents(docs))
+
+
+def streaming(docs, chunker):
+    return sum(1 for _ in chunker.iter_chunks(iter(docs)))
+
+
+def timed(fn, *args):
+    start = time.perf_counter()
+    n = fn(*args)
+    return n, time.perf_counter() - start
+
+
+def main():
+    ap = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    ap.add_argument("--pages", type=int, default=3000)
+    ap.add_argument("--chunk-size", type=int, default=1000)
+    ap.add_argument("--chunk-overlap", type=int, default=200)
+    ap.add_argument("--workers", type=int, default=4)
+    ap.add_argument("--out", default="chunking_report.json")
+    args = ap.parse_args()
+
+    docs = synthetic_pages(args.pages)
+    token_size, token_overlap = args.chunk_size // 4, args.chunk_overlap // 4
+    runs = [
+        ("baseline_chars", lambda: timed(baseline, docs, args.chunk_size, args.chunk_overlap)),
+        ("chunker_chars", lambda: timed(streaming, docs, Chunker(args.chunk_size, args.chunk_overlap))),
+        (f"chunker_chars_x{args.workers}",
+         lambda: timed(streaming, docs, Chunker(args.chunk_size, args.chunk_overlap, workers=args.workers))),
+        ("chunker_tokens", lambda: timed(streaming, docs, Chunker(token_size, token_overlap, unit="tokens"))),
+        (f"chunker_tokens_x{args.workers}",
+         lambda: timed(streaming, docs, Chunker(token_size, token_overlap, unit="tokens", workers=args.workers))),
+    ]
+
+    rows = []
+    for name, run in runs:
+        chunks, seconds = run()
+        rows.append({"run": name, "chunks": chunks, "seconds": round(seconds, 3),
+                     "pages_per_s": round(len(docs) / seconds, 1), "chunks_per_s": round(chunks / seconds, 1)})
+        print(f"{name:<22}{chunks:>9} chunks{seconds:>9.2f}s{rows[-1]['pages_per_s']:>11} pages/s")
+
+    base = rows[0]["seconds"]
+    for r in rows:
+        r["speedup_vs_baseline"] = round(base / r["seconds"], 2)
+    Path(args.out).write_text(json.dumps({"pages": len(docs), "rows": rows}, indent=2), encoding="utf-8")
+    print(f"Report written to {args.out}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,130 @@
+"""
+Offline stand-ins for the LLM and embedding providers, used by the load-test harness.
+
+    uvicorn benchmarks.fake_providers:app --workers 2
+
+Importing this module patches ModelLoader so every provider LLM and the embedding model are
+fakes with lognormal latency (LOADTEST_PROFILE: JSON overriding DEFAULT_PROFILE), then
+exposes `api.main:app`. Everything else (routing, usage accounting, FAISS, parsing) is real.
+Responses are valid for each prompt: an analysis summary JSON, a comparison change table, or
+a short chat answer.
+"""
+from __future__ import annotations
+import asyncio
+import hashlib
+import json
+import os
+import random
+import time
+from typing import Any, Dict, List, Optional
+
+import numpy as np
+from langchain_core.embeddings import Embeddings
+from langchain_core.language_models.chat_models import BaseChatModel
+from langchain_core.messages import AIMessage, BaseMessage
+from langchain_core.outputs import ChatGeneration, ChatResult
+
+from utils.model_loader import ModelLoader
+
+DEFAULT_PROFILE: Dict[str, Any] = {
+    "llm": {
+        # time to first token (lognormal median / sigma), then output tokens at tokens_per_second
+        "groq": {"ttft_median": 0.4, "ttft_sigma": 0.5, "tokens_per_second": 250, "output_tokens": 300, "error_rate": 0.0},
+        "google": {"ttft_median": 0.8, "ttft_sigma": 0.4, "tokens_per_second": 150, "output_tokens": 300, "error_rate": 0.0},
+    },
+    "embeddings": {"latency_median": 0.12, "latency_sigma": 0.3, "per_text_seconds": 0.002, "dim": 768},
+}
+
+
+def _lognormal(median: float, sigma: float) -> float:
+    return random.lognormvariate(np.log(median), sigma) if median > 0 else 0.0
+
+
+def _reply(prompt: str) -> str:
+    if "Return ONLY valid JSON" in prompt:  # document_analysis
+        return json.dumps({"Summary": ["Synthetic load-test summary."], "SentimentTone": "Neutral"})
+    if "Compare the content in two PDFs" in prompt:  # document_comparison
+        return json.dumps([{"Page": "1", "Changes": "Synthetic change."}])
+    return "Synthetic answer based on the retrieved context."
+
+
+class FakeChatModel(BaseChatModel):
+    """Chat model that sleeps for a sampled provider latency and returns a canned reply."""
+    provider: str
+    ttft_median: float = 0.4
+    ttft_sigma: float = 0.5
+    tokens_per_second: float = 250
+    output_tokens: int = 300
+    error_rate: float = 0.0
+
+    @property
+    def _llm_type(self) -> str:
+        return f"fake-{self.provider}"
+
+    def _latency(self) -> float:
+        return _lognormal(self.ttft_median, self.ttft_sigma) + self.output_tokens / max(self.tokens_per_second, 1e-9)
+
+    def _result(self, messages: List[BaseMessage]) -> ChatResult:
+        if random.random() < self.error_rate:
+            raise RuntimeError(f"{self.provider}: injected provider error")
+        prompt = "\n".join(str(m.content) for m in messages)
+        usage = {"prompt_tokens": len(prompt) // 4 + 1, "completion_tokens": self.output_tokens}
+        return ChatResult(generations=[ChatGeneration(message=AIMessage(content=_reply(prompt)))],
+                          llm_output={"token_usage": usage, "provider": self.provider})
+
+    def _generate(self, messages: List[BaseMessage], stop: Optional[List[str]] = None, run_manager=None, **kwargs) -> ChatResult:
+        time.sleep(self._latency())
+        return self._result(messages)
+
+    async def _agenerate(self, messages: List[BaseMessage], stop: Optional[List[str]] = None, run_manager=None, **kwargs) -> ChatResult:
+        await asyncio.sleep(self._latency())
+        return self._result(messages)
+
+
+class FakeEmbeddings(Embeddings):
+    """Deterministic per-text vectors after a sampled per-call latency."""
+    def __init__(self, dim: int = 768, latency_median: float = 0.12, latency_sigma: float = 0.3,
+                 per_text_seconds: float = 0.002):
+        self.dim = dim
+        self.latency_median = latency_median
+        self.latency_sigma = latency_sigma
+        self.per_text_seconds = per_text_seconds
+
+    def _vector(self, text: str) -> List[float]:
+        seed = int(hashlib.md5(text.encode("utf-8")).hexdigest()[:8], 16)
+        return np.random.default_rng(seed).standard_normal(self.dim).astype("float32").tolist()
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        time.sleep(_lognormal(self.latency_median, self.latency_sigma) + self.per_text_seconds * len(texts))
+        return [self._vector(t) for t in texts]
+
+    def embed_query(self, text: str) -> List[float]:
+        return self.embed_documents([text])[0]
+
+
+def load_profile() -> Dict[str, Any]:
+    """DEFAULT_PROFILE, with sections overridden by the LOADTEST_PROFILE JSON."""
+    profile = {k: dict(v) for k, v in DEFAULT_PROFILE.items()}
+    for section, values in json.loads(os.getenv("LOADTEST_PROFILE") or "{}").items():
+        profile.setdefault(section, {}).update(values)
+    return profile
+
+
+def fake_llm(provider: str, profile: Dict[str, Any]) -> FakeChatModel:
+    return FakeChatModel(provider=provider, **(profile["llm"].get(provider) or {}))
+
+
+def fake_embeddings(profile: Dict[str, Any]) -> FakeEmbeddings:
+    return FakeEmbeddings(**profile["embeddings"])
+
+
+def install(profile: Optional[Dict[str, Any]] = None):
+    """Route ModelLoader's provider LLMs and embeddings to the fakes (process-wide)."""
+    profile = profile or load_profile()
+    embeddings = fake_embeddings(profile)
+    ModelLoader._load_provider_llm = lambda self, provider_key, json_mode=False: fake_llm(provider_key, profile)
+    ModelLoader.load_embeddings = lambda self: embeddings
+
+
+install()
+from api.main import app  # noqa: E402  (served with the fakes installed)
@@ -0,0 +1,49 @@
+"""
+Import-time budget for the API cold start.
+
+Usage:
+    python -m benchmarks.import_budget --runs 5 --budget 1.0
+
+Imports `api.main` in fresh interpreters, reports the median wall-clock import time and
+the heavy libraries that got pulled in, and exits non-zero if the budget is exceeded
+or a lazily imported library was loaded eagerly.
+"""
+import argparse
+import json
+import statistics
+import subprocess
+import sys
+
+HEAVY = ("langchain_google_genai", "langchain_groq", "langchain_community", "faiss", "fitz", "pandas")
+
+PROBE = (
+    "import json, sys, time; t = time.perf_counter(); import api.main; "
+    "print(json.dumps({'seconds': time.perf_counter() - t, "
+    f"'heavy': [m for m in {HEAVY!r} if m in sys.modules]}}))"
+)
+
+
+def measure(runs: int):
+    results = []
+    for _ in range(runs):
+        out = subprocess.run([sys.executable, "-c", PROBE], capture_output=True, text=True, check=True)
+        results.append(json.loads(out.stdout.strip().splitlines()[-1]))
+    return results
+
+
+def main():
+    ap = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    ap.add_argument("--runs", type=int, default=5)
+    ap.add_argument("--budget", type=float, default=1.0, help="Max median import time in seconds")
+    args = ap.parse_args()
+
+    results = measure(args.runs)
+    median = statistics.median(r["seconds"] for r in results)
+    heavy = sorted({m for r in results for m in r["heavy"]})
+    print(f"api.main import: median {median:.3f}s over {args.runs} runs (budget {args.budget:.3f}s)")
+    print(f"eagerly imported heavy modules: {heavy or 'none'}")
+    sys.exit(0 if median <= args.budget and not heavy else 1)
+
+
+if __name__ == "__main__":
+    main()
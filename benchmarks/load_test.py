@@ -0,0 +1,331 @@
+"""
+End-to-end load test of the API with fake LLM / embedding providers (no network, no keys).
+
+Usage:
+    python -m benchmarks.load_test --workers 2 --concurrency 1,4,16,32 --duration 30
+    python -m benchmarks.load_test --mix analyze=1,chat_query=4 --profile profile.json --out load_test_results.jsonl
+
+Starts `uvicorn benchmarks.fake_providers:app` in a scratch directory, then drives a weighted
+mix of /analyze, /compare, /chat/index and /chat/query at each concurrency level for
+`--duration` seconds (closed loop: every client sends its next request when the previous one
+returns). Per level it reports throughput, p50/p95/p99 latency and error rate per endpoint,
+plus CPU and peak RSS per uvicorn worker. Each run is appended as one JSON line to `--out`
+(with the git commit), so capacity can be compared across changes.
+
+Provider latency comes from benchmarks.fake_providers.DEFAULT_PROFILE; `--profile` is a JSON
+file overriding its sections (e.g. {"llm": {"groq": {"ttft_median": 1.2}}}).
+"""
+import argparse
+import asyncio
+import json
+import math
+import os
+import random
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import uuid
+from datetime import datetime, timezone
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Tuple
+
+import httpx
+
+ROOT = Path(__file__).resolve().parent.parent
+ENDPOINTS = ("analyze", "compare", "chat_index", "chat_query")
+DEFAULT_MIX = "analyze=2,compare=1,chat_index=1,chat_query=6"
+
+PARAGRAPH = ("Retrieval augmented generation combines a vector index over document chunks with a "
+             "language model that answers from the retrieved context. ")
+
+
+# ---------- Fixtures ----------
+def make_pdf(pages: int, variant: str = "") -> bytes:
+    import fitz  # PyMuPDF
+
+    doc = fitz.open()
+    for p in range(pages):
+        page = doc.new_page()
+        page.insert_textbox(fitz.Rect(50, 50, 550, 800), f"Page {p + 1} {variant}\n" + PARAGRAPH * 12, fontsize=9)
+    data = doc.tobytes()
+    doc.close()
+    return data
+
+
+def make_fixtures(pages: int, chat_paragraphs: int) -> Dict[str, bytes]:
+    return {
+        "pdf": make_pdf(pages),
+        "pdf_v2": make_pdf(pages, variant="(revised)"),
+        "txt": "\n\n".join(f"Section {i}. " + PARAGRAPH * 6 for i in range(chat_paragraphs)).encode("utf-8"),
+    }
+
+
+# ---------- Server ----------
+def _free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def start_server(workers: int, port: int, workdir: Path, profile: Optional[Dict[str, Any]]) -> subprocess.Popen:
+    env = {
+        **os.environ,
+        "PYTHONPATH": os.pathsep.join([str(ROOT), os.environ.get("PYTHONPATH", "")]),
+        "GROQ_API_KEY": os.environ.get("GROQ_API_KEY", "loadtest"),
+        "GOOGLE_API_KEY": os.environ.get("GOOGLE_API_KEY", "loadtest"),
+        "UPLOAD_BASE": str(workdir / "data"),
+        "FAISS_BASE": str(workdir / "faiss_index"),
+        "SESSION_CATALOG_PATH": str(workdir / "session_catalog.db"),
+        "LLM_USAGE_DB_PATH": str(workdir / "llm_usage.db"),
+        "LOADTEST_PROFILE": json.dumps(profile or {}),
+    }
+    cmd = [sys.executable, "-m", "uvicorn", "benchmarks.fake_providers:app", "--host", "127.0.0.1",
+           "--port", str(port), "--workers", str(workers), "--log-level", "warning"]
+    return subprocess.Popen(cmd, cwd=workdir, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE)
+
+
+def wait_ready(base_url: str, proc: subprocess.Popen, timeout: float = 60):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if proc.poll() is not None:
+            raise RuntimeError(f"server exited: {proc.stderr.read().decode(errors='replace')[-2000:]}")
+        try:
+            if httpx.get(f"{base_url}/health", timeout=1).status_code == 200:
+                return
+        except httpx.HTTPError:
+            pass
+        time.sleep(0.2)
+    raise TimeoutError(f"server not ready after {timeout}s")
+
+
+# ---------- Worker CPU / RSS ----------
+def _children(pid: int) -> List[int]:
+    """uvicorn worker pids (children of the server, minus multiprocessing's resource tracker)."""
+    try:
+        import psutil
+        kids = [(c.pid, " ".join(c.cmdline())) for c in psutil.Process(pid).children()]
+    except ImportError:
+        kids = []
+        for stat in Path("/proc").glob("[0-9]*/stat"):
+            try:
+                if int(stat.read_text().rsplit(")", 1)[1].split()[1]) == pid:
+                    kids.append((int(stat.parent.name), (stat.parent / "cmdline").read_text().replace("\0", " ")))
+            except (OSError, IndexError, ValueError):
+                continue
+    return [k for k, cmdline in kids if "resource_tracker" not in cmdline]
+
+
+def _cpu_rss(pid: int) -> Tuple[float, int]:
+    """(CPU seconds used, RSS bytes) of one process."""
+    try:
+        import psutil
+        p = psutil.Process(pid)
+        t = p.cpu_times()
+        return t.user + t.system, p.memory_info().rss
+    except ImportError:
+        fields = Path(f"/proc/{pid}/stat").read_text().rsplit(")", 1)[1].split()
+        ticks = os.sysconf("SC_CLK_TCK")
+        rss_pages = int(Path(f"/proc/{pid}/statm").read_text().split()[1])
+        return (int(fields[11]) + int(fields[12])) / ticks, rss_pages * os.sysconf("SC_PAGE_SIZE")
+
+
+class ResourceSampler(threading.Thread):
+    """Samples CPU time and RSS of the uvicorn workers (children of the server process)."""
+    def __init__(self, server_pid: int, interval: float = 0.5):
+        super().__init__(daemon=True)
+        self.server_pid = server_pid
+        self.interval = interval
+        self._stop_event = threading.Event()
+        self.start_cpu: Dict[int, float] = {}
+        self.last_cpu: Dict[int, float] = {}
+        self.peak_rss: Dict[int, int] = {}
+
+    def _sample(self):
+        for pid in _children(self.server_pid) or [self.server_pid]:
+            try:
+                cpu, rss = _cpu_rss(pid)
+            except (FileNotFoundError, ProcessLookupError):
+                continue
+            self.start_cpu.setdefault(pid, cpu)
+            self.last_cpu[pid] = cpu
+            self.peak_rss[pid] = max(rss, self.peak_rss.get(pid, 0))
+
+    def run(self):
+        while not self._stop_event.is_set():
+            self._sample()
+            self._stop_event.wait(self.interval)
+
+    def stop(self, elapsed: float) -> List[Dict[str, Any]]:
+        self._stop_event.set()
+        self.join()
+        self._sample()
+        return [{"pid": pid,
+                 "cpu_percent": round(100 * (self.last_cpu[pid] - self.start_cpu[pid]) / max(elapsed, 1e-9), 1),
+                 "peak_rss_mb": round(self.peak_rss[pid] / 2**20, 1)}
+                for pid in sorted(self.last_cpu)]
+
+
+# ---------- Traffic ----------
+class Traffic:
+    """Builds one request per endpoint; chat queries go to sessions indexed during setup."""
+    def __init__(self, client: httpx.AsyncClient, fixtures: Dict[str, bytes], sessions: List[str]):
+        self.client = client
+        self.fixtures = fixtures
+        self.sessions = sessions
+
+    async def analyze(self):
+        return await self.client.post("/analyze", files={"file": ("doc.pdf", self.fixtures["pdf"], "application/pdf")})
+
+    async def compare(self):
+        return await self.client.post("/compare", files={
+            "reference": ("v1.pdf", self.fixtures["pdf"], "application/pdf"),
+            "actual": ("v2.pdf", self.fixtures["pdf_v2"], "application/pdf"),
+        })
+
+    async def chat_index(self, session_id: Optional[str] = None):
+        return await self.client.post("/chat/index", files=[("files", ("notes.txt", self.fixtures["txt"], "text/plain"))],
+                                      data={"session_id": session_id or f"load_{uuid.uuid4().hex[:10]}"})
+
+    async def chat_query(self):
+        return await self.client.post("/chat/query", data={
+            "question": f"What does section {random.randrange(100)} say about retrieval?",
+            "session_id": random.choice(self.sessions)})
+
+
+def percentile(values: List[float], q: float) -> Optional[float]:
+    if not values:
+        return None
+    ordered = sorted(values)
+    return ordered[max(0, math.ceil(q / 100 * len(ordered)) - 1)]  # nearest rank
+
+
+def summarize(samples: List[Tuple[str, float, int]], elapsed: float) -> Dict[str, Any]:
+    """Throughput, latency percentiles (ms) and error rate, overall and per endpoint."""
+    def stats(rows):
+        latencies = [lat for _, lat, _ in rows]
+        errors = sum(status >= 400 or status == 0 for _, _, status in rows)
+        return {
+            "requests": len(rows), "throughput_rps": round(len(rows) / max(elapsed, 1e-9), 2),
+            "error_rate": round(errors / len(rows), 4) if rows else 0.0,
+            **{f"p{q}_ms": None if percentile(latencies, q) is None else round(percentile(latencies, q) * 1000, 1)
+               for q in (50, 95, 99)},
+        }
+
+    by_endpoint = {name: stats([s for s in samples if s[0] == name]) for name in ENDPOINTS
+                   if any(s[0] == name for s in samples)}
+    return {"overall": stats(samples), "endpoints": by_endpoint}
+
+
+async def run_level(base_url: str, traffic_args, mix: Dict[str, float], concurrency: int,
+                    duration: float) -> List[Tuple[str, float, int]]:
+    samples: List[Tuple[str, float, int]] = []
+    names, weights = list(mix), list(mix.values())
+    limits = httpx.Limits(max_connections=concurrency, max_keepalive_connections=concurrency)
+    async with httpx.AsyncClient(base_url=base_url, timeout=300, limits=limits) as client:
+        traffic = Traffic(client, *traffic_args)
+        deadline = time.monotonic() + duration
+
+        async def user():
+            while time.monotonic() < deadline:
+                name = random.choices(names, weights)[0]
+                start = time.perf_counter()
+                try:
+                    status = (await getattr(traffic, name)()).status_code
+                except httpx.HTTPError:
+                    status = 0
+                samples.append((name, time.perf_counter() - start, status))
+
+        await asyncio.gather(*(user() for _ in range(concurrency)))
+    return samples
+
+
+async def setup_sessions(base_url: str, fixtures: Dict[str, bytes], count: int) -> List[str]:
+    async with httpx.AsyncClient(base_url=base_url, timeout=300) as client:
+        traffic = Traffic(client, fixtures, [])
+        sessions = [f"load_query_{i}" for i in range(count)]
+        for s in sessions:
+            r = await traffic.chat_index(s)
+            r.raise_for_status()
+    return sessions
+
+
+def parse_mix(spec: str) -> Dict[str, float]:
+    mix = {}
+    for part in spec.split(","):
+        name, _, weight = part.partition("=")
+        if name.strip() not in ENDPOINTS:
+            raise ValueError(f"unknown endpoint {name!r}; choose from {ENDPOINTS}")
+        mix[name.strip()] = float(weight or 1)
+    return mix
+
+
+def _git_commit() -> Optional[str]:
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=ROOT, capture_output=True,
+                              text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def main():
+    ap = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    ap.add_argument("--workers", type=int, default=2, help="uvicorn worker processes")
+    ap.add_argument("--concurrency", default="1,4,16", help="comma-separated client counts, run in order")
+    ap.add_argument("--duration", type=float, default=30, help="seconds per concurrency level")
+    ap.add_argument("--mix", default=DEFAULT_MIX, help="endpoint=weight list")
+    ap.add_argument("--pages", type=int, default=5, help="pages per PDF upload")
+    ap.add_argument("--chat-paragraphs", type=int, default=200, help="paragraphs in the chat ingestion upload")
+    ap.add_argument("--query-sessions", type=int, default=4, help="sessions indexed up front for /chat/query")
+    ap.add_argument("--profile", help="JSON file overriding the fake provider latency profile")
+    ap.add_argument("--out", default="load_test_results.jsonl", help="results file (one JSON line appended per run)")
+    args = ap.parse_args()
+
+    mix = parse_mix(args.mix)
+    levels = [int(c) for c in args.concurrency.split(",")]
+    profile = json.loads(Path(args.profile).read_text()) if args.profile else None
+    fixtures = make_fixtures(args.pages, args.chat_paragraphs)
+    port = _free_port()
+    base_url = f"http://127.0.0.1:{port}"
+
+    with tempfile.TemporaryDirectory(prefix="docportal-load-") as tmp:
+        proc = start_server(args.workers, port, Path(tmp), profile)
+        try:
+            wait_ready(base_url, proc)
+            sessions = asyncio.run(setup_sessions(base_url, fixtures, args.query_sessions))
+            results = []
+            for concurrency in levels:
+                sampler = ResourceSampler(proc.pid)
+                sampler.start()
+                start = time.perf_counter()
+                samples = asyncio.run(run_level(base_url, (fixtures, sessions), mix, concurrency, args.duration))
+                elapsed = time.perf_counter() - start
+                level = {"concurrency": concurrency, "seconds": round(elapsed, 2),
+                         **summarize(samples, elapsed), "workers": sampler.stop(elapsed)}
+                results.append(level)
+                o = level["overall"]
+                print(f"c={concurrency:>4}  {o['throughput_rps']:>8.2f} req/s  p50 {o['p50_ms']} ms  "
+                      f"p95 {o['p95_ms']} ms  p99 {o['p99_ms']} ms  errors {o['error_rate']:.2%}  "
+                      f"cpu {[w['cpu_percent'] for w in level['workers']]}%  "
+                      f"rss {[w['peak_rss_mb'] for w in level['workers']]} MB")
+        finally:
+            proc.terminate()
+            try:
+                proc.wait(timeout=15)
+            except subprocess.TimeoutExpired:
+                proc.kill()
+
+    record = {
+        "timestamp": datetime.now(timezone.utc).isoformat(timespec="seconds"), "commit": _git_commit(),
+        "workers": args.workers, "duration": args.duration, "mix": mix, "pages": args.pages,
+        "profile": profile, "levels": results,
+    }
+    with open(args.out, "a", encoding="utf-8") as fh:
+        fh.write(json.dumps(record) + "\n")
+    print(f"results appended to {args.out}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,75 @@
+"""
+Recall-vs-size report for FAISS vector storage settings.
+
+Usage:
+    python -m benchmarks.vector_storage_report --index faiss_index/<session_id>
+    python -m benchmarks.vector_storage_report --synthetic 20000 --dim 768 --out storage_report.json
+
+Vectors come from an existing (float32) session index or a synthetic clustered corpus.
+Queries are perturbed copies of sampled vectors, so recall@k is measured against exact search.
+"""
+import argparse
+import json
+from pathlib import Path
+
+import faiss
+import numpy as np
+
+from utils.faiss_storage import VectorStorageSpec, recall_size_report
+from utils.index_generations import IndexGenerations
+
+DEFAULT_SPECS = [
+    VectorStorageSpec(codec="flat"),
+    VectorStorageSpec(codec="fp16"),
+    VectorStorageSpec(codec="sq8"),
+    VectorStorageSpec(codec="pq", pq_m=64),
+    VectorStorageSpec(codec="pq", pq_m=32),
+    VectorStorageSpec(codec="fp16", reduce="truncate", target_dim=256),
+    VectorStorageSpec(codec="sq8", reduce="pca", target_dim=256),
+    VectorStorageSpec(codec="sq8", reduce="pca", target_dim=128),
+]
+
+
+def load_index_vectors(index_dir: str, index_name: str = "index") -> np.ndarray:
+    gen = IndexGenerations(index_dir, index_name).current()
+    if gen is None:
+        raise SystemExit(f"No FAISS index in {index_dir}")
+    index = faiss.read_index(str(Path(index_dir) / f"{gen.prefix}.faiss"))
+    return index.reconstruct_n(0, index.ntotal)
+
+
+def synthetic_vectors(n: int, dim: int, clusters: int = 64, seed: int = 0) -> np.ndarray:
+    rng = np.random.default_rng(seed)
+    centers = rng.normal(size=(clusters, dim))
+    x = centers[rng.integers(0, clusters, n)] + 0.3 * rng.normal(size=(n, dim))
+    return x.astype(np.float32)
+
+
+def main():
+    ap = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    ap.add_argument("--index", help="Existing float32 session index directory")
+    ap.add_argument("--synthetic", type=int, default=10000, help="Synthetic vector count when --index is not given")
+    ap.add_argument("--dim", type=int, default=768)
+    ap.add_argument("--queries", type=int, default=200)
+    ap.add_argument("--k", type=int, default=10)
+    ap.add_argument("--out", default="storage_report.json")
+    args = ap.parse_args()
+
+    vectors = load_index_vectors(args.index) if args.index else synthetic_vectors(args.synthetic, args.dim)
+    rng = np.random.default_rng(1)
+    sample = vectors[rng.choice(len(vectors), size=min(args.queries, len(vectors)), replace=False)]
+    queries = sample + 0.05 * rng.normal(size=sample.shape).astype(np.float32)
+
+    rows = recall_size_report(vectors, queries, DEFAULT_SPECS, k=args.k)
+
+    print(f"{'storage':<22}{'bytes/vec':>12}{'compression':>13}{f'recall@{args.k}':>12}")
+    for r in rows:
+        print(f"{r['storage']:<22}{r['bytes_per_vector']:>12}{r['compression']:>13}{r[f'recall@{args.k}']:>12}")
+
+    Path(args.out).write_text(json.dumps({"vectors": len(vectors), "dim": int(vectors.shape[1]), "rows": rows}, indent=2),
+                              encoding="utf-8")
+    print(f"Report written to {args.out}")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,13 +1,157 @@
 import os
-import logging 
+import sys
+import queue
+import atexit
+import random
+import logging
+import logging.handlers
 from datetime import datetime
+from typing import Any, Dict, Optional
 import structlog
 
-class CustomLogger: 
-    def __init__(self, log_dir="logs"):
-        """Initialize the CustomLogger with a specified log directory."""
+# ---------- Pipeline settings (env overridable, changeable at runtime) ----------
+_LEVELS = {"debug": logging.DEBUG, "info": logging.INFO, "warning": logging.WARNING,
+           "error": logging.ERROR, "critical": logging.CRITICAL, "exception": logging.ERROR}
+
+_settings: Dict[str, Any] = {
+    "level": _LEVELS.get(os.getenv("LOG_LEVEL", "info").lower(), logging.INFO),
+    "max_field_chars": int(os.getenv("LOG_MAX_FIELD_CHARS", "1000")),
+    "max_items": int(os.getenv("LOG_MAX_ITEMS", "50")),
+    "queue_size": int(os.getenv("LOG_QUEUE_SIZE", "10000")),
+    # event name -> fraction of events kept (warnings and errors are never sampled)
+    "sampling": {},
+}
+_dropped = {"queue_full": 0}
+_listener: Optional[logging.handlers.QueueListener] = None
+
+
+def set_level(level: str):
+    """Change the minimum log level at runtime (debug|info|warning|error|critical)."""
+    value = _LEVELS.get(level.lower())
+    if value is None:
+        raise ValueError(f"Unknown log level: {level}")
+    _settings["level"] = value
+    logging.getLogger().setLevel(value)
+
+
+def get_level() -> str:
+    return logging.getLevelName(_settings["level"]).lower()
+
+
+def set_sampling(event: str, rate: float):
+    """Keep only `rate` (0..1) of the info/debug events named `event`; rate 1 disables sampling."""
+    if rate >= 1:
+        _settings["sampling"].pop(event, None)
+    else:
+        _settings["sampling"][event] = max(0.0, float(rate))
+
+
+def pipeline_stats() -> Dict[str, Any]:
+    return {"level": get_level(), "sampling": dict(_settings["sampling"]), "dropped": dict(_dropped),
+            "queue_size": _settings["queue_size"]}
+
+
+# ---------- Request-thread processors (cheap: filter, sample, bound) ----------
+def _filter_level(_, method_name, event_dict):
+    if _LEVELS.get(method_name, logging.INFO) < _settings["level"]:
+        raise structlog.DropEvent
+    return event_dict
+
+
+def _sample(_, method_name, event_dict):
+    rate = _settings["sampling"].get(event_dict.get("event"))
+    if rate is not None and _LEVELS.get(method_name, logging.INFO) < logging.WARNING and random.random() >= rate:
+        raise structlog.DropEvent
+    return event_dict
+
+
+def _bound(value: Any) -> Any:
+    limit = _settings["max_field_chars"]
+    if value is None or isinstance(value, (bool, int, float)):
+        return value
+    if isinstance(value, str):
+        return value if len(value) <= limit else f"{value[:limit]}...(+{len(value) - limit} chars)"
+    if isinstance(value, (bytes, bytearray)):
+        return f"<{len(value)} bytes>"
+    if hasattr(value, "shape"):
+        # DataFrames / arrays: log the shape, never the full repr
+        return f"<{type(value).__name__} shape={tuple(value.shape)}>"
+    if isinstance(value, (list, tuple, set)):
+        items = list(value)
+        out = [_bound(v) for v in items[:_settings["max_items"]]]
+        if len(items) > _settings["max_items"]:
+            out.append(f"...(+{len(items) - _settings['max_items']} items)")
+        return out
+    if isinstance(value, dict):
+        keys = list(value)[:_settings["max_items"]]
+        out = {str(k): _bound(value[k]) for k in keys}
+        if len(value) > len(keys):
+            out["..."] = f"+{len(value) - len(keys)} keys"
+        return out
+    return _bound(repr(value))
+
+
+def _bound_fields(_, __, event_dict):
+    return {k: (v if k in ("exc_info", "exception") else _bound(v)) for k, v in event_dict.items()}
+
+
+# ---------- Non-blocking queue handler ----------
+class _NonBlockingQueueHandler(logging.handlers.QueueHandler):
+    """Hands records to the writer thread as-is; drops (and counts) instead of blocking when full."""
+    def prepare(self, record):
+        return record
+
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            _dropped["queue_full"] += 1
+
+
+def _start_pipeline(log_file_path: str):
+    """Route the root logger through a bounded queue; JSON rendering happens on the writer thread."""
+    global _listener
+    if _listener is not None:
+        return
+
+    formatter = structlog.stdlib.ProcessorFormatter(
+        processors=[
+            structlog.stdlib.ProcessorFormatter.remove_processors_meta,
+            structlog.processors.JSONRenderer(),
+        ],
+    )
+
+    # file handle
+    file_handler = logging.FileHandler(log_file_path)
+    file_handler.setFormatter(formatter)  # Raw JSON lines
+
+    # Console handler
+    console_handler = logging.StreamHandler(sys.stderr)
+    console_handler.setFormatter(formatter)
+
+    log_queue: queue.Queue = queue.Queue(maxsize=_settings["queue_size"])
+    root = logging.getLogger()
+    root.handlers = [_NonBlockingQueueHandler(log_queue)]
+    root.setLevel(_settings["level"])
+
+    _listener = logging.handlers.QueueListener(log_queue, console_handler, file_handler, respect_handler_level=False)
+    _listener.start()
+    atexit.register(stop_pipeline)
+
+
+def stop_pipeline():
+    """Flush queued records and stop the writer thread."""
+    global _listener
+    if _listener is not None:
+        _listener.stop()
+        _listener = None
+
+
+class CustomLogger:
+    def __init__(self, log_dir=None):
+        """Initialize the CustomLogger with a specified log directory (default: $LOG_DIR or ./logs)."""
         # Ensure logs directory exists
-        self.logs_dir = os.path.join(os.getcwd(), log_dir)
+        self.logs_dir = os.path.join(os.getcwd(), log_dir or os.getenv("LOG_DIR", "logs"))
         os.makedirs(self.logs_dir, exist_ok=True)
 
         # Timestamped log file (for persistence)
@@ -18,30 +162,21 @@ class CustomLogger:
     def get_logger(self, name=__file__):
         logger_name = os.path.basename(name)
 
-        # file handle
-        file_handler = logging.FileHandler(self.log_file_path)
-        file_handler.setLevel(logging.INFO)
-        file_handler.setFormatter(logging.Formatter("%(message)s"))  # Raw JSON lines
-
-        # Console handler
-        console_handler = logging.StreamHandler()
-        console_handler.setLevel(logging.INFO)
-        console_handler.setFormatter(logging.Formatter("%(message)s"))
-
-        logging.basicConfig(
-            level=logging.INFO,
-            format="%(message)s",  # Structlog will handle JSON rendering
-            handlers=[console_handler, file_handler]
-        )
+        _start_pipeline(self.log_file_path)
 
-        # Configure structlog for JSON structured logging
+        # Configure structlog: filtering, sampling, timestamping and truncation run on the caller;
+        # JSON rendering and file/console I/O run on the background writer thread.
         structlog.configure(
             processors=[
+                _filter_level,
+                _sample,
                 structlog.processors.TimeStamper(fmt="iso", utc=True, key="timestamp"),
                 structlog.stdlib.add_logger_name,
                 structlog.processors.add_log_level,
+                structlog.processors.format_exc_info,
+                _bound_fields,
                 structlog.processors.EventRenamer(to="event"),
-                structlog.processors.JSONRenderer()
+                structlog.stdlib.ProcessorFormatter.wrap_for_formatter,
             ],
             logger_factory=structlog.stdlib.LoggerFactory(),
             cache_logger_on_first_use=True,
@@ -52,6 +187,6 @@ class CustomLogger:
 
 # --- Usage Example ---
 if __name__ == "__main__":
-    logger = CustomLogger().get_logger(__file__) 
+    logger = CustomLogger().get_logger(__file__)
     logger.info("User uploaded a file", user_id=123, filename="report.pdf")
     logger.error("Failed to process PDF", error="File not found", user_id=123)
@@ -1,5 +1,5 @@
-from pydantic import BaseModel, RootModel
-from typing import List, Union
+from pydantic import BaseModel, RootModel, Field
+from typing import List, Optional, Union
 from enum import Enum
 
 ## Document analysis
@@ -14,6 +14,11 @@ class Metadata(BaseModel):
     PageCount: Union[int, str]  
     SentimentTone: str
 
+class DocumentSummary(BaseModel):
+    """The part of Metadata asked of the LLM; the rest is read from the PDF itself."""
+    Summary: List[str]
+    SentimentTone: str
+
 ## Document comparison
 class ChangeFormat(BaseModel):
     Page: str
@@ -23,6 +28,15 @@ class ChangeFormat(BaseModel):
 class SummaryResponse(RootModel[list[ChangeFormat]]):
     pass
 
+## Chat batch query
+class BatchQueryRequest(BaseModel):
+    questions: List[str] = Field(..., min_length=1)
+    session_id: Optional[str] = None
+    use_session_dirs: bool = True
+    k: Optional[int] = None
+    max_concurrency: Optional[int] = None
+    stream: bool = False
+
 class PromptType(str, Enum):
     DOCUMENT_ANALYSIS = "document_analysis"
     DOCUMENT_COMPARISON = "document_comparison"
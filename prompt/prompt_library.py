@@ -7,7 +7,8 @@ Return ONLY valid JSON matching the exact schema provided below.
 
 {format_instructions}
 
-Analyze this document:
+Summarize this document and describe its overall sentiment/tone. Long documents are
+given as their beginning followed by excerpts separated by [...]:
 {document_text}                                                            
 """)
 
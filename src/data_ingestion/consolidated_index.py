@@ -0,0 +1,436 @@
+from __future__ import annotations
+import hashlib
+import json
+import os
+import pickle
+import threading
+import uuid
+import zlib
+from collections import OrderedDict
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+
+import faiss
+import numpy as np
+from langchain.schema import Document
+from langchain_core.callbacks import CallbackManagerForRetrieverRun
+from langchain_core.embeddings import Embeddings
+from langchain_core.retrievers import BaseRetriever
+
+from logger import GLOBAL_LOGGER as log
+from exception.custom_exception import CustomException
+from utils.faiss_storage import VectorStorageSpec
+from utils.index_generations import folder_lock
+from utils.metrics import stage
+
+CONSOLIDATED_DIR = "_consolidated"
+STORAGE_MODES = {"session", "consolidated"}
+
+
+# ---------- Segment (one FAISS index + docstore + session ID-range map) ----------
+def _replace_file(path: Path, data: bytes):
+    tmp = path.with_name(f".tmp-{uuid.uuid4().hex}")
+    tmp.write_bytes(data)
+    os.replace(tmp, path)
+
+
+class _Segment:
+    """
+    In-process copy of one segment of a shard. A shard's appends go to its newest segment
+    until that holds `segment_max_vectors`, so a save rewrites at most one bounded segment.
+    The session map loads eagerly; the index and docstore only once a search or write needs
+    them. `lock` serializes this process's threads; `writing()` also holds the segment's
+    cross-process flock and starts from the latest state on disk.
+    """
+    def __init__(self, segment_dir: Path):
+        self.dir = segment_dir
+        self.dir.mkdir(parents=True, exist_ok=True)
+        self.index_path = self.dir / "index.faiss"
+        self.docs_path = self.dir / "docstore.pkl"
+        self.map_path = self.dir / "sessions.json"
+        self.lock = threading.RLock()
+        self.index = None
+        self.docs: Dict[int, Document] = {}
+        self.sessions: Dict[str, Dict[str, Any]] = {}
+        self.next_id = 0
+        self.stamp: Optional[Tuple[int, int]] = None
+        self.data_stamp: Optional[Tuple[int, int]] = None  # map stamp the loaded index/docstore belong to
+        self.reload()
+
+    def _disk_stamp(self) -> Optional[Tuple[int, int]]:
+        try:
+            st = self.map_path.stat()  # replaced on every save: a new inode
+            return st.st_ino, st.st_mtime_ns
+        except FileNotFoundError:
+            return None
+
+    def _load(self, data: bool):
+        stamp = self._disk_stamp()
+        if stamp is not None and stamp != self.stamp:
+            state = json.loads(self.map_path.read_text(encoding="utf-8"))
+            self.sessions = state.get("sessions", {})
+            self.next_id = int(state.get("next_id", 0))
+            self.stamp = stamp
+        if data and self.stamp is not None and self.data_stamp != self.stamp:
+            self.index = faiss.read_index(str(self.index_path)) if self.index_path.exists() else None
+            self.docs = pickle.loads(self.docs_path.read_bytes()) if self.docs_path.exists() else {}
+            self.data_stamp = self.stamp
+            log.info("Consolidated segment loaded", segment=str(self.dir), sessions=len(self.sessions),
+                     vectors=self.size())
+
+    def reload(self, data: bool = False):
+        """(Re)load from disk if another worker wrote the segment since we last read it."""
+        with self.lock:
+            if self._disk_stamp() == self.stamp and (not data or self.data_stamp == self.stamp):
+                return
+            with folder_lock(self.dir, shared=True):  # not while a writer is mid-save
+                self._load(data)
+
+    @contextmanager
+    def writing(self) -> Iterator["_Segment"]:
+        """Reload -> modify -> save under the segment's cross-process write lock."""
+        with self.lock, folder_lock(self.dir):
+            self._load(data=True)
+            yield self
+
+    def save(self):
+        """Write the segment (caller holds `writing()`); the session map goes last."""
+        if self.index is not None:
+            _replace_file(self.index_path, faiss.serialize_index(self.index).tobytes())
+        _replace_file(self.docs_path, pickle.dumps(self.docs))
+        _replace_file(self.map_path, json.dumps({"next_id": self.next_id, "sessions": self.sessions}).encode("utf-8"))
+        self.stamp = self.data_stamp = self._disk_stamp()
+
+    def ranges(self, session_id: str) -> List[Tuple[int, int]]:
+        return [tuple(r) for r in self.sessions.get(session_id, {}).get("ranges", [])]
+
+    def pending(self, session_id: str) -> List[Tuple[int, int]]:
+        return [tuple(r) for r in self.sessions.get(session_id, {}).get("pending", [])]
+
+    def size(self) -> int:
+        """Vectors held by the segment, published or pending."""
+        return sum(end - start for entry in self.sessions.values()
+                   for start, end in entry.get("ranges", []) + entry.get("pending", []))
+
+
+def _add_range(ranges: List[List[int]], start: int, end: int):
+    if ranges and ranges[-1][1] == start:
+        ranges[-1][1] = end  # consecutive batches extend one range
+    else:
+        ranges.append([start, end])
+
+
+# ---------- Session-scoped retriever ----------
+class SessionScopedRetriever(BaseRetriever):
+    """Retriever over one session's vectors inside a consolidated store."""
+    store: Any
+    session_id: str
+    k: int = 5
+
+    def _get_relevant_documents(self, query: str, *, run_manager: CallbackManagerForRetrieverRun) -> List[Document]:
+        return [doc for doc, _ in self.store.similarity_search_with_score(self.session_id, query, k=self.k)]
+
+    @property
+    def embeddings(self) -> Embeddings:
+        return self.store.emb
+
+    def search_by_vectors(self, vectors, k: Optional[int] = None) -> List[List[Document]]:
+        rows = self.store.search_by_vectors(self.session_id, vectors, k=k or self.k)
+        return [[doc for doc, _ in row] for row in rows]
+
+
+# ---------- Consolidated store ----------
+class ConsolidatedFaissStore:
+    """
+    One sharded FAISS index per node instead of one directory per session.
+
+    Every chunk gets an explicit vector ID; each session owns a list of contiguous ID ranges
+    (one per ingestion call) and carries its session_id in document metadata. Searches pass an
+    ID selector built from those ranges, so only the session's own vectors are scored.
+    Streaming ingestion appends each batch under a pending range (`append_pending`) that
+    searches and dedup ignore until `publish`; `discard` drops it after a failed ingestion.
+    A worker that dies in between leaves its pending vectors unsearchable until the session
+    is removed.
+    A shard is a series of size-capped segments (`shard_NN/seg_NNN`), written one at a time
+    under the shard's lock. Loaded segments are kept in process memory (LRU, up to
+    `max_cached_segments`) and shared by all requests.
+    """
+    _segments: "OrderedDict[str, _Segment]" = OrderedDict()
+    _segments_lock = threading.Lock()
+
+    def __init__(self, base_dir: Path, embeddings: Embeddings, num_shards: int = 8,
+                 storage: Optional[VectorStorageSpec] = None, segment_max_vectors: int = 50000,
+                 max_cached_segments: int = 64):
+        self.base_dir = Path(base_dir)
+        self.base_dir.mkdir(parents=True, exist_ok=True)
+        self.emb = embeddings
+        self.num_shards = max(1, int(num_shards))
+        self.storage = storage or VectorStorageSpec()
+        self.segment_max_vectors = max(1, int(segment_max_vectors))
+        self.max_cached_segments = max(1, int(max_cached_segments))
+
+    def shard_for(self, session_id: str) -> int:
+        return zlib.crc32(session_id.encode("utf-8")) % self.num_shards
+
+    def _shard_dir(self, session_id: str) -> Path:
+        return self.base_dir / f"shard_{self.shard_for(session_id):02d}"
+
+    def _segment(self, segment_dir: Path) -> _Segment:
+        key = str(segment_dir.resolve())
+        with self._segments_lock:
+            segment = self._segments.pop(key, None)
+            if segment is None:
+                segment = _Segment(segment_dir)
+            self._segments[key] = segment  # most recently used last
+            while len(self._segments) > self.max_cached_segments:
+                self._segments.popitem(last=False)
+        segment.reload()
+        return segment
+
+    def _shard_segments(self, session_id: str) -> List[_Segment]:
+        """Every segment of the session's shard, oldest first (zero-padded names sort by age)."""
+        dirs = sorted(self._shard_dir(session_id).glob("seg_*"))
+        return [self._segment(d) for d in dirs if d.is_dir()]
+
+    def _session_segments(self, session_id: str) -> List[_Segment]:
+        return [seg for seg in self._shard_segments(session_id) if session_id in seg.sessions]
+
+    @contextmanager
+    def _appending(self, session_id: str) -> Iterator[Tuple[_Segment, set]]:
+        """
+        Shard write lock plus the segment new vectors go to (a new one when the newest is full)
+        and the session's rows across all segments, which no other writer can change meanwhile.
+        """
+        shard_dir = self._shard_dir(session_id)
+        with folder_lock(shard_dir):
+            segments = self._shard_segments(session_id)
+            rows = self._rows(session_id, segments)
+            if not segments or segments[-1].size() >= self.segment_max_vectors:
+                segments.append(self._segment(shard_dir / f"seg_{len(segments):03d}"))
+            # no _segment() lookups past this point: a cache miss on the segment being written
+            # would open a second copy and wait on this process's own flock
+            with segments[-1].writing() as segment:
+                yield segment, rows
+
+    def has_session(self, session_id: str) -> bool:
+        return any(seg.ranges(session_id) for seg in self._session_segments(session_id))
+
+    @staticmethod
+    def _fingerprint(doc: Document) -> str:
+        """Dedup key: source + row id, or source + content hash for chunks without a row id."""
+        md = doc.metadata or {}
+        rid = md.get("row_id")
+        if rid is None:
+            rid = hashlib.sha256(doc.page_content.encode("utf-8")).hexdigest()
+        return f"{md.get('source') or md.get('file_path')}::{rid}"
+
+    def _rows(self, session_id: str, segments: Optional[List[_Segment]] = None) -> set:
+        rows = set()
+        for seg in self._session_segments(session_id) if segments is None else segments:
+            with seg.lock:
+                rows.update(seg.sessions.get(session_id, {}).get("rows", {}))
+        return rows
+
+    def claim_new(self, session_id: str, docs: List[Document]) -> List[Document]:
+        """Return the chunks this session has not ingested yet (rows are marked when they are added)."""
+        rows = self._rows(session_id)
+        return [d for d in docs if self._fingerprint(d) not in rows]
+
+    def _append(self, segment: _Segment, session_id: str, docs: List[Document], vectors,
+                rows: set, pending: bool = False) -> Tuple[int, int]:
+        """
+        Add chunks not already in the session (`rows`) under a fresh ID range and mark their
+        rows, or, with `pending`, record the range for a later `publish`.
+        """
+        keep = [i for i, d in enumerate(docs) if self._fingerprint(d) not in rows]
+        start = segment.next_id
+        if not keep:
+            return start, start
+        entry = segment.sessions.setdefault(session_id, {"ranges": [], "rows": {}})
+        docs = [docs[i] for i in keep]
+        vectors = np.asarray(vectors, dtype=np.float32)[keep]
+        if segment.index is None:
+            segment.index = faiss.IndexIDMap2(self.storage.build_index(vectors))
+
+        ids = np.arange(start, start + len(docs), dtype=np.int64)
+        segment.index.add_with_ids(vectors, ids)
+        for i, d in zip(ids.tolist(), docs):
+            segment.docs[i] = Document(page_content=d.page_content,
+                                       metadata={**(d.metadata or {}), "session_id": session_id})
+            if not pending:
+                entry["rows"][self._fingerprint(d)] = True
+        if pending:
+            entry.setdefault("pending", []).append([start, start + len(docs)])  # kept apart per writer
+        else:
+            _add_range(entry["ranges"], start, start + len(docs))
+        segment.next_id = start + len(docs)
+        return start, start + len(docs)
+
+    def add_embedded(self, session_id: str, docs: List[Document], vectors) -> Tuple[int, int]:
+        """
+        Append already-embedded chunks to the session's shard under a fresh ID range, in one
+        reload -> append -> save of the shard's newest segment under the shard's write lock.
+        """
+        with self._appending(session_id) as (segment, rows):
+            id_range = self._append(segment, session_id, docs, vectors, rows)
+            if id_range[1] > id_range[0]:
+                with stage("faiss.write"):
+                    segment.save()
+        return id_range
+
+    def train_size(self, session_id: str, dim: int) -> int:
+        """Vectors to gather before the first append when it may have to train a new segment's codec."""
+        segments = self._shard_segments(session_id)
+        if segments and segments[-1].size() and segments[-1].size() < self.segment_max_vectors:
+            return 0
+        return self.storage.min_train_size(dim)
+
+    def append_pending(self, session_id: str, docs: List[Document], vectors) -> Optional[Tuple[str, int, int]]:
+        """Append embedded chunks under a pending ID range: (segment, start, end), or None if all were known."""
+        with self._appending(session_id) as (segment, rows):
+            start, end = self._append(segment, session_id, docs, vectors, rows, pending=True)
+            if end == start:
+                return None
+            with stage("faiss.write"):
+                segment.save()
+        return segment.dir.name, start, end
+
+    def _pending_by_segment(self, session_id: str, pending: List[Tuple[str, int, int]]):
+        """(segment, ranges) for each segment holding some of `pending`; caller holds the shard lock."""
+        segments = {seg.dir.name: seg for seg in self._shard_segments(session_id)}
+        for name in dict.fromkeys(name for name, _, _ in pending):
+            if name in segments:
+                yield segments[name], [[start, end] for n, start, end in pending if n == name]
+
+    def publish(self, session_id: str, pending: List[Tuple[str, int, int]]) -> int:
+        """
+        Make pending ranges searchable and mark their rows. Chunks that another ingestion of
+        the session published in the meantime are dropped instead. Returns the chunks published.
+        """
+        published = 0
+        with folder_lock(self._shard_dir(session_id)):
+            rows = self._rows(session_id, self._shard_segments(session_id))
+            for seg, ranges in list(self._pending_by_segment(session_id, pending)):
+                with seg.writing():
+                    entry = seg.sessions[session_id]
+                    dupes = []
+                    for start, end in ranges:
+                        entry["pending"].remove([start, end])
+                        for i in range(start, end):
+                            key = self._fingerprint(seg.docs[i])
+                            if key in rows:
+                                dupes.append(i)
+                                seg.docs.pop(i)
+                            else:
+                                rows.add(key)
+                                entry["rows"][key] = True
+                                published += 1
+                        _add_range(entry["ranges"], start, end)
+                    if dupes:
+                        seg.index.remove_ids(np.asarray(dupes, dtype=np.int64))
+                    seg.save()
+        return published
+
+    def discard(self, session_id: str, pending: List[Tuple[str, int, int]]) -> int:
+        """Remove pending ranges (a failed ingestion) from the shard. Returns the vectors removed."""
+        removed = 0
+        with folder_lock(self._shard_dir(session_id)):
+            for seg, ranges in list(self._pending_by_segment(session_id, pending)):
+                with seg.writing():
+                    entry = seg.sessions.get(session_id) or {}
+                    for start, end in ranges:
+                        if [start, end] in entry.get("pending", []):
+                            entry["pending"].remove([start, end])
+                            removed += seg.index.remove_ids(faiss.IDSelectorRange(start, end))
+                            for i in range(start, end):
+                                seg.docs.pop(i, None)
+                    if entry and not entry.get("ranges") and not entry.get("pending"):
+                        seg.sessions.pop(session_id, None)
+                    seg.save()
+        return removed
+
+    def add_documents(self, session_id: str, docs: List[Document]) -> int:
+        """Embed and append a session's new chunks to its shard under a fresh ID range."""
+        try:
+            new_docs = self.claim_new(session_id, docs)
+            if not new_docs:
+                return 0
+            with stage("faiss.embed"):
+                vectors = self.emb.embed_documents([d.page_content for d in new_docs])
+            start, end = self.add_embedded(session_id, new_docs, vectors)
+
+            log.info("Consolidated index updated", session_id=session_id, shard=self._shard_dir(session_id).name,
+                     added=end - start, id_range=[start, end])
+            return end - start
+
+        except Exception as e:
+            log.error("Failed to add documents to consolidated index", error=str(e), session_id=session_id)
+            raise CustomException("Failed to add documents to consolidated index", e) from e
+
+    def remove_session(self, session_id: str) -> int:
+        """Drop a session's vectors and documents from every segment of its shard that holds them."""
+        removed = 0
+        with folder_lock(self._shard_dir(session_id)):
+            for seg in self._session_segments(session_id):
+                with seg.writing():
+                    for start, end in seg.ranges(session_id) + seg.pending(session_id):
+                        removed += seg.index.remove_ids(faiss.IDSelectorRange(start, end))
+                        for i in range(start, end):
+                            seg.docs.pop(i, None)
+                    seg.sessions.pop(session_id, None)
+                    seg.save()
+        if removed:
+            log.info("Session removed from consolidated index", session_id=session_id, removed=removed)
+        return removed
+
+    def similarity_search_with_score(self, session_id: str, query: str, k: int = 5) -> List[Tuple[Document, float]]:
+        if not self.has_session(session_id):
+            return []
+        with stage("faiss.embed_query"):
+            q = np.asarray([self.emb.embed_query(query)], dtype=np.float32)
+        return self.search_by_vectors(session_id, q, k)[0]
+
+    def search_by_vectors(self, session_id: str, vectors, k: int = 5) -> List[List[Tuple[Document, float]]]:
+        """
+        Search many query vectors in one FAISS call per segment holding the session, restricted
+        to the session's vectors; per query the k nearest across segments.
+        """
+        q = np.asarray(vectors, dtype=np.float32)
+        hits: List[List[Tuple[Document, float]]] = [[] for _ in range(len(q))]
+        with stage("faiss.search"):
+            for seg in self._session_segments(session_id):
+                seg.reload(data=True)
+                with seg.lock:
+                    ranges = seg.ranges(session_id)
+                    if not ranges or seg.index is None:
+                        continue
+                    rows = self._search_ranges(seg.index, q, k, ranges)
+                    for row, (distances, ids) in zip(hits, rows):
+                        row.extend((seg.docs[i], float(dist)) for dist, i in zip(distances, ids) if i in seg.docs)
+        return [sorted(row, key=lambda hit: hit[1])[:k] for row in hits]
+
+    @staticmethod
+    def _search_ranges(index, q: np.ndarray, k: int, ranges: List[Tuple[int, int]]):
+        """Per query row: (distances, ids) of the k nearest vectors inside `ranges`."""
+        selectors = [faiss.IDSelectorRange(start, end) for start, end in ranges]
+        sel = selectors[0]
+        for other in selectors[1:]:
+            sel = faiss.IDSelectorOr(sel, other)
+            selectors.append(sel)  # keep SWIG objects alive for the duration of the search
+        try:
+            distances, ids = index.search(q, k, params=faiss.SearchParameters(sel=sel))
+            return [(d[i >= 0].tolist(), i[i >= 0].tolist()) for d, i in zip(distances, ids)]
+        except RuntimeError:
+            # codecs without selector support (e.g. PQ): decode only this session's vectors
+            all_ids = np.concatenate([np.arange(s, e, dtype=np.int64) for s, e in ranges])
+            vecs = np.vstack([index.reconstruct(int(i)) for i in all_ids])
+            rows = []
+            for row in q:
+                dist = ((vecs - row) ** 2).sum(axis=1)
+                top = np.argsort(dist)[:k]
+                rows.append((dist[top].tolist(), all_ids[top].tolist()))
+            return rows
+
+    def as_retriever(self, session_id: str, k: int = 5) -> SessionScopedRetriever:
+        return SessionScopedRetriever(store=self, session_id=session_id, k=k)
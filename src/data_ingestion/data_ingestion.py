@@ -1,23 +1,35 @@
 from __future__ import annotations
 import os
 import sys
+import re
 import json
 import uuid  
 import hashlib
 import shutil
+from contextlib import contextmanager
 from pathlib import Path
-from typing import Iterable, List, Optional, Dict, Any
+from typing import Iterable, List, Optional, Dict, Any, Tuple
 
 import fitz  # PyMuPDF
+import numpy as np
 from langchain.schema import Document
-from langchain_text_splitters import RecursiveCharacterTextSplitter
+from langchain_community.docstore.in_memory import InMemoryDocstore
 from langchain_community.vectorstores import FAISS
 
 from utils.model_loader import ModelLoader
 from logger import GLOBAL_LOGGER as log
 from exception.custom_exception import CustomException
 from utils.file_io import generate_session_id, save_uploaded_files
-from utils.document_ops import load_documents, concat_for_analysis, concat_for_comparison
+from utils.session_catalog import record_session, get_catalog, dir_bytes, files_bytes
+from utils.metrics import stage
+from utils.document_ops import iter_documents, concat_for_analysis, concat_for_comparison
+from utils.faiss_storage import VectorStorageSpec
+from utils.chunking import Chunker
+from utils.pipeline import StagedPipeline, batched
+from utils.hierarchical_index import HierarchicalIndex
+from utils.storage_backend import fetch_dir, publish_dir
+from utils.index_generations import IndexGenerations
+from src.data_ingestion.consolidated_index import ConsolidatedFaissStore, CONSOLIDATED_DIR, STORAGE_MODES
 
 
 SUPPORTED_EXTENSIONS = {".pdf", ".docx", ".txt"}
@@ -26,26 +38,63 @@ SUPPORTED_EXTENSIONS = {".pdf", ".docx", ".txt"}
 class FaissManager:
     """ 
     FAISS index manager with idempotent document addition and metadata tracking.
+    Vector storage (float32, float16, SQ8, PQ, truncation / PCA) follows `faiss_db.storage` in config.yaml
+    unless an explicit `storage` spec is passed.
+    Every commit writes a new index generation (see utils/index_generations.py); run
+    load-modify-commit sequences inside `writing()` so concurrent writers do not lose updates.
     """
-    def __init__(self, index_dir: Path, model_loader: Optional[ModelLoader] = None):
+    def __init__(self, index_dir: Path, model_loader: Optional[ModelLoader] = None,
+                 storage: Optional[VectorStorageSpec] = None):
         self.index_dir = Path(index_dir)
+        fetch_dir(self.index_dir)  # continue a session indexed on another node
         self.index_dir.mkdir(parents=True, exist_ok=True)
         
-        self.meta_path = self.index_dir / "ingested_meta.json"
+        self.model_loader = model_loader or ModelLoader()
+        self.emb = self.model_loader.load_embeddings()
+        self.storage = storage or VectorStorageSpec.from_config(self.model_loader.config)
+        self.generations = IndexGenerations(
+            self.index_dir, keep=int((self.model_loader.config.get("faiss_db") or {}).get("generations_kept", 3)))
+        self._writing = 0
+        self._refresh()
+
+    def _refresh(self):
+        """(Re)read the current generation's ingest metadata and centroid layer; the index loads lazily."""
+        self.generation = self.generations.current()
+        self.vs: Optional[FAISS] = None
+        self._dirty = False  # claimed rows / added vectors not yet committed
         self._meta: Dict[str, Any] = {"rows": {}}
-        
-        if self.meta_path.exists():
+        if self.generation is not None and self.generation.meta_path.exists():
             try:
-                self._meta = json.loads(self.meta_path.read_text(encoding="utf-8")) or {"rows": {}}
+                self._meta = json.loads(self.generation.meta_path.read_text(encoding="utf-8")) or {"rows": {}}
             except Exception:
                 self._meta = {"rows": {}}
-        
-        self.model_loader = model_loader or ModelLoader()
-        self.emb = self.model_loader.load_embeddings()
-        self.vs: Optional[FAISS] = None
+        # document/section centroid layer for coarse-to-fine retrieval
+        self.hierarchy = (HierarchicalIndex.load(self.index_dir, self.generation.hierarchy_prefix)
+                          if self._exists() else None) \
+            or HierarchicalIndex.from_config(self.model_loader.config)
+
+    @contextmanager
+    def writing(self):
+        """Hold the session's cross-process write lock, starting from the latest generation."""
+        if self._writing:
+            yield self
+            return
+        with self.generations.write_lock():
+            self._writing += 1
+            try:
+                latest = self.generations.current()
+                if (latest and latest.number) != (self.generation and self.generation.number):
+                    if self._dirty:
+                        raise RuntimeError(
+                            f"FAISS index {self.index_dir} was committed by another writer while this one "
+                            "held uncommitted changes; add documents inside writing()")
+                    self._refresh()  # another writer committed since this manager loaded
+                yield self
+            finally:
+                self._writing -= 1
         
     def _exists(self)-> bool:
-        return (self.index_dir / "index.faiss").exists() and (self.index_dir / "index.pkl").exists()
+        return self.generation is not None and self.generation.exists()
     
     @staticmethod
     def _fingerprint(text: str, md: Dict[str, Any]) -> str:
@@ -56,72 +105,273 @@ class FaissManager:
             return f"{src}::{'' if rid is None else rid}"
         return hashlib.sha256(text.encode("utf-8")).hexdigest()
     
-    def _save_meta(self):
-        self.meta_path.write_text(json.dumps(self._meta, ensure_ascii=False, indent=2), encoding="utf-8")
+    def _save_meta(self, path: Path):
+        path.write_text(json.dumps(self._meta, ensure_ascii=False, indent=2), encoding="utf-8")
                 
-    def add_documents(self, docs: List[Document]):
-        if self.vs is None:
-            raise RuntimeError("Call load_or_create() before add_documents_idempotent().")
-        
+    def claim_new(self, docs: List[Document]) -> List[Document]:
+        """Return the chunks not yet in this index and mark them as ingested."""
         new_docs: List[Document] = []
-        
-        for d in docs: 
+        for d in docs:
             key = self._fingerprint(d.page_content, d.metadata or {})
             if key in self._meta["rows"]:
                 continue
             self._meta["rows"][key] = True
             new_docs.append(d)
-            
-        if new_docs:
-            self.vs.add_documents(new_docs)
-            self.vs.save_local(str(self.index_dir))
-            self._save_meta()
+        self._dirty = self._dirty or bool(new_docs)
+        return new_docs
+
+    def train_size(self, dim: int) -> int:
+        """Vectors to buffer before the first add so a compressed codec can be trained."""
+        if self.vs is not None or self._exists():
+            return 0
+        return self.storage.min_train_size(dim)
+
+    def add_embedded(self, docs: List[Document], vectors: List[List[float]]):
+        """Add already-embedded chunks, loading or creating the index on first use (not saved)."""
+        texts = [d.page_content for d in docs]
+        metadatas = [d.metadata for d in docs]
+        if self.vs is None and self._exists():
+            self.load_or_create()
+        start = self.vs.index.ntotal if self.vs is not None else 0
+        self._dirty = True
+        with stage("faiss.build"):
+            self.hierarchy.add(metadatas, vectors, range(start, start + len(docs)))
+            if self.vs is not None:
+                self.vs.add_embeddings(list(zip(texts, vectors)), metadatas=metadatas)
+            elif self.storage.is_default:
+                self.vs = FAISS.from_embeddings(list(zip(texts, vectors)), self.emb, metadatas=metadatas)
+            else:
+                self.vs = self._create_compressed(texts, vectors, metadatas)
+
+    def commit(self):
+        """Write the index as a new generation and point readers at it."""
+        with self.writing():
+            if self.vs is None:
+                return
+            with stage("faiss.write"):
+                gen = self.generations.next()
+                self.vs.save_local(str(self.index_dir), index_name=gen.prefix)
+                self.hierarchy.save(self.index_dir, gen.hierarchy_prefix)
+                self._meta.setdefault("storage", self.storage.to_dict())
+                self._save_meta(gen.meta_path)
+                self.generations.publish(gen)
+                self.generation = gen
+                self._dirty = False
+        publish_dir(self.index_dir)
+
+    def add_documents(self, docs: List[Document]):
+        if self.vs is None:
+            raise RuntimeError("Call load_or_create() before add_documents_idempotent().")
+        
+        with self.writing():
+            if self.vs is None:  # another writer committed first: continue from its generation
+                self.load_or_create()
+            new_docs = self.claim_new(docs)
+            if new_docs:
+                with stage("faiss.embed"):
+                    vectors = self.emb.embed_documents([d.page_content for d in new_docs])
+                self.add_embedded(new_docs, vectors)
+                self.commit()
         return len(new_docs)
     
     def load_or_create(self,texts:Optional[List[str]]=None, metadatas: Optional[List[dict]] = None):
         if self._exists():
-            self.vs = FAISS.load_local(
-                str(self.index_dir),
-                embeddings=self.emb,
-                allow_dangerous_deserialization=True,
-            )
+            with stage("faiss.load"):
+                self.vs = FAISS.load_local(
+                    str(self.index_dir),
+                    embeddings=self.emb,
+                    index_name=self.generation.prefix,
+                    allow_dangerous_deserialization=True,
+                )
             return self.vs
         
         if not texts:
             raise CustomException("No existing FAISS index and no data to create one", sys)
-        self.vs = FAISS.from_texts(texts=texts, embedding=self.emb, metadatas=metadatas or [])
-        self.vs.save_local(str(self.index_dir))
+        with stage("faiss.embed"):
+            vectors = self.emb.embed_documents(texts)
+        with stage("faiss.build"):
+            if self.storage.is_default:
+                self.vs = FAISS.from_embeddings(list(zip(texts, vectors)), self.emb, metadatas=metadatas or None)
+                self._meta["storage"] = self.storage.to_dict()
+            else:
+                self.vs = self._create_compressed(texts, vectors, metadatas)
+            self.hierarchy.add(metadatas or [{} for _ in texts], vectors, range(len(texts)))
+        self._dirty = True
+        self.commit()
         return self.vs
+
+    def _create_compressed(self, texts: List[str], vectors: List[List[float]],
+                           metadatas: Optional[List[dict]] = None) -> FAISS:
+        """Train the configured codec on the freshly embedded vectors, then add them."""
+        arr = np.asarray(vectors, dtype=np.float32)
+        spec = self.storage.for_vectors(*arr.shape)
+        index = spec.build_index(arr)
+        vs = FAISS(self.emb, index, InMemoryDocstore(), {})
+        vs.add_embeddings(list(zip(texts, vectors)), metadatas=metadatas or None)
+        self._meta["storage"] = spec.to_dict()  # the spec built, which may be the fp16 fallback
+        log.info("Compressed FAISS index created", storage=spec.label(), vectors=len(texts),
+                 index=str(self.index_dir))
+        return vs
         
 
+def consolidated_store(faiss_base, model_loader: Optional[ModelLoader] = None) -> ConsolidatedFaissStore:
+    """Node-wide consolidated FAISS store under `<faiss_base>/_consolidated`."""
+    model_loader = model_loader or ModelLoader()
+    block = (model_loader.config.get("faiss_db") or {}).get("consolidated") or {}
+    return ConsolidatedFaissStore(
+        Path(faiss_base) / CONSOLIDATED_DIR,
+        model_loader.load_embeddings(),
+        num_shards=int(os.getenv("FAISS_SHARDS", "8")),
+        storage=VectorStorageSpec.from_config(model_loader.config),
+        segment_max_vectors=int(block.get("segment_max_vectors", 50000)),
+        max_cached_segments=int(block.get("max_cached_segments", 64)),
+    )
+
+
+class _ConsolidatedWriter:
+    """
+    Adapts one session of a ConsolidatedFaissStore to the FaissManager write API. Each embedded
+    batch goes to the shard as it arrives, under a pending ID range that searches ignore, so
+    memory stays bounded by the pipeline's batches; `commit()` publishes the ranges and
+    `rollback()` removes them when the ingestion fails.
+    """
+    def __init__(self, store: ConsolidatedFaissStore, session_id: str):
+        self.store = store
+        self.session_id = session_id
+        self._pending: List[Tuple[str, int, int]] = []
+        self._keys: set = set()
+
+    def claim_new(self, docs: List[Document]) -> List[Document]:
+        new_docs = []
+        for d in self.store.claim_new(self.session_id, docs):
+            key = self.store._fingerprint(d)
+            if key not in self._keys:  # repeated within this upload
+                self._keys.add(key)
+                new_docs.append(d)
+        return new_docs
+
+    def train_size(self, dim: int) -> int:
+        return self.store.train_size(self.session_id, dim)
+
+    def add_embedded(self, docs: List[Document], vectors):
+        with stage("faiss.build"):
+            pending = self.store.append_pending(self.session_id, docs, vectors)
+        if pending is not None:
+            self._pending.append(pending)
+
+    def commit(self):
+        if self._pending:
+            self.store.publish(self.session_id, self._pending)
+        self._pending = []
+
+    def rollback(self):
+        if self._pending:
+            removed = self.store.discard(self.session_id, self._pending)
+            log.info("Pending consolidated ranges discarded", session_id=self.session_id, removed=removed)
+        self._pending = []
+
+
+# ---------- Ingestion stages ----------
+_BLANK_RUNS = re.compile(r"\n{3,}")
+
+
+def clean_pages(pages: Iterable[Document]) -> Iterable[Document]:
+    """Drop NULs, trailing spaces and runs of blank lines; skip pages with no text."""
+    for d in pages:
+        text = d.page_content.replace("\x00", "")
+        text = "\n".join(line.rstrip() for line in text.splitlines())
+        text = _BLANK_RUNS.sub("\n\n", text).strip()
+        if not text:
+            continue
+        d.page_content = text
+        yield d
+
+
+def chunk_pages(pages: Iterable[Document], chunker: Chunker) -> Iterable[Document]:
+    for c in chunker.iter_chunks(pages):
+        # page (or streamed segment) + chunk position identifies a chunk within its source
+        # for idempotent re-ingestion
+        unit = c.metadata.get("page", c.metadata.get("segment", 0))
+        c.metadata.setdefault("row_id", f"{unit}:{c.metadata['chunk_index']}")
+        yield c
+
+
+def embed_chunks(chunks: Iterable[Document], writer, embeddings, batch_size: int):
+    for batch in batched(chunks, batch_size):
+        new_docs = writer.claim_new(batch)
+        if not new_docs:
+            continue
+        with stage("faiss.embed"):
+            vectors = embeddings.embed_documents([d.page_content for d in new_docs])
+        yield new_docs, vectors
+
+
+def index_batches(batches, writer):
+    """
+    Add embedded batches as they arrive; the first vectors are held back only until a
+    compressed codec has enough of them to train on.
+    """
+    pending_docs: List[Document] = []
+    pending_vecs: List[List[float]] = []
+    need = None
+    for docs, vectors in batches:
+        if need is None:
+            need = writer.train_size(len(vectors[0]))
+        pending_docs.extend(docs)
+        pending_vecs.extend(vectors)
+        if len(pending_docs) >= need:
+            writer.add_embedded(pending_docs, pending_vecs)
+            yield len(pending_docs)
+            pending_docs, pending_vecs, need = [], [], 0
+    if pending_docs:
+        writer.add_embedded(pending_docs, pending_vecs)
+        yield len(pending_docs)
+    writer.commit()
+
+
 # ---------- Chat Ingestor ---------- 
 class ChatIngestor:
     """ 
     Ingest files, split into chunks, create/load FAISS index with session-based versioning for chat.
+
+    storage_mode "session" (default) keeps one FAISS directory per session; "consolidated" appends
+    to the node's sharded index (FAISS_STORAGE_MODE / FAISS_SHARDS env vars).
+
+    Ingestion is a streaming pipeline (parse -> clean -> chunk -> embed -> index) whose stages run
+    concurrently over bounded queues (`ingestion` block in config.yaml), so memory stays flat in
+    the size of the upload and embedding starts with the first pages.
     """
     def __init__( self,
         temp_base: str = "data",
         faiss_base: str = "faiss_index",
         use_session_dirs: bool = True,
         session_id: Optional[str] = None,
+        storage_mode: Optional[str] = None,
     ):
         try:
             self.model_loader = ModelLoader()
             
             self.use_session = use_session_dirs
             self.session_id = session_id or generate_session_id()
+            self.storage_mode = storage_mode or os.getenv("FAISS_STORAGE_MODE", "session")
+            if self.storage_mode not in STORAGE_MODES:
+                raise ValueError(f"Unsupported storage mode: {self.storage_mode}")
             
             self.temp_base = Path(temp_base); self.temp_base.mkdir(parents=True, exist_ok=True)
             self.faiss_base = Path(faiss_base); self.faiss_base.mkdir(parents=True, exist_ok=True)
             
             self.temp_dir = self._resolve_dir(self.temp_base)
-            self.faiss_dir = self._resolve_dir(self.faiss_base)
+            if self.storage_mode == "consolidated":
+                self.faiss_dir = self.faiss_base / CONSOLIDATED_DIR
+            else:
+                self.faiss_dir = self._resolve_dir(self.faiss_base)
 
             log.info("ChatIngestor initialized",
                       session_id=self.session_id,
                       temp_dir=str(self.temp_dir),
                       faiss_dir=str(self.faiss_dir),
-                      sessionized=self.use_session)
+                      sessionized=self.use_session,
+                      storage_mode=self.storage_mode)
             
         except Exception as e:
             log.error("Failed to initialize ChatIngestor", error=str(e))
@@ -134,11 +384,27 @@ class ChatIngestor:
             return d
         return base # fallback: "faiss_index/"
         
-    def _split(self, docs: List[Document], chunk_size=1000, chunk_overlap=200) -> List[Document]:
-        splitter = RecursiveCharacterTextSplitter(chunk_size=chunk_size, chunk_overlap=chunk_overlap)
-        chunks = splitter.split_documents(docs)
-        log.info("Documents split successfully", chunks=len(chunks), chunk_size=chunk_size, overlap=chunk_overlap)
-        return chunks
+    def _ingest(self, paths: List[Path], writer, chunk_size: int, chunk_overlap: int) -> int:
+        config = self.model_loader.config
+        block = config.get("ingestion") or {}
+        chunker = Chunker.from_config(config, chunk_size=chunk_size, chunk_overlap=chunk_overlap)
+        embeddings = self.model_loader.load_embeddings()
+        pipeline = StagedPipeline(
+            "ingest",
+            iter_documents(paths),
+            [
+                ("clean", clean_pages),
+                ("chunk", lambda pages: chunk_pages(pages, chunker)),
+                ("embed", lambda chunks: embed_chunks(chunks, writer, embeddings,
+                                                      int(block.get("embed_batch_size", 64)))),
+                ("index", lambda batches: index_batches(batches, writer)),
+            ],
+            queue_size=int(block.get("queue_size", 8)),
+        )
+        added = sum(pipeline.run())
+        log.info("Documents ingested", pages=pipeline.stats["clean"]["items"], chunks=pipeline.stats["chunk"]["items"],
+                 added=added, chunk_size=chunk_size, overlap=chunk_overlap, unit=chunker.unit, session_id=self.session_id)
+        return added
     
     def built_retriver( self,
         uploaded_files: Iterable,
@@ -148,23 +414,32 @@ class ChatIngestor:
         k: int = 5,):
         try:
             paths = save_uploaded_files(uploaded_files, self.temp_dir)
-            docs = load_documents(paths)
-            if not docs:
-                raise ValueError("No valid documents loaded")
-            
-            chunks = self._split(docs, chunk_size=chunk_size, chunk_overlap=chunk_overlap)
+            if self.use_session:
+                record_session("chat", self.session_id, self.temp_dir, files_bytes(paths))
+            publish_dir(self.temp_dir)
+
+            if self.storage_mode == "consolidated":
+                store = consolidated_store(self.faiss_base, self.model_loader)
+                writer = _ConsolidatedWriter(store, self.session_id)
+                try:
+                    added = self._ingest(paths, writer, chunk_size, chunk_overlap)
+                except Exception:
+                    writer.rollback()
+                    raise
+                if not store.has_session(self.session_id):
+                    raise ValueError("No valid documents loaded")
+                log.info("FAISS index updated", added=added, index=str(self.faiss_dir), session_id=self.session_id)
+                return store.as_retriever(self.session_id, k=k)
             
             fm = FaissManager(self.faiss_dir, self.model_loader)
-            
-            texts = [c.page_content for c in chunks]
-            metas = [c.metadata for c in chunks]
-            
-            try:
-                vs = fm.load_or_create(texts=texts, metadatas=metas)
-            except Exception:
-                vs = fm.load_or_create(texts=texts, metadatas=metas)  
-            added = fm.add_documents(chunks)
+            with fm.writing():
+                added = self._ingest(paths, fm, chunk_size, chunk_overlap)
+            vs = fm.vs or (fm.load_or_create() if fm._exists() else None)
+            if vs is None:
+                raise ValueError("No valid documents loaded")
             log.info("FAISS index updated", added=added, index=str(self.faiss_dir))
+            if self.use_session:
+                record_session("chat", self.session_id, self.faiss_dir, dir_bytes(self.faiss_dir), replace=True)
             
             return vs.as_retriever(search_type="similarity", search_kwargs={"k": k})
             
@@ -174,30 +449,64 @@ class ChatIngestor:
 
             
 # ---------- PDF Handler + Comparator ----------           
+def open_pdf(source):
+    """Open a PDF from a path, or straight from memory for uploads exposing .getbuffer()."""
+    if hasattr(source, "getbuffer"):
+        return fitz.open(stream=source.getbuffer(), filetype="pdf")
+    return fitz.open(source)
+
+
+def pdf_info(doc) -> Dict[str, str]:
+    """The PDF's own metadata (Info dictionary, plus the catalog's /Lang when declared)."""
+    info = {k: v for k, v in (doc.metadata or {}).items() if isinstance(v, str) and v.strip()}
+    try:
+        kind, lang = doc.xref_get_key(doc.pdf_catalog(), "Lang")
+        if kind == "string" and lang.strip():
+            info["lang"] = lang.strip()
+    except Exception:  # not a PDF catalog (or a damaged one): no declared language
+        pass
+    return info
+
+
+def read_pdf_document(pdf_path) -> Tuple[str, int, Dict[str, str]]:
+    """Page-marked text, page count and PDF metadata (module-level so it can run in a worker process)."""
+    text_chunks = []
+    with open_pdf(pdf_path) as doc:
+        for page_num in range(doc.page_count):
+            page = doc.load_page(page_num)
+            text_chunks.append(f"\n--- Page {page_num + 1} ---\n{page.get_text()}")  # type: ignore
+        info = pdf_info(doc)
+    return "\n".join(text_chunks), len(text_chunks), info
+
+
 class DocHandler:
     """
     PDF save + read (page-wise) for analysis.
     """
-    def __init__(self, data_dir: Optional[str] = None, session_id: Optional[str] = None):
+    def __init__(self, data_dir: Optional[str] = None, session_id: Optional[str] = None, persist: bool = True):
         self.data_dir = data_dir or os.getenv("DATA_STORAGE_PATH", os.path.join(os.getcwd(), "data", "document_analysis"))
         self.session_id = session_id or generate_session_id("session")
         self.session_path = os.path.join(self.data_dir, self.session_id)
-        os.makedirs(self.session_path, exist_ok=True)
+        if persist:
+            os.makedirs(self.session_path, exist_ok=True)
         log.info("DocHandler initialized", session_id=self.session_id, session_path=self.session_path)
 
-    def save_pdf(self, uploaded_file) -> str:
+    def save_pdf(self, uploaded_file, prefix: str = "") -> str:
+        """Save an upload into the session; `prefix` keeps same-named files of one batch apart."""
         try:
             filename = os.path.basename(uploaded_file.name)
             
             if not filename.lower().endswith(".pdf"):
                 raise ValueError("Invalid file type. Only PDFs are allowed.")
-            save_path = os.path.join(self.session_path, filename)
+            save_path = os.path.join(self.session_path, f"{prefix}{filename}")
+            os.makedirs(self.session_path, exist_ok=True)
             
-            with open(save_path, "wb") as f:
+            with stage("upload.save"), open(save_path, "wb") as f:
                 if hasattr(uploaded_file, "read"):
                     f.write(uploaded_file.read())
                 else:
                     f.write(uploaded_file.getbuffer())
+            record_session("analysis", self.session_id, self.session_path, files_bytes([save_path]))
             log.info("PDF saved successfully", file=filename, save_path=save_path, session_id=self.session_id)
             return save_path
         
@@ -205,46 +514,63 @@ class DocHandler:
             log.error("Failed to save PDF", error=str(e), session_id=self.session_id)
             raise CustomException(f"Failed to save PDF: {str(e)}", e) from e
 
-    def read_pdf(self, pdf_path: str) -> str:
+    def read_document(self, source) -> Tuple[str, Dict[str, Any]]:
+        """
+        Page-marked text plus what the file itself says about the document: the PDF metadata
+        and `page_count`. `source` is a saved path or an in-memory upload.
+        """
+        if hasattr(source, "getbuffer") and not os.path.basename(source.name).lower().endswith(".pdf"):
+            raise CustomException("Invalid file type. Only PDFs are allowed.", sys)
         try:
-            text_chunks = []
-            with fitz.open(pdf_path) as doc:
-                for page_num in range(doc.page_count):
-                    page = doc.load_page(page_num)
-                    text_chunks.append(f"\n--- Page {page_num + 1} ---\n{page.get_text()}")  # type: ignore
-            text = "\n".join(text_chunks)
-            log.info("PDF read successfully", pdf_path=pdf_path, session_id=self.session_id, pages=len(text_chunks))
-            return text
-        
+            with stage("analyze.parse"):
+                text, pages, info = read_pdf_document(source)
+            log.info("PDF read successfully", pdf_path=str(source), session_id=self.session_id, pages=pages)
+            return text, {**info, "page_count": pages}
+
         except Exception as e:
-            log.error("Failed to read PDF", error=str(e), pdf_path=pdf_path, session_id=self.session_id)
-            raise CustomException(f"Could not process PDF: {pdf_path}", e) from e
+            log.error("Failed to read PDF", error=str(e), pdf_path=str(source), session_id=self.session_id)
+            raise CustomException(f"Could not process PDF: {source}", e) from e
+
+    def read_pdf(self, pdf_path: str) -> str:
+        return self.read_document(pdf_path)[0]
 
 
 # ---------- PDF Comparator ----------
+_WS = re.compile(r"\s+")
+
+
+def page_fingerprint(text: str) -> str:
+    """Whitespace-insensitive hash of a page's text; equal fingerprints mean an unchanged page."""
+    return hashlib.sha1(_WS.sub(" ", text).strip().encode("utf-8")).hexdigest()
+
+
 class DocumentComparator:
     """
     Save, read & combine PDFs for comparison with session-based versioning.
+    Also ingests N ordered versions of one document (each parsed once, with per-page fingerprints).
     """
-    def __init__(self, base_dir: str = "data/document_compare", session_id: Optional[str] = None):
+    def __init__(self, base_dir: str = "data/document_compare", session_id: Optional[str] = None, persist: bool = True):
         self.base_dir = Path(base_dir)
         self.session_id = session_id or generate_session_id()
         self.session_path = self.base_dir / self.session_id
-        self.session_path.mkdir(parents=True, exist_ok=True)
+        if persist:
+            self.session_path.mkdir(parents=True, exist_ok=True)
         log.info("DocumentComparator initialized", session_path=str(self.session_path))
 
     def save_uploaded_files(self, reference_file, actual_file):
         try:
             ref_path = self.session_path / reference_file.name
             act_path = self.session_path / actual_file.name
+            self.session_path.mkdir(parents=True, exist_ok=True)
             for fobj, out in ((reference_file, ref_path), (actual_file, act_path)):
                 if not fobj.name.lower().endswith(".pdf"):
                     raise ValueError("Only PDF files are allowed.")
-                with open(out, "wb") as f:
+                with stage("upload.save"), open(out, "wb") as f:
                     if hasattr(fobj, "read"):
                         f.write(fobj.read())
                     else:
                         f.write(fobj.getbuffer())
+            record_session("compare", self.session_id, self.session_path, files_bytes([ref_path, act_path]))
             log.info("Files saved", reference=str(ref_path), actual=str(act_path), session=self.session_id)
             return ref_path, act_path
         
@@ -252,17 +578,42 @@ class DocumentComparator:
             log.error("Error saving PDF files", error=str(e), session=self.session_id)
             raise CustomException("Error saving files", e) from e
 
+    def save_versions(self, files: List[Any]) -> List[Path]:
+        """Save N ordered versions as v01_<name>, v02_<name>, ... so file order is version order."""
+        try:
+            if len(files) < 2:
+                raise ValueError("At least two versions are required.")
+            paths = []
+            for i, fobj in enumerate(files, start=1):
+                name = os.path.basename(fobj.name)
+                if not name.lower().endswith(".pdf"):
+                    raise ValueError("Only PDF files are allowed.")
+                out = self.session_path / f"v{i:02d}_{name}"
+                with stage("upload.save"), open(out, "wb") as f:
+                    if hasattr(fobj, "read"):
+                        f.write(fobj.read())
+                    else:
+                        f.write(fobj.getbuffer())
+                paths.append(out)
+            record_session("compare", self.session_id, self.session_path, files_bytes(paths))
+            log.info("Versions saved", count=len(paths), session=self.session_id)
+            return paths
+
+        except Exception as e:
+            log.error("Error saving PDF versions", error=str(e), session=self.session_id)
+            raise CustomException("Error saving versions", e) from e
+
+    def read_pages(self, pdf_path) -> List[str]:
+        """Text of every page (empty string for pages without text); a path or an in-memory upload."""
+        with open_pdf(pdf_path) as doc:
+            if doc.is_encrypted:
+                raise ValueError(f"PDF is encrypted: {Path(pdf_path.name).name}")
+            return [doc.load_page(n).get_text() for n in range(doc.page_count)]  # type: ignore
+
     def read_pdf(self, pdf_path: Path) -> str:
         try:
-            with fitz.open(pdf_path) as doc:
-                if doc.is_encrypted:
-                    raise ValueError(f"PDF is encrypted: {pdf_path.name}")
-                parts = []
-                for page_num in range(doc.page_count):
-                    page = doc.load_page(page_num)
-                    text = page.get_text()  # type: ignore
-                    if text.strip():
-                        parts.append(f"\n --- Page {page_num + 1} --- \n{text}")
+            parts = [f"\n --- Page {n} --- \n{text}"
+                     for n, text in enumerate(self.read_pages(pdf_path), start=1) if text.strip()]
             log.info("PDF read successfully", file=str(pdf_path), pages=len(parts))
             return "\n".join(parts)
         
@@ -270,13 +621,48 @@ class DocumentComparator:
             log.error("Error reading PDF", file=str(pdf_path), error=str(e))
             raise CustomException("Error reading PDF", e) from e
 
+    def load_versions(self, paths: List[Path]) -> List[Dict[str, Any]]:
+        """Parse each version once: [{name, pages, fingerprints}] in version order."""
+        try:
+            versions = []
+            with stage("compare.parse"):
+                for p in paths:
+                    pages = self.read_pages(Path(p))
+                    versions.append({"name": Path(p).name, "pages": pages,
+                                     "fingerprints": [page_fingerprint(t) for t in pages]})
+            log.info("Versions parsed", count=len(versions), pages=[len(v["pages"]) for v in versions],
+                     session=self.session_id)
+            return versions
+
+        except Exception as e:
+            log.error("Error parsing versions", error=str(e), session=self.session_id)
+            raise CustomException("Error parsing versions", e) from e
+
+    def combine_uploads(self, files: List[Any]) -> str:
+        """Same combined text as `combine_documents`, parsed from in-memory uploads (nothing written)."""
+        try:
+            doc_parts = []
+            with stage("compare.parse"):
+                for fobj in sorted(files, key=lambda f: os.path.basename(f.name)):
+                    name = os.path.basename(fobj.name)
+                    if not name.lower().endswith(".pdf"):
+                        raise ValueError("Only PDF files are allowed.")
+                    doc_parts.append(f"Document: {name}\n{self.read_pdf(fobj)}")
+            log.info("Documents combined in memory", count=len(doc_parts), session=self.session_id)
+            return "\n\n".join(doc_parts)
+
+        except Exception as e:
+            log.error("Error combining uploads", error=str(e), session=self.session_id)
+            raise CustomException("Error combining documents", e) from e
+
     def combine_documents(self) -> str:
         try:
             doc_parts = []
-            for file in sorted(self.session_path.iterdir()):
-                if file.is_file() and file.suffix.lower() == ".pdf":
-                    content = self.read_pdf(file)
-                    doc_parts.append(f"Document: {file.name}\n{content}")
+            with stage("compare.parse"):
+                for file in sorted(self.session_path.iterdir()):
+                    if file.is_file() and file.suffix.lower() == ".pdf":
+                        content = self.read_pdf(file)
+                        doc_parts.append(f"Document: {file.name}\n{content}")
             combined_text = "\n\n".join(doc_parts)
             log.info("Documents combined", count=len(doc_parts), session=self.session_id)
             return combined_text
@@ -290,6 +676,7 @@ class DocumentComparator:
             sessions = sorted([f for f in self.base_dir.iterdir() if f.is_dir()], reverse=True)
             for folder in sessions[keep_latest:]:
                 shutil.rmtree(folder, ignore_errors=True)
+                get_catalog().remove("compare", folder.name)
                 log.info("Old session folder deleted", path=str(folder))
         
         except Exception as e:
@@ -1,32 +1,44 @@
 import os
 import sys
+import asyncio
+from typing import Any, AsyncIterator, Callable, Dict, List, Optional, Tuple
 from utils.model_loader import ModelLoader
 from logger.custom_logger import CustomLogger
 from exception.custom_exception import CustomException
 from model.models import *
 from prompt.prompt_library import PROMPT_REGISTRY 
 from logger import GLOBAL_LOGGER as log
-
-from langchain_core.output_parsers import JsonOutputParser
-from langchain.output_parsers import OutputFixingParser
+from utils.metrics import stage
+from utils.llm_usage import with_usage, fit_to_budget
+from utils.config_loader import get_config
+from utils.structured_output import StructuredChain, native_json_supported, structured_parser
+from src.document_analyzer.local_metadata import local_metadata, representative_sample
 
 
 class DocumentAnalyzer:
     """
     Analyzes documents using a pre-trained model.
+    Metadata fields come from the PDF itself (see local_metadata); the LLM only writes the
+    Summary and SentimentTone, from a representative sample of the text.
     Automatically logs all actions and supports session-based organization.
     """
     def __init__(self):
         try:
             self.loader = ModelLoader()
-            self.llm = self.loader.load_llm()
+            base_llm = self.loader.load_llm()
+            self.llm = with_usage(base_llm, "analyze")
+            options = get_config().get("structured_output") or {}
+            native = options.get("native", True) and native_json_supported(DocumentSummary)
+            json_llm = with_usage(self.loader.load_llm(json_mode=True), "analyze") if native else None
 
-            # Prepare parsers
-            self.parser = JsonOutputParser(pydantic_object=Metadata)
-            self.fixing_parser = OutputFixingParser.from_llm(parser=self.parser, llm=self.llm)
+            # Local JSON repair first; an LLM fix round-trip only as a last resort
+            fixer_llm = with_usage(base_llm, "analyze.fix") if options.get("llm_fix", True) else None
+            self.parser = structured_parser(DocumentSummary, "analyze", fixer_llm)
 
             self.prompt = PROMPT_REGISTRY["document_analysis"]
-                
+            self.chain = StructuredChain(self.prompt, self.parser, self.llm, json_llm)
+            self.sample_chars = int((get_config().get("document_analysis") or {}).get("sample_chars", 12000))
+
             log.info("DocumentAnalyzer initialized successfully")
 
         except Exception as e:
@@ -34,18 +46,28 @@ class DocumentAnalyzer:
             raise CustomException(f"DocumentAnalyzer initialization failed: {e}")
 
 
-    def analyze_document(self, document_text: str) -> dict:
+    def _inputs(self, document_text: str) -> dict:
+        sample = representative_sample(document_text, self.sample_chars)
+        return {
+            "format_instructions": self.parser.get_format_instructions(),
+            "document_text": fit_to_budget(sample, "analyze"),
+        }
+
+    @staticmethod
+    def _merge(document_text: str, pdf_info: Optional[Dict[str, Any]], summary: dict) -> dict:
+        with stage("analyze.metadata"):
+            local = local_metadata(document_text, pdf_info)
+        return Metadata(**local, **summary).model_dump()
+
+    def analyze_document(self, document_text: str, pdf_info: Optional[Dict[str, Any]] = None) -> dict:
         """
         Analyzes a document's text and extract structured metadata and summary.
+        `pdf_info` is the PDF's own metadata (DocHandler.read_document).
         """
         try:
-            chain = self.prompt | self.llm | self.fixing_parser
-            log.info(f"Metadata analysis chain initialized.")
-
-            response = chain.invoke({
-                "format_instructions": self.parser.get_format_instructions(),
-                "document_text": document_text
-            })
+            with stage("analyze.llm"):
+                summary = self.chain.invoke(self._inputs(document_text))
+            response = self._merge(document_text, pdf_info, summary)
             
             log.info(f"Metadata extraction successful", keys=list(response.keys()))
 
@@ -55,3 +77,58 @@ class DocumentAnalyzer:
             log.error(f"Metadata analysis failed", error=str(e))
             raise CustomException(f"Metadata extraction failed", sys)
 
+    async def aanalyze_document(self, document_text: str, pdf_info: Optional[Dict[str, Any]] = None) -> dict:
+        """Async variant of analyze_document (non-blocking LLM call)."""
+        try:
+            with stage("analyze.llm"):
+                summary = await self.chain.ainvoke(self._inputs(document_text))
+            response = self._merge(document_text, pdf_info, summary)
+            log.info(f"Metadata extraction successful", keys=list(response.keys()))
+            return response
+
+        except Exception as e:
+            log.error(f"Metadata analysis failed", error=str(e))
+            raise CustomException(f"Metadata extraction failed", e) from e
+
+    async def analyze_files(
+        self,
+        files: List[Tuple[str, str]],
+        parse: Callable[[str], Tuple[str, int, Dict[str, str]]],
+        max_concurrency: int = 4,
+        executor=None,
+        max_in_flight: Optional[int] = None,
+    ) -> AsyncIterator[Dict[str, Any]]:
+        """
+        Analyze many saved files, yielding one result per file as soon as it is ready.
+
+        `files` is a list of (name, path); `parse` returns (text, page count, PDF metadata),
+        like read_pdf_document. Parsing runs on `executor` (a process pool, or the
+        default thread pool when None) and at most `max_concurrency` LLM calls are in flight.
+        A file takes one of `max_in_flight` slots (default: twice `max_concurrency`) before it
+        is parsed and frees it once analyzed, so extracted texts waiting for the LLM stay bounded.
+        A file that fails to parse or analyze yields an error entry; the others continue.
+        """
+        loop = asyncio.get_running_loop()
+        llm_slots = asyncio.Semaphore(max(1, max_concurrency))
+        file_slots = asyncio.Semaphore(max(1, max_in_flight or 2 * max_concurrency))
+
+        async def one(index: int, name: str, path: str) -> Dict[str, Any]:
+            try:
+                async with file_slots:
+                    with stage("analyze.parse"):
+                        text, pages, info = await loop.run_in_executor(executor, parse, path)
+                    async with llm_slots:
+                        result = await self.aanalyze_document(text, {**info, "page_count": pages})
+                return {"index": index, "file": name, "status": "ok", "pages": pages, "result": result}
+            except Exception as e:
+                log.error("Bulk analysis failed for file", file=name, error=str(e))
+                return {"index": index, "file": name, "status": "error", "error": str(e)}
+
+        tasks = [asyncio.ensure_future(one(i, name, path)) for i, (name, path) in enumerate(files)]
+        try:
+            for done in asyncio.as_completed(tasks):
+                yield await done
+        finally:
+            for t in tasks:  # client went away: stop pending LLM calls
+                t.cancel()
+
@@ -0,0 +1,152 @@
+from __future__ import annotations
+import re
+from collections import Counter
+from typing import Any, Dict, List, Mapping, Optional
+
+UNKNOWN = "N/A"
+_PAGE_MARKER = re.compile(r"^\s*--- Page \d+ ---\s*$")
+_PDF_DATE = re.compile(r"^(?:D:)?(\d{4})(\d{2})?(\d{2})?")
+_AUTHORS = re.compile(r"\s*(?:;|&|\band\b)\s*", re.IGNORECASE)
+_WORD = re.compile(r"[^\W\d_]+")
+_DETECT_CHARS = 20000  # language is decided on the first part of the text
+
+
+# ---------- Language detection ----------
+_STOPWORDS = {
+    "English": "the of and to in is that for it with as was on be by this are from or which an",
+    "German": "der die und den von zu das mit sich des auf für ist im dem nicht ein eine als auch",
+    "French": "le la les des et en un une du est que dans pour qui au sur pas par ce avec",
+    "Spanish": "el la de que y en los del se las por un para con una es al lo como más",
+    "Portuguese": "o a de que e do da em um para com não uma os no se na por mais as",
+    "Italian": "il di che e la in un per non una sono del della le è con si da gli",
+    "Dutch": "de het een van en in is dat op te voor met zijn niet aan er ook als",
+    "Swedish": "och i att det som en på är av för med till den har de inte om ett",
+    "Polish": "i w nie na się z do to że jest o jak ale po co tak za od",
+    "Turkish": "ve bir bu da de için ile olarak olan en çok daha gibi kadar ne",
+}
+_STOPWORD_SETS = {lang: frozenset(words.split()) for lang, words in _STOPWORDS.items()}
+
+# letters of these scripts name the language on their own
+_SCRIPTS = (
+    (0x3040, 0x30FF, "Japanese"),  # hiragana + katakana
+    (0xAC00, 0xD7AF, "Korean"),
+    (0x4E00, 0x9FFF, "Chinese"),
+    (0x0400, 0x04FF, "Russian"),
+    (0x0600, 0x06FF, "Arabic"),
+    (0x0900, 0x097F, "Hindi"),
+    (0x0370, 0x03FF, "Greek"),
+    (0x0590, 0x05FF, "Hebrew"),
+    (0x0E00, 0x0E7F, "Thai"),
+)
+
+LANGUAGE_CODES = {
+    "en": "English", "de": "German", "fr": "French", "es": "Spanish", "pt": "Portuguese",
+    "it": "Italian", "nl": "Dutch", "sv": "Swedish", "pl": "Polish", "tr": "Turkish",
+    "ja": "Japanese", "ko": "Korean", "zh": "Chinese", "ru": "Russian", "ar": "Arabic",
+    "hi": "Hindi", "el": "Greek", "he": "Hebrew", "th": "Thai",
+}
+
+
+def _script_language(text: str) -> Optional[str]:
+    scripts: Counter = Counter()
+    letters = 0
+    for ch in text:
+        if not ch.isalpha():
+            continue
+        letters += 1
+        code = ord(ch)
+        for lo, hi, lang in _SCRIPTS:
+            if lo <= code <= hi:
+                scripts[lang] += 1
+                break
+    if not scripts or sum(scripts.values()) < 0.3 * letters:
+        return None
+    if scripts["Japanese"] >= 0.05 * letters:  # kanji are Han characters too
+        return "Japanese"
+    return scripts.most_common(1)[0][0]
+
+
+def _stopword_language(text: str, min_words: int = 20) -> Optional[str]:
+    words = [w.lower() for w in _WORD.findall(text)]
+    if len(words) < min_words:
+        return None
+    scores = Counter({lang: sum(w in stop for w in words) for lang, stop in _STOPWORD_SETS.items()})
+    (best, top), (_, second) = scores.most_common(2)
+    if top < 0.05 * len(words) or top < 1.2 * second:
+        return None
+    return best
+
+
+def detect_language(text: str, declared: Optional[str] = None) -> str:
+    """
+    Language name from the text (script, then stopword frequencies); the PDF's declared
+    /Lang is only used when the text is too short or too mixed to decide.
+    """
+    sample = text[:_DETECT_CHARS]
+    found = _script_language(sample) or _stopword_language(sample)
+    if found:
+        return found
+    if declared:
+        return LANGUAGE_CODES.get(declared.split("-")[0].lower(), declared)
+    return UNKNOWN
+
+
+# ---------- PDF metadata ----------
+def pdf_date(value: Optional[str]) -> str:
+    """PDF date string (D:YYYYMMDDHHmmSS...) as YYYY-MM-DD (or as much of it as is present)."""
+    if not value:
+        return UNKNOWN
+    m = _PDF_DATE.match(value.strip())
+    if not m:
+        return value.strip()
+    return "-".join(part for part in m.groups() if part)
+
+
+def _first_line(text: str) -> Optional[str]:
+    for line in text.splitlines():
+        if line.strip() and not _PAGE_MARKER.match(line):
+            return line.strip()[:200]
+    return None
+
+
+def local_metadata(text: str, info: Optional[Mapping[str, Any]] = None) -> Dict[str, Any]:
+    """
+    Metadata fields that need no LLM: the PDF Info dictionary (`info`, as read by
+    read_pdf_document, with `page_count`), falling back to the text itself.
+    """
+    info = info or {}
+    authors: List[str] = [a for a in _AUTHORS.split(info.get("author") or "") if a]
+    page_count = info.get("page_count")
+    if page_count is None:
+        page_count = sum(1 for line in text.splitlines() if _PAGE_MARKER.match(line)) or UNKNOWN
+    return {
+        "Title": (info.get("title") or "").strip() or _first_line(text) or UNKNOWN,
+        "Author": authors,
+        "DateCreated": pdf_date(info.get("creationDate")),
+        "LastModifiedDate": pdf_date(info.get("modDate") or info.get("creationDate")),
+        "Publisher": UNKNOWN,  # not part of the PDF Info dictionary
+        "Language": detect_language(text, info.get("lang")),
+        "PageCount": page_count,
+    }
+
+
+# ---------- LLM sample ----------
+def representative_sample(text: str, max_chars: int, excerpts: int = 6) -> str:
+    """
+    At most ~`max_chars` of `text` for summarization: the first half of the budget from the
+    start of the document, the rest as evenly spaced excerpts from the remainder.
+    """
+    if len(text) <= max_chars:
+        return text
+    head_len = max_chars // 2
+    rest = text[head_len:]
+    n = max(1, min(excerpts, (max_chars - head_len) // 500))
+    size = (max_chars - head_len) // n
+    stride = len(rest) // n
+    parts = [text[:head_len]]
+    for i in range(n):
+        start = i * stride + max(0, stride - size) // 2  # centred in its stretch of the text
+        newline = rest.find("\n", start, start + 200)
+        start = newline + 1 if newline >= 0 else start
+        parts.append(rest[start:start + size])
+    return "\n[...]\n".join(p.strip("\n") for p in parts)
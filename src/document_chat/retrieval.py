@@ -1,18 +1,226 @@
 import sys
 import os
+import threading
+from collections import OrderedDict
 from operator import itemgetter
-from typing import List, Optional, Dict, Any
+from pathlib import Path
+from typing import AsyncIterator, List, Optional, Dict, Any, Tuple
 
+import numpy as np
+from langchain_core.documents import Document
+from langchain_core.callbacks import CallbackManagerForRetrieverRun
 from langchain_core.messages import BaseMessage
 from langchain_core.output_parsers import StrOutputParser
 from langchain_core.prompts import ChatPromptTemplate
+from langchain_core.retrievers import BaseRetriever
+from langchain_core.runnables import RunnableLambda
 from langchain_community.vectorstores import FAISS
 
 from utils.model_loader import ModelLoader
+from utils.config_loader import get_config, subscribe
 from exception.custom_exception import CustomException
 from logger import GLOBAL_LOGGER as log
 from prompt.prompt_library import PROMPT_REGISTRY
 from model.models import PromptType
+from utils.metrics import stage
+from utils.llm_usage import with_usage, fit_to_budget
+from utils.rate_limiter import RateLimitedEmbeddings, estimate_tokens
+from utils.hierarchical_index import HierarchicalIndex, VECTORS_SCORED, HIERARCHY_JSON
+from utils.storage_backend import pinned_dir
+from utils.index_generations import IndexGenerations
+
+
+def _timed_step(name: str, runnable):
+    """Wrap a runnable so each execution is recorded as a pipeline stage."""
+    def _run(inputs, config):
+        with stage(name):
+            return runnable.invoke(inputs, config)
+    return RunnableLambda(_run, name=name)
+
+
+# ---------- Loaded-index cache ----------
+_VS_CACHE: "OrderedDict[Tuple[str, str], Tuple[float, FAISS]]" = OrderedDict()
+_VS_CACHE_SIZE = int(os.getenv("FAISS_CACHE_SIZE", "16"))
+_VS_LOCK = threading.Lock()
+
+
+def _drop_cached_vectorstores(old, new, changed):
+    # cached indexes hold the previous embedding client
+    with _VS_LOCK:
+        _VS_CACHE.clear()
+
+
+subscribe(_drop_cached_vectorstores, {"embedding_model"})
+
+
+def _cache_put(cache: OrderedDict, key, value):
+    """Insert as most recently used and trim to FAISS_CACHE_SIZE; caller holds _VS_LOCK."""
+    cache[key] = value
+    cache.move_to_end(key)
+    while len(cache) > _VS_CACHE_SIZE:
+        cache.popitem(last=False)
+
+
+def drop_cached_index(index_path: str):
+    """Forget a deleted session's loaded index and centroid layer."""
+    folder = str(Path(index_path).resolve())
+    with _VS_LOCK:
+        for cache in (_VS_CACHE, _HIER_CACHE):
+            for key in [k for k in cache if k[0] == folder]:
+                del cache[key]
+
+
+def load_vectorstore(index_path: str, embeddings, index_name: str = "index") -> FAISS:
+    """
+    Load the current generation of a FAISS index (a consistent snapshot even while a writer
+    appends), reusing the in-memory copy while it is still current.
+    Keeps the most recently used FAISS_CACHE_SIZE indexes.
+    """
+    folder = Path(index_path)
+    generations = IndexGenerations(folder, index_name)
+    key = (str(folder.resolve()), index_name)
+    for attempt in range(3):
+        gen = generations.current()
+        if gen is None:
+            raise FileNotFoundError(f"No FAISS index in {index_path}")
+        try:
+            version = (gen.prefix, max((folder / f"{gen.prefix}{ext}").stat().st_mtime for ext in (".faiss", ".pkl")))
+            with _VS_LOCK:
+                hit = _VS_CACHE.get(key)
+                if hit and hit[0] == version:
+                    _VS_CACHE.move_to_end(key)
+                    return hit[1]
+            with stage("faiss.load"):
+                vectorstore = FAISS.load_local(
+                    index_path,
+                    embeddings,
+                    index_name=gen.prefix,
+                    allow_dangerous_deserialization=True,
+                )
+            break
+        except (OSError, RuntimeError):
+            # the generation was pruned by writers moving on; retry with the new pointer
+            latest = generations.current()
+            if attempt == 2 or latest is None or latest.prefix == gen.prefix:
+                raise
+    with _VS_LOCK:
+        _cache_put(_VS_CACHE, key, (version, vectorstore))
+    return vectorstore
+
+
+# ---------- Batched retrieval ----------
+def embed_queries(embeddings, questions: List[str]) -> List[List[float]]:
+    """Embed many questions in one provider call, using the query task type where supported."""
+    with stage("faiss.embed_query"):
+        if isinstance(embeddings, RateLimitedEmbeddings):
+            # charge the batch once, whichever call signature the client accepts
+            embeddings.limiter.acquire(sum(estimate_tokens(q) for q in questions))
+            embeddings = embeddings.inner
+        try:
+            return embeddings.embed_documents(questions, task_type="RETRIEVAL_QUERY")
+        except TypeError:
+            return embeddings.embed_documents(questions)
+
+
+def search_many(vectorstore: FAISS, vectors, k: int) -> List[List[Document]]:
+    """Top-k documents for each query vector from a single FAISS search call."""
+    import faiss
+
+    q = np.asarray(vectors, dtype=np.float32)
+    if getattr(vectorstore, "_normalize_L2", False):
+        faiss.normalize_L2(q)
+    with stage("faiss.search"):
+        _, ids = vectorstore.index.search(q, k)
+    VECTORS_SCORED.observe(vectorstore.index.ntotal, mode="flat")
+    return _docs_for_positions(vectorstore, ids)
+
+
+def _docs_for_positions(vectorstore: FAISS, ids) -> List[List[Document]]:
+    results = []
+    for row in ids:
+        docs = []
+        for i in row:
+            if i == -1:
+                continue
+            doc = vectorstore.docstore.search(vectorstore.index_to_docstore_id[int(i)])
+            if isinstance(doc, Document):
+                docs.append(doc)
+        results.append(docs)
+    return results
+
+
+# ---------- Coarse-to-fine retrieval ----------
+# one entry per index folder (replaced when a new generation is published), LRU-bounded
+# like _VS_CACHE and guarded by the same lock
+_HIER_CACHE: "OrderedDict[Tuple[str, str], Tuple[Tuple[str, float], HierarchicalIndex]]" = OrderedDict()
+
+
+def load_hierarchy(index_path: str, index_name: str = "index") -> Optional[HierarchicalIndex]:
+    """Centroid layer of the current index generation, if any (cached per index folder)."""
+    gen = IndexGenerations(index_path, index_name).current()
+    if gen is None:
+        return None
+    meta = Path(index_path) / f"{gen.hierarchy_prefix}{HIERARCHY_JSON}"
+    if not meta.exists():
+        return None
+    key, version = (str(Path(index_path).resolve()), index_name), (gen.prefix, meta.stat().st_mtime)
+    with _VS_LOCK:
+        hit = _HIER_CACHE.get(key)
+        if hit and hit[0] == version:
+            _HIER_CACHE.move_to_end(key)
+            return hit[1]
+    hierarchy = HierarchicalIndex.load(Path(index_path), gen.hierarchy_prefix)
+    with _VS_LOCK:
+        _cache_put(_HIER_CACHE, key, (version, hierarchy))
+    return hierarchy
+
+
+class HierarchicalRetriever(BaseRetriever):
+    """Selects the top documents, then their top sections, and scores only those sections' chunks."""
+    vectorstore: Any
+    hierarchy: Any
+    k: int = 5
+    top_docs: int = 5
+    top_sections: int = 20
+
+    @property
+    def embeddings(self):
+        return self.vectorstore.embeddings
+
+    def search_by_vectors(self, vectors, k: Optional[int] = None) -> List[List[Document]]:
+        k = k or self.k
+        q = np.asarray(vectors, dtype=np.float32)
+        if getattr(self.vectorstore, "_normalize_L2", False):
+            q = q / np.linalg.norm(q, axis=1, keepdims=True)
+        try:
+            with stage("faiss.search"):
+                rows = self.hierarchy.search(self.vectorstore.index, q, k, self.top_docs, self.top_sections)
+        except RuntimeError as e:
+            # codec cannot reconstruct vectors: fall back to a flat search
+            log.warning("Hierarchical search unavailable; using flat search", error=str(e))
+            return search_many(self.vectorstore, vectors, k)
+        return _docs_for_positions(self.vectorstore, [[pos for pos, _ in row] for row in rows])
+
+    def _get_relevant_documents(self, query: str, *, run_manager: CallbackManagerForRetrieverRun) -> List[Document]:
+        with stage("faiss.embed_query"):
+            vector = self.embeddings.embed_query(query)
+        return self.search_by_vectors([vector])[0]
+
+
+def hierarchical_retriever(vectorstore: FAISS, index_path: str, k: int,
+                           index_name: str = "index") -> Optional[HierarchicalRetriever]:
+    """Coarse-to-fine retriever when enabled and the session is large enough, else None (flat search)."""
+    block = get_config().get("hierarchical_retrieval") or {}
+    if not block.get("enabled", True):
+        return None
+    hierarchy = load_hierarchy(index_path, index_name)  # size check below catches a newer generation
+    if hierarchy is None or hierarchy.size != vectorstore.index.ntotal:
+        return None
+    if hierarchy.size < int(block.get("min_chunks", 2000)):
+        return None
+    return HierarchicalRetriever(vectorstore=vectorstore, hierarchy=hierarchy, k=k,
+                                 top_docs=int(block.get("top_docs", 5)),
+                                 top_sections=int(block.get("top_sections", 20)))
 
 
 class ConversationalRAG:
@@ -59,20 +267,17 @@ class ConversationalRAG:
         Load FAISS vectorstore from disk and build retriever + LCEL chain.
         """
         try:
-            if not os.path.isdir(index_path):
-                raise FileNotFoundError(f"FAISS index directory not found: {index_path}")
+            with pinned_dir(index_path) as exists:  # not evicted from the node cache mid-load
+                if not exists:
+                    raise FileNotFoundError(f"FAISS index directory not found: {index_path}")
 
-            embeddings = ModelLoader().load_embeddings()
-            vectorstore = FAISS.load_local(
-                index_path,
-                embeddings,
-                index_name=index_name,
-                allow_dangerous_deserialization=True, 
-            )
-            if search_kwargs is None:
-                search_kwargs = {"k": k}
+                embeddings = ModelLoader().load_embeddings()
+                vectorstore = load_vectorstore(index_path, embeddings, index_name=index_name)
+                if search_kwargs is None:
+                    search_kwargs = {"k": k}
 
-            self.retriever = vectorstore.as_retriever(
+                hierarchical = hierarchical_retriever(vectorstore, index_path, k, index_name) if search_type == "similarity" else None
+            self.retriever = hierarchical or vectorstore.as_retriever(
                 search_type=search_type, search_kwargs=search_kwargs
             )
             self._build_lcel_chain()
@@ -82,6 +287,7 @@ class ConversationalRAG:
                 index_path=index_path,
                 index_name=index_name,
                 k=k,
+                hierarchical=hierarchical is not None,
                 session_id=self.session_id,
             )
             return self.retriever
@@ -119,6 +325,51 @@ class ConversationalRAG:
             raise CustomException("Invocation error in ConversationalRAG", sys)
 
 
+    # -------- Batch (standalone questions) --------
+    def retrieve_many(self, questions: List[str], k: Optional[int] = None) -> List[List[Document]]:
+        """
+        Retrieve context for many standalone questions: one embeddings call and one FAISS search.
+        There is no chat history, so the question-rewrite LLM call is skipped.
+        """
+        r = self.retriever
+        if r is None:
+            raise CustomException("Retriever not initialized. Call load_retriever_from_faiss() first.", sys)
+        if hasattr(r, "search_by_vectors"):
+            return r.search_by_vectors(embed_queries(r.embeddings, questions), k=k)
+        vectorstore = getattr(r, "vectorstore", None)
+        if isinstance(vectorstore, FAISS):
+            k = k or (getattr(r, "search_kwargs", None) or {}).get("k", 5)
+            return search_many(vectorstore, embed_queries(vectorstore.embeddings, questions), k)
+        with stage("chat.retrieve"):
+            return r.batch(questions)
+
+    def _answer_inputs(self, questions: List[str], contexts: List[List[Document]]) -> List[Dict[str, Any]]:
+        return [{"input": q, "chat_history": [], "context": self._budgeted_context(self._format_docs(docs))}
+                for q, docs in zip(questions, contexts)]
+
+    def _answer_chain(self):
+        return _timed_step("chat.answer", self.qa_prompt | self._usage_llm("chat.answer") | StrOutputParser())
+
+    async def abatch_answers(self, questions: List[str], contexts: List[List[Document]],
+                             max_concurrency: int = 4) -> List[Any]:
+        """Answers in question order; a failed question yields its exception instead of an answer."""
+        return await self._answer_chain().abatch(
+            self._answer_inputs(questions, contexts),
+            config={"max_concurrency": max_concurrency},
+            return_exceptions=True,
+        )
+
+    async def aanswers_as_completed(self, questions: List[str], contexts: List[List[Document]],
+                                    max_concurrency: int = 4) -> AsyncIterator[Tuple[int, Any]]:
+        """Yield (question index, answer or exception) as each answer finishes."""
+        async for i, answer in self._answer_chain().abatch_as_completed(
+            self._answer_inputs(questions, contexts),
+            config={"max_concurrency": max_concurrency},
+            return_exceptions=True,
+        ):
+            yield i, answer
+
+
 # -------- Helper methods --------
     def _load_llm(self):
         try:
@@ -135,21 +386,29 @@ class ConversationalRAG:
     def _format_docs(docs) -> str:
         return "\n\n".join(getattr(d, "page_content", str(d)) for d in docs)
 
+    def _usage_llm(self, feature: str):
+        return with_usage(self.llm, feature, session_id=self.session_id)
+
+    def _budgeted_context(self, context: str) -> str:
+        return fit_to_budget(context, "chat.answer", session_id=self.session_id)
+
     def _build_lcel_chain(self):
         try:
             if self.retriever is None:
                 raise CustomException("No retriever set before building chain", sys)
 
             # 1) Rewrite user question with chat history context
-            question_rewriter = (
+            question_rewriter = _timed_step(
+                "chat.rewrite",
                 {"input": itemgetter("input"), "chat_history": itemgetter("chat_history")}
                 | self.contextualize_prompt
-                | self.llm
-                | StrOutputParser()
+                | self._usage_llm("chat.rewrite")
+                | StrOutputParser(),
             )
 
             # 2) Retrieve docs for rewritten question
-            retrieve_docs = question_rewriter | self.retriever | self._format_docs
+            retrieve_docs = (question_rewriter | _timed_step("chat.retrieve", self.retriever)
+                             | self._format_docs | self._budgeted_context)
 
             # 3) Answer using retrieved context + original input + chat history
             self.chain = (
@@ -158,9 +417,7 @@ class ConversationalRAG:
                     "input": itemgetter("input"),
                     "chat_history": itemgetter("chat_history"),
                 }
-                | self.qa_prompt
-                | self.llm
-                | StrOutputParser()
+                | _timed_step("chat.answer", self.qa_prompt | self._usage_llm("chat.answer") | StrOutputParser())
             )
             log.info("LCEL graph built successfully", session_id=self.session_id)
 
@@ -1,37 +1,48 @@
+from __future__ import annotations
+import re
 import sys
+from typing import Any, Dict, List, Tuple, TYPE_CHECKING
 from dotenv import load_dotenv
-import pandas as pd
-
-from langchain_core.output_parsers import JsonOutputParser
-from langchain.output_parsers import OutputFixingParser
 
 from model.models import *
 from utils.model_loader import ModelLoader
 from logger import GLOBAL_LOGGER as log
+from utils.metrics import stage
+from utils.llm_usage import with_usage, fit_to_budget
+from utils.config_loader import get_config
+from utils.structured_output import StructuredChain, native_json_supported, structured_parser
 from exception.custom_exception import CustomException
 from prompt.prompt_library import PROMPT_REGISTRY
 
+if TYPE_CHECKING:
+    import pandas as pd
+
 
 class DocumentComparatorLLM:
     def __init__(self):
         load_dotenv()
         self.loader = ModelLoader()
-        self.llm = self.loader.load_llm()
-        self.parser = JsonOutputParser(pydantic_object=SummaryResponse)
-        self.fixing_parser = OutputFixingParser.from_llm(parser=self.parser, llm=self.llm)
+        base_llm = self.loader.load_llm()
+        self.llm = with_usage(base_llm, "compare")
+        options = get_config().get("structured_output") or {}
+        native = options.get("native", True) and native_json_supported(SummaryResponse)
+        json_llm = with_usage(self.loader.load_llm(json_mode=True), "compare") if native else None
+        fixer_llm = with_usage(base_llm, "compare.fix") if options.get("llm_fix", True) else None
+        self.parser = structured_parser(SummaryResponse, "compare", fixer_llm)
         self.prompt = PROMPT_REGISTRY[PromptType.DOCUMENT_COMPARISON.value]
-        self.chain = self.prompt | self.llm | self.parser
-        log.info("DocumentComparatorLLM initialized", model=self.llm)
+        self.chain = StructuredChain(self.prompt, self.parser, self.llm, json_llm)
+        log.info("DocumentComparatorLLM initialized", model=base_llm)
 
 
     def compare_documents(self, combined_docs: str) -> pd.DataFrame:
         try:
             inputs = {
-                "combined_docs": combined_docs,
+                "combined_docs": fit_to_budget(combined_docs, "compare"),
                 "format_instruction": self.parser.get_format_instructions()
             }
             log.info("Invoking document comparison LLM chain")
-            response = self.chain.invoke(inputs)
+            with stage("compare.llm"):
+                response = self.chain.invoke(inputs)
             log.info("Chain invoked successfully", response_preview=str(response)[:200])
             return self._format_response(response)
         
@@ -40,11 +51,73 @@ class DocumentComparatorLLM:
             raise CustomException("Error comparing documents", sys)
         
 
+    @staticmethod
+    def pair_documents(old: Dict[str, Any], new: Dict[str, Any]) -> Tuple[str, List[int]]:
+        """
+        Combined text for one version pair in the `combined_docs` layout, holding only pages
+        whose fingerprints differ, plus the page numbers that are unchanged.
+        """
+        total = max(len(old["pages"]), len(new["pages"]))
+        unchanged, changed = [], []
+        for n in range(total):
+            a = old["fingerprints"][n] if n < len(old["fingerprints"]) else None
+            b = new["fingerprints"][n] if n < len(new["fingerprints"]) else None
+            (unchanged if a == b else changed).append(n)
+
+        def render(version):
+            parts = [f"\n --- Page {n + 1} --- \n{version['pages'][n]}" for n in changed if n < len(version["pages"])]
+            return f"Document: {version['name']}\n" + "\n".join(parts)
+
+        combined = f"{render(old)}\n\n{render(new)}" if changed else ""
+        return combined, [n + 1 for n in unchanged]
+
+    @staticmethod
+    def _page_number(row: Dict[str, Any]) -> int:
+        m = re.search(r"\d+", str(row.get("Page", "")))
+        return int(m.group()) if m else 10**9
+
+    async def compare_versions(self, versions: List[Dict[str, Any]], max_concurrency: int = 4) -> List[Dict[str, Any]]:
+        """
+        Change tables for each successive pair (v1->v2, v2->v3, ...) in one job.
+        Unchanged pages are reported as NO CHANGE without asking the LLM, pairs with no
+        changed page skip the LLM entirely, and the remaining pair calls run concurrently.
+        """
+        pairs = []
+        for old, new in zip(versions, versions[1:]):
+            combined, unchanged = self.pair_documents(old, new)
+            pairs.append({"from": old["name"], "to": new["name"], "combined": combined, "unchanged": unchanged})
+
+        todo = [p for p in pairs if p["combined"]]
+        inputs = [{"combined_docs": fit_to_budget(p["combined"], "compare"), "format_instruction": self.parser.get_format_instructions()}
+                  for p in todo]
+        log.info("Invoking version comparison", pairs=len(pairs), llm_calls=len(todo), concurrency=max_concurrency)
+        with stage("compare.llm"):
+            responses = await self.chain.abatch(inputs, config={"max_concurrency": max(1, max_concurrency)},
+                                                return_exceptions=True) if inputs else []
+        by_pair = {id(p): r for p, r in zip(todo, responses)}
+
+        results = []
+        for p in pairs:
+            rows = [{"Page": str(n), "Changes": "NO CHANGE"} for n in p["unchanged"]]
+            entry = {"from": p["from"], "to": p["to"], "unchanged_pages": len(p["unchanged"])}
+            response = by_pair.get(id(p), [])
+            if isinstance(response, Exception):
+                log.error("Version pair comparison failed", pair=[p["from"], p["to"]], error=str(response))
+                entry["error"] = str(response)
+            else:
+                rows.extend(response if isinstance(response, list) else [response])
+            entry["rows"] = sorted(rows, key=self._page_number)
+            results.append(entry)
+        log.info("Version comparison completed", pairs=len(results), failed=sum("error" in r for r in results))
+        return results
+
     def _format_response(self, response_parsed: list[dict]) -> pd.DataFrame: #type: ignore
         """ Formats the LLM response into a pandas DataFrame (structured format)"""
+        import pandas as pd  # heavy; only needed once a comparison result exists
+
         try:
             df = pd.DataFrame(response_parsed)
-            log.info("Response formatted into DataFrame", dataframe=df) 
+            log.info("Response formatted into DataFrame", rows=len(df), columns=list(df.columns))
             return df
         
         except Exception as e:
@@ -0,0 +1,41 @@
+import os
+import shutil
+import tempfile
+
+import pytest
+
+# Runtime output of the app (logs, session catalog, usage ledger, indexes, uploads) goes to a
+# per-run temp dir instead of the working tree. Set at configure time: the logger and api.main
+# read these when the test module imports them.
+_RUNTIME_DIR = None
+_RUNTIME_PATHS = {
+    "LOG_DIR": "logs",
+    "SESSION_CATALOG_PATH": "session_catalog.db",
+    "LLM_USAGE_DB_PATH": "llm_usage.db",
+    "FAISS_BASE": "faiss_index",
+    "UPLOAD_BASE": "data",
+    "DATA_STORAGE_PATH": os.path.join("data", "document_analysis"),
+}
+
+
+def pytest_configure(config):
+    global _RUNTIME_DIR
+    _RUNTIME_DIR = tempfile.mkdtemp(prefix="docportal-tests-")
+    for name, rel in _RUNTIME_PATHS.items():
+        os.environ[name] = os.path.join(_RUNTIME_DIR, rel)
+
+
+def pytest_unconfigure(config):
+    from logger.custom_logger import stop_pipeline
+
+    stop_pipeline()  # the log file lives in the runtime dir
+    if _RUNTIME_DIR:
+        shutil.rmtree(_RUNTIME_DIR, ignore_errors=True)
+
+
+@pytest.fixture
+def fake_api_keys(monkeypatch):
+    """Provider keys for tests that build ModelLoader-backed components with the clients faked out."""
+    monkeypatch.delenv("API_KEYS", raising=False)
+    monkeypatch.setenv("GROQ_API_KEY", "test-groq-key")
+    monkeypatch.setenv("GOOGLE_API_KEY", "test-google-key")
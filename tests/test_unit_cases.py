@@ -8,3 +8,1050 @@ def test_home():
     response = client.get("/")  
     assert response.status_code == 200
     assert "Document Portal" in response.text
+
+
+def test_vector_storage_fp16_halves_index_size():
+    import numpy as np
+    from utils.faiss_storage import VectorStorageSpec, recall_size_report
+
+    vectors = np.random.default_rng(0).normal(size=(200, 64)).astype("float32")
+    rows = recall_size_report(vectors, vectors[:10], [VectorStorageSpec("flat"), VectorStorageSpec("fp16")], k=5)
+    flat, fp16 = rows
+    assert fp16["index_bytes"] < flat["index_bytes"] * 0.6
+    assert fp16["recall@5"] >= 0.95
+
+
+def test_api_import_keeps_heavy_libraries_lazy():
+    from benchmarks.import_budget import measure
+
+    (result,) = measure(runs=1)
+    assert result["heavy"] == []
+
+
+def test_staged_pipeline_keeps_order_and_propagates_failure():
+    from utils.pipeline import StagedPipeline
+
+    double = ("double", lambda xs: (x * 2 for x in xs))
+    total = ("total", lambda xs: [sum(xs)])
+    assert StagedPipeline("t", range(1000), [double, total], queue_size=2).run() == [999000]
+
+    def boom(xs):
+        for x in xs:
+            if x == 500:
+                raise ValueError("bad item")
+            yield x
+
+    with pytest.raises(ValueError, match="bad item"):
+        StagedPipeline("t", range(1000), [("boom", boom), double, total], queue_size=2).run()
+
+
+def test_rate_limiter_queues_then_rejects_after_timeout():
+    import asyncio
+    from langchain_community.embeddings import DeterministicFakeEmbedding
+    from utils.rate_limiter import RateLimitedEmbeddings, RateLimiter, RateLimitExceeded
+
+    now = [0.0]
+    limiter = RateLimiter("test", "model", rpm=120, tpm=None, timeout=0.3, clock=lambda: now[0])  # 2 requests/s
+    for _ in range(120):
+        limiter.acquire()
+    with pytest.raises(RateLimitExceeded) as rejected:
+        limiter.acquire()  # next slot is 0.5s away, beyond the 0.3s queue timeout
+    assert rejected.value.retry_after == pytest.approx(0.5)
+
+    now[0] += 0.5
+    limiter.acquire()  # refilled by the clock, no waiting
+
+    async def on_loop():
+        embeddings = RateLimitedEmbeddings(DeterministicFakeEmbedding(size=8), limiter)
+        now[0] += 0.5
+        with pytest.raises(RuntimeError, match="event loop"):
+            embeddings.embed_query("q")  # a sync client call on the loop is a caller bug, not a 429
+        assert limiter.acquire(block=False)  # the budget it would have taken is untouched
+        now[0] += 0.5
+        assert len(await embeddings.aembed_query("q")) == 8
+
+    asyncio.run(on_loop())
+
+
+def test_hierarchical_index_matches_flat_top_hit_with_fewer_vectors():
+    import faiss
+    import numpy as np
+    from utils.hierarchical_index import HierarchicalIndex
+
+    rng = np.random.default_rng(0)
+    # 20 documents x 5 sections (4 pages of 10 chunks), each section clustered around its own center
+    docs = rng.normal(size=(20, 1, 32)) * 5
+    sections = (docs + rng.normal(size=(20, 5, 32)) * 2).reshape(100, 32)
+    vectors = np.repeat(sections, 40, axis=0) + rng.normal(size=(4000, 32)) * 0.5
+    vectors = vectors.astype("float32")
+    metadatas = [{"source": f"doc{i // 200}", "page": (i % 200) // 10} for i in range(len(vectors))]
+    index = faiss.IndexFlatL2(32)
+    index.add(vectors)
+    hierarchy = HierarchicalIndex(pages_per_section=4)
+    hierarchy.add(metadatas, vectors, range(len(vectors)))
+
+    queries = vectors[::400] + 0.01
+    _, flat = index.search(queries, 1)
+    hits = hierarchy.search(index, queries, k=1, top_docs=2, top_sections=3)
+    assert [row[0][0] for row in hits] == flat[:, 0].tolist()
+    ids, centroids = hierarchy.candidates(queries[0], top_docs=2, top_sections=3, min_ids=1)
+    assert len(ids) + centroids < len(vectors) // 10
+
+
+def test_streaming_text_loader_yields_bounded_contiguous_segments(tmp_path):
+    from utils.document_ops import StreamingTextLoader
+
+    path = tmp_path / "big.txt"
+    text = "".join(f"line {i} héllo\n" for i in range(5000)) + "é" * 3000  # last line has no newline
+    path.write_text(text, encoding="utf-8")
+    segments = list(StreamingTextLoader(str(path), segment_chars=4096).lazy_load())
+    assert len(segments) > 10
+    assert "".join(s.page_content for s in segments) == text
+    assert segments[0].metadata["byte_start"] == 0 and segments[-1].metadata["byte_end"] == path.stat().st_size
+    assert all(a.metadata["byte_end"] == b.metadata["byte_start"] for a, b in zip(segments, segments[1:]))
+    assert max(s.metadata["byte_end"] - s.metadata["byte_start"] for s in segments) < 2 * 4096
+
+
+def test_streaming_docx_loader_yields_bounded_segments_in_paragraph_order(tmp_path):
+    import zipfile
+    from utils.document_ops import StreamingDocxLoader
+
+    paragraphs = [f"Paragraph {i} " + "word " * (i % 7 * 10) for i in range(400)]
+    paragraphs[10] = paragraphs[25] = ""  # empty paragraphs are counted but not emitted
+    body = "".join(
+        # two runs per paragraph (text split mid-way) plus a tab, as Word writes them
+        f"<w:p><w:r><w:t>{p[:5]}</w:t></w:r><w:r><w:tab/><w:t>{p[5:]}</w:t></w:r></w:p>" if p else "<w:p/>"
+        for p in paragraphs)
+    path = tmp_path / "big.docx"
+    with zipfile.ZipFile(path, "w") as zf:
+        zf.writestr("word/document.xml", '<w:document xmlns:w="http://schemas.openxmlformats.org/'
+                    f'wordprocessingml/2006/main"><w:body>{body}</w:body></w:document>')
+
+    segments = list(StreamingDocxLoader(str(path), segment_chars=1000).lazy_load())
+    expected = [p[:5] + "\t" + p[5:] for p in paragraphs if p]
+    assert len(segments) > 10
+    assert "\n\n".join(s.page_content for s in segments) == "\n\n".join(expected)  # every paragraph, in order
+    assert [s.metadata["segment"] for s in segments] == list(range(len(segments)))
+    assert segments[0].metadata["paragraph_start"] == 0 and segments[-1].metadata["paragraph_end"] == 400
+    assert all(a.metadata["paragraph_end"] == b.metadata["paragraph_start"] for a, b in zip(segments, segments[1:]))
+    longest = max(len(p) for p in expected)
+    assert all(len(s.page_content) < 1000 + longest for s in segments)  # closed at the first paragraph past the limit
+
+
+def test_node_cache_fetches_changed_files_and_evicts_lru(tmp_path):
+    import time
+    from utils.storage_backend import LocalBackend, NodeCache
+
+    shared = LocalBackend(str(tmp_path / "bucket"))
+    a = NodeCache(shared, workdir=str(tmp_path / "a"), revalidate_seconds=0)
+    b = NodeCache(shared, max_bytes=1500, workdir=str(tmp_path / "b"), revalidate_seconds=0, min_idle_seconds=0)
+    for s in ("s1", "s2"):
+        folder = tmp_path / "a" / "faiss_index" / s
+        folder.mkdir(parents=True)
+        (folder / "index.faiss").write_bytes(b"x" * 1000)
+        a.publish(folder)
+
+    s1 = tmp_path / "b" / "faiss_index" / "s1"
+    assert b.fetch(s1) and (s1 / "index.faiss").read_bytes() == b"x" * 1000
+    assert not b.fetch(tmp_path / "b" / "faiss_index" / "missing")
+
+    time.sleep(0.01)
+    (tmp_path / "a" / "faiss_index" / "s1" / "index.faiss").write_bytes(b"y" * 1000)
+    a.publish(tmp_path / "a" / "faiss_index" / "s1")
+    b.fetch(s1)
+    assert (s1 / "index.faiss").read_bytes() == b"y" * 1000
+
+    b.fetch(tmp_path / "b" / "faiss_index" / "s2")  # over 1500 bytes: s1 is evicted
+    assert not s1.exists() and b.fetch(s1) and s1.exists()
+
+
+def test_node_cache_never_evicts_pinned_or_recently_used_folders(tmp_path):
+    import time
+    from utils.storage_backend import LocalBackend, NodeCache
+
+    shared = LocalBackend(str(tmp_path / "bucket"))
+    writer = NodeCache(shared, workdir=str(tmp_path / "a"))
+    for s in ("s1", "s2", "s3"):
+        folder = tmp_path / "a" / "faiss_index" / s
+        folder.mkdir(parents=True)
+        (folder / "index.faiss").write_bytes(b"x" * 1000)
+        writer.publish(folder)
+
+    node = NodeCache(shared, max_bytes=1500, workdir=str(tmp_path / "b"), revalidate_seconds=0, min_idle_seconds=0)
+    s1, s2, s3 = (tmp_path / "b" / "faiss_index" / s for s in ("s1", "s2", "s3"))
+    with node.pinned(s1) as exists:
+        assert exists
+        node.fetch(s2)  # over budget, but s1 is being loaded
+        assert (s1 / "index.faiss").read_bytes() == b"x" * 1000
+    node.fetch(s3)  # unpinned: the least recently used folders go
+    assert not s1.exists() and not s2.exists() and s3.exists()
+
+    node.min_idle_seconds = 60
+    node.fetch(s1)  # s3 was just used: kept over budget rather than pulled from under a reader
+    assert s1.exists() and s3.exists()
+    node.min_idle_seconds = 0
+    time.sleep(0.01)
+    node.fetch(s2)
+    assert s2.exists() and not s1.exists() and not s3.exists()
+
+
+def test_index_generations_publish_atomically_and_keep_recent(tmp_path):
+    from utils.index_generations import IndexGenerations
+
+    gens = IndexGenerations(tmp_path, keep=2)
+    assert gens.current() is None
+    for _ in range(4):
+        with gens.write_lock():
+            gen = gens.next()
+            for ext in (".faiss", ".pkl"):
+                (tmp_path / f"{gen.prefix}{ext}").write_text(str(gen.number))
+            snapshot = gens.current()  # readers still see the previous generation
+            gens.publish(gen)
+        assert snapshot is None or snapshot.number == gen.number - 1
+    assert gens.current().prefix == "index.g000004"
+    assert sorted(p.name for p in tmp_path.glob("index.*")) == [
+        "index.g000003.faiss", "index.g000003.pkl", "index.g000004.faiss", "index.g000004.pkl"]
+
+
+def test_llm_usage_is_recorded_and_session_budget_rejects(tmp_path, monkeypatch):
+    from langchain_core.language_models.fake_chat_models import FakeListChatModel
+    import utils.llm_usage as usage
+
+    budgets = {"enabled": True, "session_tokens": 40, "degrade_at": 0.5, "degrade_max_input_tokens": 5}
+    monkeypatch.setattr(usage, "get_config", lambda: {"llm_budgets": budgets})
+    monkeypatch.setattr(usage, "_ledger", usage.UsageLedger(str(tmp_path / "usage.db")))
+    llm = usage.with_usage(FakeListChatModel(responses=["x" * 40] * 3), "analyze", session_id="s1")
+
+    llm.invoke("y" * 40)
+    (row,) = usage.get_ledger().summary(session_id="s1")
+    assert (row["feature"], row["calls"], row["prompt_tokens"], row["completion_tokens"]) == ("analyze", 1, 11, 11)
+    assert usage.fit_to_budget("z" * 100, "analyze", session_id="s1") == "z" * 20  # past degrade_at: trimmed
+    with pytest.raises(usage.BudgetExceeded):
+        llm.invoke("y" * 100)  # 22 used + ~26 estimated > 40
+
+
+def test_llm_usage_is_buffered_and_budget_totals_stay_current(tmp_path):
+    import sqlite3
+    from utils.llm_usage import UsageLedger
+
+    db = tmp_path / "usage.db"
+    worker = UsageLedger(str(db), flush_seconds=3600)  # only explicit flushes in this test
+    other = UsageLedger(str(db), flush_seconds=3600)   # a second uvicorn worker
+    assert worker.session_tokens("s1") == 0
+    worker.record("s1", "/analyze", "analyze", "groq", 10, 5, 0.1)
+    worker.record("s1", "/analyze", "analyze", "groq", 20, 5, 0.1)
+    assert sqlite3.connect(str(db)).execute("SELECT COUNT(*) FROM llm_usage").fetchone() == (0,)  # nothing written yet
+    assert worker.session_tokens("s1") == 40 and worker.day_tokens() == 40  # budgets see buffered calls
+
+    worker.flush()
+    assert other.session_tokens("s1") == 40
+    other.record("s1", "/compare", "compare", "groq", 7, 3, 0.1)
+    other.flush()
+    worker.flush()  # re-reads the totals in use: the other worker's usage counts here too
+    assert worker.session_tokens("s1") == 50
+    rows = {r["endpoint"]: (r["calls"], r["prompt_tokens"], r["completion_tokens"]) for r in worker.summary(session_id="s1")}
+    assert rows == {"/analyze": (2, 30, 10), "/compare": (1, 7, 3)}
+
+
+def test_load_test_summary_reports_percentiles_and_errors():
+    from benchmarks.load_test import summarize
+
+    samples = [("chat_query", i / 100, 200) for i in range(1, 101)] + [("analyze", 2.0, 500)]
+    report = summarize(samples, elapsed=10)
+    assert report["overall"]["requests"] == 101 and report["overall"]["throughput_rps"] == 10.1
+    q = report["endpoints"]["chat_query"]
+    assert (q["p50_ms"], q["p95_ms"], q["p99_ms"], q["error_rate"]) == (500.0, 950.0, 990.0, 0.0)
+    assert report["endpoints"]["analyze"]["error_rate"] == 1.0
+
+
+def test_sampling_profiler_folds_project_stacks_into_bounded_ring(tmp_path):
+    import os
+    import time
+    from utils.profiler import ProfileRing, SamplingProfiler
+
+    def busy():
+        end = time.perf_counter() + 0.2
+        while time.perf_counter() < end:
+            pass
+
+    profiler = SamplingProfiler(interval=0.002).start()
+    busy()
+    folded = profiler.stop().folded()
+    assert "busy (tests/test_unit_cases.py" in folded and folded.splitlines()[0].rsplit(" ", 1)[1].isdigit()
+
+    ring = ProfileRing(tmp_path, max_profiles=3)
+    for i in range(5):
+        ring.save(f"p{i}.folded", folded)
+        os.utime(tmp_path / f"p{i}.folded", (i, i))
+    assert [p["name"] for p in ring.list()] == ["p4.folded", "p3.folded", "p2.folded"]
+
+
+def test_memory_tracking_records_stage_high_water_mark():
+    import time
+    from utils import memory_tracking
+    from utils.metrics import REGISTRY, stage
+
+    memory_tracking.configure({"memory_tracking": {
+        "enabled": True, "tracemalloc": True, "threshold_mb": 4, "sample_interval_ms": 5}})
+    try:
+        with stage("test.alloc"):
+            buf = bytearray(8 * 2**20)
+            time.sleep(0.05)
+            del buf  # freed before the stage ends: only the sampler saw the peak
+    finally:
+        memory_tracking.configure({})
+    rendered = REGISTRY.render()
+    peak = next(l for l in rendered.splitlines()
+                if l.startswith('docportal_memory_peak_alloc_bytes_sum{kind="stage",name="test.alloc"}'))
+    assert float(peak.split()[-1]) >= 8 * 2**20
+    assert 'docportal_memory_threshold_crossed_total{kind="stage",name="test.alloc"} 1' in rendered
+
+
+def test_structured_output_repairs_locally_before_failing():
+    from langchain_core.exceptions import OutputParserException
+    from model.models import ChangeFormat
+    from utils.structured_output import parse_structured
+
+    reply = '<think>pages differ</think>Here you go:\n```json\n{"Page": "2", "Changes": "a, b",}\n```'
+    assert parse_structured(reply, ChangeFormat) == ({"Page": "2", "Changes": "a, b"}, "repaired")
+    assert parse_structured('{"Page": "1", "Changes": "x"}', ChangeFormat)[1] == "direct"
+    with pytest.raises(OutputParserException):
+        parse_structured("no json here", ChangeFormat)
+
+
+def test_local_metadata_reads_pdf_info_and_samples_long_text():
+    from src.document_analyzer.local_metadata import local_metadata, representative_sample
+
+    text = "\n".join(f"\n--- Page {i} ---\nThe results of the study show that it works for the data in this section."
+                     for i in range(1, 201))
+    info = {"title": "Report", "author": "Ann Lee; Bo Chen", "creationDate": "D:20240315101500+01'00'", "page_count": 200}
+    meta = local_metadata(text, info)
+    assert meta["Title"] == "Report" and meta["Author"] == ["Ann Lee", "Bo Chen"]
+    assert meta["DateCreated"] == meta["LastModifiedDate"] == "2024-03-15"
+    assert meta["Language"] == "English" and meta["PageCount"] == 200
+
+    sample = representative_sample(text, 4000)
+    assert len(sample) <= 4100 and sample.startswith("--- Page 1 ---") and "--- Page 180 ---" in sample
+
+
+def test_consolidated_store_isolates_sessions_dedups_and_removes(tmp_path):
+    from langchain.schema import Document
+    from langchain_core.embeddings import DeterministicFakeEmbedding
+    from src.data_ingestion.consolidated_index import ConsolidatedFaissStore
+
+    def docs(session, n):
+        # no row_id: chunks of one file must still be told apart
+        return [Document(page_content=f"{session} chunk {i}", metadata={"source": "a.pdf"}) for i in range(n)]
+
+    ConsolidatedFaissStore._segments.clear()
+    store = ConsolidatedFaissStore(tmp_path, DeterministicFakeEmbedding(size=16), num_shards=1)
+    assert store.add_documents("s1", docs("s1", 5)) == 5
+    assert store.add_documents("s1", docs("s1", 6)) == 1  # only the new chunk
+
+    stale = dict(ConsolidatedFaissStore._segments)
+    ConsolidatedFaissStore._segments.clear()  # another worker with its own copy of the segments
+    assert store.add_documents("s2", docs("s2", 4)) == 4
+    ConsolidatedFaissStore._segments.update(stale)  # the first worker appends next
+    assert store.add_documents("s3", docs("s3", 2)) == 2
+
+    hits = store.search_by_vectors("s2", [store.emb.embed_query("s1 chunk 0")], k=10)[0]
+    assert len(hits) == 4 and all(d.metadata["session_id"] == "s2" for d, _ in hits)
+    assert {d.page_content for d, _ in store.search_by_vectors("s1", [store.emb.embed_query("x")], k=10)[0]} == \
+        {f"s1 chunk {i}" for i in range(6)}
+
+    assert store.remove_session("s1") == 6
+    assert not store.has_session("s1") and store.has_session("s2") and store.has_session("s3")
+    ConsolidatedFaissStore._segments.clear()  # reread from disk
+    assert len(store.search_by_vectors("s3", [store.emb.embed_query("x")], k=10)[0]) == 2
+    assert store.search_by_vectors("s1", [store.emb.embed_query("x")], k=10)[0] == []
+
+
+def test_consolidated_shard_rolls_over_segments_and_bounds_its_cache(tmp_path):
+    from langchain.schema import Document
+    from langchain_core.embeddings import DeterministicFakeEmbedding
+    from src.data_ingestion.consolidated_index import ConsolidatedFaissStore
+
+    def docs(session, n):
+        return [Document(page_content=f"{session} chunk {i}", metadata={"source": f"{session}.pdf", "row_id": i})
+                for i in range(n)]
+
+    ConsolidatedFaissStore._segments.clear()
+    store = ConsolidatedFaissStore(tmp_path, DeterministicFakeEmbedding(size=16), num_shards=1,
+                                   segment_max_vectors=4, max_cached_segments=2)
+    assert store.add_documents("s1", docs("s1", 5)) == 5
+    first = tmp_path / "shard_00" / "seg_000" / "index.faiss"
+    written = first.stat().st_mtime_ns
+    assert store.add_documents("s2", docs("s2", 3)) == 3  # seg_000 is full: goes to seg_001
+    assert store.add_documents("s1", docs("s1", 7)) == 2  # dedup spans segments; seg_001 not full yet
+    assert store.add_documents("s3", docs("s3", 1)) == 1  # seg_002
+    assert sorted(p.name for p in (tmp_path / "shard_00").glob("seg_*")) == ["seg_000", "seg_001", "seg_002"]
+    assert first.stat().st_mtime_ns == written  # appends never rewrite a full segment
+    assert len(ConsolidatedFaissStore._segments) <= 2
+
+    hits = store.search_by_vectors("s1", [store.emb.embed_query("s1 chunk 6")], k=3)[0]
+    assert hits[0][0].page_content == "s1 chunk 6" and len(hits) == 3  # nearest across segments
+    assert {d.page_content for d, _ in store.search_by_vectors("s1", [store.emb.embed_query("x")], k=10)[0]} == \
+        {f"s1 chunk {i}" for i in range(7)}
+    assert store.remove_session("s1") == 7
+    assert not store.has_session("s1") and store.has_session("s2") and store.has_session("s3")
+
+
+def test_consolidated_ingestion_leaves_no_rows_from_unfinished_pipelines(tmp_path):
+    from langchain.schema import Document
+    from langchain_core.embeddings import DeterministicFakeEmbedding
+    from src.data_ingestion.consolidated_index import ConsolidatedFaissStore
+    from src.data_ingestion.data_ingestion import _ConsolidatedWriter
+
+    def embedded(writer, session, n):
+        docs = writer.claim_new([Document(page_content=f"{session} {i}", metadata={"source": f"{session}.pdf", "row_id": i})
+                                 for i in range(n)])
+        writer.add_embedded(docs, store.emb.embed_documents([d.page_content for d in docs]))
+        return len(docs)
+
+    ConsolidatedFaissStore._segments.clear()
+    store = ConsolidatedFaissStore(tmp_path, DeterministicFakeEmbedding(size=16), num_shards=1)
+    failed = _ConsolidatedWriter(store, "s1")
+    assert embedded(failed, "s1", 3) == 3  # written to the shard as it arrives, but still pending
+    other = _ConsolidatedWriter(store, "s2")
+    embedded(other, "s2", 2)
+    other.commit()  # another session's publish must not publish s1's pending ranges
+    assert not store.has_session("s1") and store.has_session("s2")
+    assert store.search_by_vectors("s1", [store.emb.embed_query("s1 0")], k=10)[0] == []
+
+    retry = _ConsolidatedWriter(store, "s1")
+    assert embedded(retry, "s1", 3) == 3  # pending rows do not count as ingested
+    failed.rollback()  # the failed pipeline's vectors leave the shard
+    retry.commit()
+    assert len(store.search_by_vectors("s1", [store.emb.embed_query("s1 0")], k=10)[0]) == 3
+    ConsolidatedFaissStore._segments.clear()  # reread from disk
+    segment = store._shard_segments("s1")[0]
+    segment.reload(data=True)
+    assert segment.size() == segment.index.ntotal == 5 and not segment.pending("s1")
+
+
+def test_structured_chain_uses_native_json_for_objects_only():
+    from langchain_core.language_models.fake_chat_models import FakeListChatModel
+    from langchain_core.prompts import ChatPromptTemplate
+    from langchain_core.runnables import RunnableLambda
+    from model.models import DocumentSummary, SummaryResponse
+    from utils.structured_output import StructuredChain, native_json_supported, structured_parser
+
+    assert native_json_supported(DocumentSummary) and not native_json_supported(SummaryResponse)
+    prompt = ChatPromptTemplate.from_template("{text}")
+    native = FakeListChatModel(responses=['{"Summary": ["s"], "SentimentTone": "Neutral"}'])
+    plain = FakeListChatModel(responses=["unused"])
+    chain = StructuredChain(prompt, structured_parser(DocumentSummary, "test"), plain, native)
+    assert chain.invoke({"text": "doc"}) == {"Summary": ["s"], "SentimentTone": "Neutral"}
+
+    class BadRequest(Exception):
+        status_code = 400
+
+    def failing(error):
+        def call(_):
+            raise error
+        return RunnableLambda(call)
+
+    plain_calls = []
+    plain = RunnableLambda(lambda _: plain_calls.append(1) or '{"Summary": [], "SentimentTone": "Calm"}')
+    parser = structured_parser(DocumentSummary, "test")
+    assert StructuredChain(prompt, parser, plain, failing(BadRequest("json mode unsupported"))).invoke(
+        {"text": "doc"})["SentimentTone"] == "Calm"  # rejected JSON mode: retried without it
+    with pytest.raises(TimeoutError):
+        StructuredChain(prompt, parser, plain, failing(TimeoutError("provider down"))).invoke({"text": "doc"})
+    assert plain_calls == [1]  # an outage is not retried on the plain client
+
+
+def test_bulk_analysis_parses_only_as_far_ahead_as_its_in_flight_slots():
+    import asyncio
+    from src.document_analyzer.data_analyzer import DocumentAnalyzer
+
+    held, peak = set(), [0]
+
+    def parse(path):
+        held.add(path)
+        peak[0] = max(peak[0], len(held))
+        return f"text of {path}", 1, {}
+
+    class Analyzer(DocumentAnalyzer):
+        def __init__(self):
+            pass
+
+        async def aanalyze_document(self, text, pdf_info=None):
+            await asyncio.sleep(0.01)
+            held.discard(text.removeprefix("text of "))
+            return {"Summary": [text]}
+
+    async def run():
+        files = [(f"f{i}.pdf", f"f{i}") for i in range(12)]
+        return [r async for r in Analyzer().analyze_files(files, parse, max_concurrency=1, max_in_flight=3)]
+
+    results = asyncio.run(run())
+    assert sorted(r["index"] for r in results if r["status"] == "ok") == list(range(12))
+    assert peak[0] <= 3  # extracted texts never pile up behind the LLM slot
+
+
+def test_bulk_analysis_keeps_same_named_uploads_apart(tmp_path, monkeypatch, fake_api_keys):
+    import json
+    import fitz
+    from langchain_core.language_models.fake_chat_models import FakeListChatModel
+    import utils.llm_usage as usage
+    from utils.model_loader import ModelLoader
+
+    reply = json.dumps({"Summary": ["s"], "SentimentTone": "Neutral"})
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setenv("DATA_STORAGE_PATH", str(tmp_path / "analysis"))
+    monkeypatch.setattr(usage, "_ledger", usage.UsageLedger(str(tmp_path / "usage.db")))
+    monkeypatch.setattr(ModelLoader, "load_llm", lambda self, json_mode=False: FakeListChatModel(responses=[reply]))
+
+    def pdf(pages):
+        doc = fitz.open()
+        for i in range(pages):
+            doc.new_page().insert_text((72, 72), f"page {i}")
+        return doc.tobytes()
+
+    files = [("files", ("same.pdf", pdf(1))), ("files", ("same.pdf", pdf(3))), ("files", ("notes.txt", b"x"))]
+    lines = [json.loads(l) for l in client.post("/analyze/bulk", files=files).text.splitlines()]
+    items = {l["index"]: l for l in lines if "index" in l}
+    assert items[0]["pages"] == 1 and items[1]["pages"] == 3  # each analyzed with its own bytes
+    assert items[1]["result"]["PageCount"] == 3 and items[2]["status"] == "error"
+    assert lines[-1] == {"done": True, "session_id": lines[-1]["session_id"], "ok": 2, "failed": 1}
+
+
+def test_hierarchy_cache_keeps_one_bounded_entry_per_index(tmp_path, monkeypatch):
+    import numpy as np
+    from src.document_chat import retrieval
+    from utils.hierarchical_index import HierarchicalIndex
+    from utils.index_generations import IndexGenerations
+
+    monkeypatch.setattr(retrieval, "_VS_CACHE_SIZE", 2)
+    retrieval._HIER_CACHE.clear()
+
+    def commit(folder, n):
+        gens = IndexGenerations(folder)
+        gen = gens.next()
+        hierarchy = HierarchicalIndex()
+        hierarchy.add([{"source": "a", "page": 0}] * n, np.ones((n, 4), dtype=np.float32), range(n))
+        hierarchy.save(folder, gen.hierarchy_prefix)
+        for ext in (".faiss", ".pkl"):
+            (folder / f"{gen.prefix}{ext}").write_text("")
+        gens.publish(gen)
+
+    folders = [tmp_path / f"s{i}" for i in range(3)]
+    for folder in folders:
+        folder.mkdir()
+        commit(folder, 2)
+        assert retrieval.load_hierarchy(str(folder)).size == 2
+    commit(folders[2], 3)  # a new generation replaces the folder's entry
+    assert retrieval.load_hierarchy(str(folders[2])).size == 3
+    assert len(retrieval._HIER_CACHE) == 2
+
+    retrieval.drop_cached_index(str(folders[2]))
+    assert [k[0] for k in retrieval._HIER_CACHE] == [str(folders[1].resolve())]
+
+
+def test_hedged_router_hedges_fails_over_and_trips_breaker():
+    import contextvars
+    import threading
+    import time
+    from typing import Any
+    from langchain_core.language_models.chat_models import BaseChatModel
+    from langchain_core.messages import AIMessage
+    from langchain_core.outputs import ChatGeneration, ChatResult
+    from utils.llm_router import CircuitBreaker, HedgedChatModel, LatencyTracker, ProvidersUnavailable, _Provider
+    from utils.rate_limiter import RateLimitedChatModel, RateLimiter
+
+    request_tag = contextvars.ContextVar("request_tag", default=None)
+
+    class Fake(BaseChatModel):
+        reply: str
+        gate: Any = None      # threading.Event the call waits for
+        delay: float = 0.0
+        error: Any = None
+        seen: Any = None      # (request tag, got run_manager) of the last call
+
+        @property
+        def _llm_type(self) -> str:
+            return "fake"
+
+        def _generate(self, messages, stop=None, run_manager=None, **kwargs) -> ChatResult:
+            self.seen = (request_tag.get(), run_manager is not None)
+            if self.gate is not None:
+                self.gate.wait(5)
+            time.sleep(self.delay)
+            if self.error is not None:
+                raise self.error
+            return ChatResult(generations=[ChatGeneration(message=AIMessage(content=self.reply))])
+
+    def router(*llms):
+        providers = [_Provider(f"p{i}", llm, LatencyTracker(), CircuitBreaker(f"p{i}")) for i, llm in enumerate(llms)]
+        return HedgedChatModel(providers=providers, hedge_min_delay=0.01, hedge_default_delay=0.01), providers
+
+    # slow primary: the backup is hedged in and wins, in the caller's context with callbacks
+    gate = threading.Event()
+    backup = Fake(reply="backup")
+    model, _ = router(Fake(reply="primary", gate=gate), backup)
+    request_tag.set("req-1")
+    try:
+        assert model.invoke("hi").content == "backup"
+    finally:
+        gate.set()
+    assert backup.seen == ("req-1", True)
+
+    # no local budget on the backup: no hedge, the primary's answer is awaited
+    now = [0.0]
+    limiter = RateLimiter("test", "hedge", rpm=60, timeout=0.0, clock=lambda: now[0])
+    for _ in range(60):
+        limiter.acquire()
+    starved = Fake(reply="starved")
+    model, _ = router(Fake(reply="primary", delay=0.1), RateLimitedChatModel(inner=starved, limiter=limiter))
+    assert model.invoke("hi").content == "primary"
+    assert starved.seen is None
+
+    # failing primary: fails over, and its breaker opens after the threshold
+    model, (failing, _) = router(Fake(reply="x", error=ValueError("provider down")), Fake(reply="backup"))
+    failing.breaker.failure_threshold = 2
+    assert model.invoke("hi").content == "backup"
+    assert model.invoke("hi").content == "backup"
+    assert failing.breaker.state == "open"
+
+    breaker = CircuitBreaker("clocked", failure_threshold=1, reset_seconds=10, clock=lambda: now[0])
+    breaker.record_failure()
+    assert not breaker.allow()
+    now[0] += 10
+    assert breaker.allow() and breaker.state == "half_open"
+    assert not breaker.allow()  # one trial call at a time
+    breaker.record_failure()
+    assert breaker.state == "open" and not breaker.allow()
+    now[0] += 10
+    assert breaker.allow()
+    breaker.record_success()
+    assert breaker.state == "closed"
+
+    model, providers = router(Fake(reply="a"))
+    providers[0].breaker.record_failure()
+    providers[0].breaker.record_failure()
+    providers[0].breaker.record_failure()
+    with pytest.raises(ProvidersUnavailable):
+        model.invoke("hi")
+
+
+def test_session_collector_elects_one_worker_and_spares_recent_sessions(tmp_path):
+    import sqlite3
+    import time
+    from utils.session_catalog import SessionCatalog, SessionCollector
+
+    catalog = SessionCatalog(str(tmp_path / "catalog.db"))
+    folders = {}
+    for sid, nbytes in (("old", 600), ("older", 500), ("recent", 700)):
+        folders[sid] = tmp_path / "data" / sid
+        folders[sid].mkdir(parents=True)
+        catalog.register("chat", sid, folders[sid], nbytes)
+    catalog.register("chat", "older", tmp_path / "faiss" / "older", 100)  # two folders, one session
+    with sqlite3.connect(str(catalog.db_path)) as conn:
+        conn.execute("UPDATE session_paths SET last_accessed = ? WHERE session_id = 'old'", (time.time() - 7200,))
+        conn.execute("UPDATE session_paths SET last_accessed = ? WHERE session_id = 'older'", (time.time() - 9000,))
+    sessions = catalog.sessions("chat")
+    assert [s["session_id"] for s in sessions] == ["older", "old", "recent"]
+    assert sessions[0]["bytes"] == 600 and len(sessions[0]["paths"]) == 2
+    assert catalog.total_bytes() == 1900
+
+    released = []
+    collector = SessionCollector(catalog, max_bytes=500, min_idle_seconds=3600, hooks={"chat": released.append})
+    other = SessionCollector(catalog)
+    assert collector.lead() and not other.lead()  # one collecting worker per catalog
+
+    catalog.touch("chat", "old")  # a request arrives while the pass is running
+    assert collector.collect() == 1  # over quota, but "old" and "recent" were just used
+    assert released == ["older"] and not folders["older"].exists()
+    assert folders["old"].exists() and folders["recent"].exists()
+    assert {s["session_id"] for s in catalog.sessions()} == {"old", "recent"}
+
+    stale = {"feature": "chat", "session_id": "old", "bytes": 600, "paths": [str(folders["old"])]}
+    assert not collector.evict(stale, reason="ttl")  # picked earlier, touched since: kept
+    assert folders["old"].exists()
+
+    collector.stop()
+    assert other.lead()
+    other.stop()
+
+
+def test_faiss_manager_commit_never_drops_or_refreshes_over_unsaved_vectors(tmp_path, monkeypatch, fake_api_keys):
+    from langchain.schema import Document
+    from langchain_community.embeddings import DeterministicFakeEmbedding
+    from src.data_ingestion.data_ingestion import FaissManager
+    from utils.model_loader import ModelLoader
+
+    monkeypatch.setattr(ModelLoader, "load_embeddings", lambda self: DeterministicFakeEmbedding(size=16))
+    folder = tmp_path / "s1"
+
+    def docs(*names):
+        return [Document(page_content=f"chunk {n}", metadata={"source": "a.pdf", "row_id": n}) for n in names]
+
+    def add(fm, batch):
+        new = fm.claim_new(batch)
+        fm.add_embedded(new, fm.emb.embed_documents([d.page_content for d in new]))
+
+    first, late = FaissManager(folder), FaissManager(folder)
+    FaissManager(folder).commit()  # nothing to write: no generation, no error
+    assert first.generations.current() is None
+
+    with first.writing():
+        add(first, docs(0, 1))
+        first.commit()
+    add(late, docs(2))  # outside the lock, from before `first` committed
+    with pytest.raises(RuntimeError, match="another writer"):
+        late.commit()
+    assert first.generations.current().number == first.generation.number  # nothing overwritten
+
+    again = FaissManager(folder)
+    with again.writing():
+        add(again, docs(1, 2))  # continues from the latest generation; row 1 is already there
+        again.commit()
+    assert again.vs.index.ntotal == 3
+    assert FaissManager(folder).load_or_create().index.ntotal == 3
+
+
+def test_config_snapshot_reloads_on_change_and_notifies_touched_sections(tmp_path, monkeypatch):
+    import os
+    import yaml
+    from utils import config_loader, model_loader
+
+    path = tmp_path / "config.yaml"
+    path.write_text((config_loader._project_root() / "config" / "config.yaml").read_text(encoding="utf-8"))
+    monkeypatch.setenv("CONFIG_PATH", str(path))
+    monkeypatch.setattr(config_loader, "_snapshot", None)
+    monkeypatch.setattr(config_loader, "_listeners", list(config_loader._listeners))
+    monkeypatch.setattr(model_loader, "_CLIENT_CACHE", {("llm", "groq", "m"): object(), ("llm", "google", "m"): object()})
+
+    def edit(section, key, value):
+        data = yaml.safe_load(path.read_text(encoding="utf-8"))
+        data[section][key] = value
+        path.write_text(yaml.safe_dump(data), encoding="utf-8")
+
+    snap = config_loader.get_config(force_check=True)
+    assert config_loader.get_config() is snap  # within CONFIG_CHECK_INTERVAL: no stat, no parse
+    with pytest.raises(TypeError):
+        snap["retriever"]["top_k"] = 3
+    seen = []
+    config_loader.subscribe(lambda old, new, changed: seen.append(changed), {"llm.groq"})
+
+    os.utime(path, (1, 1))  # touched, same content: same snapshot
+    assert config_loader.get_config(force_check=True) is snap
+
+    edit("retriever", "top_k", 3)
+    fresh = config_loader.get_config(force_check=True)
+    assert fresh["retriever"]["top_k"] == 3 and fresh.version != snap.version
+    assert seen == []  # not a section the listener asked for
+
+    groq = dict(config_loader.thaw(fresh["llm"]["groq"]), temperature=0.5)
+    edit("llm", "groq", groq)
+    assert config_loader.get_config(force_check=True)["llm"]["groq"]["temperature"] == 0.5
+    assert seen == [{"llm", "llm.groq"}]
+    assert list(model_loader._CLIENT_CACHE) == [("llm", "google", "m")]  # only the changed client is rebuilt
+
+
+def test_chunker_respects_token_size_and_overlap_in_order():
+    from concurrent.futures import ThreadPoolExecutor
+    from langchain.schema import Document
+    from utils.chunking import Chunker, _approx_tokens, _tiktoken_length
+
+    length = _tiktoken_length("cl100k_base") or _approx_tokens
+    words = " ".join(f"word{i}" for i in range(600))
+    pages = [Document(page_content=words, metadata={"source": "a.pdf", "page": p}) for p in range(3)]
+    chunker = Chunker(chunk_size=50, chunk_overlap=10, unit="tokens")
+
+    chunks = chunker.split(pages)
+    first = [c for c in chunks if c.metadata["page"] == 0]
+    assert len(first) > 5 and all(length(c.page_content) <= 50 for c in chunks)
+    assert [c.metadata["chunk_index"] for c in first] == list(range(len(first)))
+    for c in first:
+        assert words[c.metadata["start_index"]:c.metadata["start_index"] + len(c.page_content)] == c.page_content
+    for prev, nxt in zip(first, first[1:]):
+        shared = words[nxt.metadata["start_index"]:prev.metadata["start_index"] + len(prev.page_content)]
+        assert shared and 0 < length(shared) <= 10  # overlap bounded by chunk_overlap tokens
+    assert first[-1].page_content.endswith("word599")
+
+    with ThreadPoolExecutor(2) as pool:  # pooled path: same chunks, same order
+        pooled = list(Chunker(chunk_size=50, chunk_overlap=10, unit="tokens", workers=2).iter_chunks(pages, pool))
+    assert [(c.metadata["page"], c.page_content) for c in pooled] == [(c.metadata["page"], c.page_content) for c in chunks]
+
+    with pytest.raises(ValueError):
+        Chunker(unit="lines")
+
+
+def test_chat_query_batch_embeds_questions_once_and_answers_each(tmp_path, monkeypatch, fake_api_keys):
+    import json
+    from langchain_community.embeddings import DeterministicFakeEmbedding
+    from langchain_core.language_models.fake_chat_models import FakeListChatModel
+    import utils.llm_usage as usage
+    from utils.model_loader import ModelLoader
+
+    class CountingEmbedding(DeterministicFakeEmbedding):
+        calls: int = 0
+
+        def embed_documents(self, texts):
+            self.calls += 1
+            return super().embed_documents(texts)
+
+    emb = CountingEmbedding(size=16)
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setattr(usage, "_ledger", usage.UsageLedger(str(tmp_path / "usage.db")))
+    monkeypatch.setattr(ModelLoader, "load_embeddings", lambda self: emb)
+    monkeypatch.setattr(ModelLoader, "load_llm", lambda self, json_mode=False: FakeListChatModel(responses=["ans"]))
+
+    text = "\n\n".join(f"Paragraph {i} " + "lorem ipsum dolor " * 40 for i in range(20))
+    assert client.post("/chat/index", files=[("files", ("a.txt", text.encode()))],
+                       data={"session_id": "sb"}).status_code == 200
+
+    emb.calls = 0
+    questions = [f"question {i}" for i in range(6)]
+    r = client.post("/chat/query/batch", json={"session_id": "sb", "questions": questions, "k": 3})
+    assert r.status_code == 200 and emb.calls == 1  # all questions embedded in one call
+    assert r.json()["results"] == [{"index": i, "question": q, "answer": "ans"} for i, q in enumerate(questions)]
+
+    r = client.post("/chat/query/batch", json={"session_id": "sb", "questions": questions, "stream": True})
+    lines = [json.loads(l) for l in r.text.splitlines()]
+    assert r.headers["content-type"].startswith("application/x-ndjson")
+    assert sorted(l["index"] for l in lines) == list(range(6)) and {l["answer"] for l in lines} == {"ans"}
+
+    assert client.post("/chat/query/batch", json={"session_id": "nope", "questions": questions}).status_code == 404
+    assert client.post("/chat/query/batch", json={"session_id": "sb", "questions": []}).status_code == 422
+    too_many = ["q"] * 201
+    assert client.post("/chat/query/batch", json={"session_id": "sb", "questions": too_many}).status_code == 413
+
+
+def test_compare_versions_sends_only_changed_pages_to_the_llm(tmp_path, monkeypatch, fake_api_keys):
+    import asyncio
+    import json
+    import fitz
+    from langchain_core.language_models.fake_chat_models import FakeListChatModel
+    import utils.llm_usage as usage
+    from src.data_ingestion.data_ingestion import DocumentComparator
+    from src.document_compare.document_comparator import DocumentComparatorLLM
+    from utils.model_loader import ModelLoader
+
+    class Recording(FakeListChatModel):
+        prompts: list = []
+
+        def _call(self, messages, stop=None, run_manager=None, **kwargs):
+            self.prompts.append(messages[-1].content)
+            return super()._call(messages, stop, run_manager, **kwargs)
+
+    def pdf(name, pages):
+        doc = fitz.open()
+        for text in pages:
+            doc.new_page().insert_text((72, 72), text)
+        doc.save(str(tmp_path / name))
+        return tmp_path / name
+
+    monkeypatch.setattr(usage, "_ledger", usage.UsageLedger(str(tmp_path / "usage.db")))
+    paths = [pdf("v1.pdf", ["intro text", "body text"]),
+             pdf("v2.pdf", ["intro   text", "body text"]),  # whitespace only: same fingerprints
+             pdf("v3.pdf", ["intro text", "body text revised", "appendix"])]
+    versions = DocumentComparator(str(tmp_path / "compare"), persist=False).load_versions(paths)
+    combined, unchanged = DocumentComparatorLLM.pair_documents(versions[0], versions[1])
+    assert combined == "" and unchanged == [1, 2]
+
+    reply = json.dumps([{"Page": "2", "Changes": "revised"}, {"Page": "3", "Changes": "added"}])
+    llm = Recording(responses=[reply])
+    monkeypatch.setattr(ModelLoader, "load_llm", lambda self, json_mode=False: llm)
+    results = asyncio.run(DocumentComparatorLLM().compare_versions(versions))
+
+    assert [(r["from"], r["to"], r["unchanged_pages"]) for r in results] == [("v1.pdf", "v2.pdf", 2), ("v2.pdf", "v3.pdf", 1)]
+    assert results[0]["rows"] == [{"Page": "1", "Changes": "NO CHANGE"}, {"Page": "2", "Changes": "NO CHANGE"}]
+    assert [row["Changes"] for row in results[1]["rows"]] == ["NO CHANGE", "revised", "added"]
+    assert len(llm.prompts) == 1  # the unchanged pair never reached the LLM
+    assert "body text revised" in llm.prompts[0] and "intro" not in llm.prompts[0]
+
+    llm.responses = ["not json"]
+    (failed,) = asyncio.run(DocumentComparatorLLM().compare_versions(versions[1:]))
+    assert "error" in failed and failed["rows"] == [{"Page": "1", "Changes": "NO CHANGE"}]
+
+
+def test_in_memory_uploads_parse_without_disk_and_match_the_disk_path(tmp_path, monkeypatch, fake_api_keys):
+    import json
+    import fitz
+    from langchain_core.language_models.fake_chat_models import FakeListChatModel
+    import api.main as main
+    import utils.llm_usage as usage
+    from utils.model_loader import ModelLoader
+
+    class Recording(FakeListChatModel):
+        prompts: list = []
+
+        def _call(self, messages, stop=None, run_manager=None, **kwargs):
+            self.prompts.append(messages[-1].content)
+            return super()._call(messages, stop, run_manager, **kwargs)
+
+    def pdf(*pages):
+        doc = fitz.open()
+        for text in pages:
+            doc.new_page().insert_text((72, 72), text)
+        return doc.tobytes()
+
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setenv("DATA_STORAGE_PATH", str(tmp_path / "analysis"))
+    monkeypatch.setattr(usage, "_ledger", usage.UsageLedger(str(tmp_path / "usage.db")))
+    analysis = Recording(responses=[json.dumps({"Summary": ["s"], "SentimentTone": "Neutral"})])
+    monkeypatch.setattr(ModelLoader, "load_llm", lambda self, json_mode=False: analysis)
+
+    monkeypatch.setattr(main, "_upload_mode", lambda: (True, False))
+    r = client.post("/analyze", files={"file": ("a.pdf", pdf("one", "two"))})
+    assert r.status_code == 200 and r.json()["PageCount"] == 2
+    assert not (tmp_path / "analysis").exists()  # parsed from the request body only
+
+    monkeypatch.setattr(main, "_upload_mode", lambda: (True, True))
+    r = client.post("/analyze", files={"file": ("a.pdf", pdf("one", "two"))})
+    assert r.status_code == 200 and len(list((tmp_path / "analysis").glob("*/a.pdf"))) == 1  # retained afterwards
+
+    compare = Recording(responses=[json.dumps([{"Page": "1", "Changes": "edited"}])])
+    monkeypatch.setattr(ModelLoader, "load_llm", lambda self, json_mode=False: compare)
+    files = {"reference": ("old.pdf", pdf("alpha", "beta")), "actual": ("new.pdf", pdf("alpha", "gamma"))}
+    for mode in ((False, True), (True, False)):
+        monkeypatch.setattr(main, "_upload_mode", lambda: mode)
+        r = client.post("/compare", files=files)
+        assert r.status_code == 200 and r.json()["rows"] == [{"Page": "1", "Changes": "edited"}]
+    disk, memory = compare.prompts
+    assert memory == disk and "gamma" in memory
+
+
+def test_index_metadata_records_the_storage_actually_built(tmp_path, monkeypatch, fake_api_keys):
+    import json
+    from langchain_community.embeddings import DeterministicFakeEmbedding
+    from src.data_ingestion.data_ingestion import FaissManager
+    from utils.faiss_storage import VectorStorageSpec
+    from utils.model_loader import ModelLoader
+
+    monkeypatch.setattr(ModelLoader, "load_embeddings", lambda self: DeterministicFakeEmbedding(size=16))
+    pq = VectorStorageSpec(codec="pq", pq_m=4)
+    assert pq.for_vectors(10, 16) == VectorStorageSpec(codec="fp16")  # too few to train PQ
+    assert pq.for_vectors(2000, 16) is pq
+
+    fm = FaissManager(tmp_path / "s1", storage=pq)
+    fm.load_or_create(texts=[f"chunk {i}" for i in range(10)], metadatas=[{"source": "a", "row_id": i} for i in range(10)])
+    meta = json.loads(fm.generation.meta_path.read_text(encoding="utf-8"))
+    assert meta["storage"]["codec"] == "fp16"
+    assert FaissManager(tmp_path / "s1").load_or_create().index.ntotal == 10
+
+
+def test_log_pipeline_truncates_fields_filters_levels_and_samples(monkeypatch):
+    import json
+    import logging
+    import random
+    import structlog
+    import logger.custom_logger as custom_logger
+    from logger import GLOBAL_LOGGER as log
+
+    monkeypatch.setitem(custom_logger._settings, "max_field_chars", 20)
+    monkeypatch.setitem(custom_logger._settings, "max_items", 3)
+    monkeypatch.setitem(custom_logger._settings, "sampling", {})
+    file_handler = next(h for h in custom_logger._listener.handlers if isinstance(h, logging.FileHandler))
+
+    def written(event):
+        logging.getLogger().handlers[0].queue.join()  # the writer thread has rendered everything queued
+        with open(file_handler.baseFilename, encoding="utf-8") as fh:
+            return [r for r in map(json.loads, fh) if r["event"] == event]
+
+    log.info("bounded fields", text="x" * 50, items=list(range(10)), blob=b"\0" * 4096)
+    (record,) = written("bounded fields")
+    assert record["text"] == "x" * 20 + "...(+30 chars)"
+    assert record["items"] == [0, 1, 2, "...(+7 items)"] and record["blob"] == "<4096 bytes>"
+
+    level = custom_logger.get_level()
+    try:
+        custom_logger.set_level("warning")
+        log.info("below level")
+        log.warning("at level")
+        assert written("below level") == [] and len(written("at level")) == 1
+        with pytest.raises(ValueError):
+            custom_logger.set_level("loud")
+    finally:
+        custom_logger.set_level(level)
+
+    monkeypatch.setattr(custom_logger.random, "random", random.Random(7).random)
+    custom_logger.set_sampling("noisy", 0.25)
+
+    def kept(method):
+        n = 0
+        for _ in range(4000):
+            try:
+                custom_logger._sample(None, method, {"event": "noisy"})
+                n += 1
+            except structlog.DropEvent:
+                pass
+        return n
+
+    assert 900 <= kept("info") <= 1100  # about a quarter of the info events
+    assert kept("warning") == 4000      # warnings and errors are never sampled
+    custom_logger.set_sampling("noisy", 1)
+    assert kept("info") == 4000
+
+
+def test_log_queue_handler_drops_instead_of_blocking_when_full():
+    import logging
+    import queue
+    import time
+    import logger.custom_logger as custom_logger
+
+    handler = custom_logger._NonBlockingQueueHandler(queue.Queue(maxsize=2))  # nobody drains it
+    burst = logging.getLogger("test-full-queue")
+    burst.propagate = False
+    burst.addHandler(handler)
+    dropped = custom_logger._dropped["queue_full"]
+    try:
+        start = time.perf_counter()
+        for i in range(500):
+            burst.warning("burst %d", i)
+        assert time.perf_counter() - start < 1
+    finally:
+        burst.removeHandler(handler)
+    assert handler.queue.qsize() == 2
+    assert custom_logger._dropped["queue_full"] - dropped == 498
+    assert custom_logger.pipeline_stats()["dropped"]["queue_full"] == custom_logger._dropped["queue_full"]
+
+
+def test_metrics_expose_stage_histograms_and_responses_carry_server_timing(tmp_path, monkeypatch, fake_api_keys):
+    import re
+    from langchain_community.embeddings import DeterministicFakeEmbedding
+    from utils.model_loader import ModelLoader
+
+    monkeypatch.setattr(ModelLoader, "load_embeddings", lambda self: DeterministicFakeEmbedding(size=16))
+    text = "\n\n".join(f"Paragraph {i} " + "lorem ipsum " * 30 for i in range(10))
+    r = client.post("/chat/index", files=[("files", ("a.txt", text.encode()))], data={"session_id": "st"})
+    assert r.status_code == 200
+
+    entries = r.headers["Server-Timing"].split(", ")
+    assert all(re.fullmatch(r"[\w.-]+;dur=\d+\.\d", e) for e in entries)
+    names = [e.split(";")[0] for e in entries]
+    assert {"faiss.embed", "faiss.write"} <= set(names) and names[-1] == "total"
+    assert len(names) == len(set(names))  # repeated stages are summed into one entry
+
+    exposition = client.get("/metrics").text
+    assert "# TYPE docportal_stage_duration_seconds histogram" in exposition
+    for suffix in ("_count", "_sum"):
+        assert f'docportal_stage_duration_seconds{suffix}{{stage="faiss.embed"}}' in exposition
+    assert re.search(r'docportal_stage_duration_seconds_bucket\{stage="faiss\.embed",le="\+Inf"\} [1-9]', exposition)
+    assert re.search(r'docportal_http_requests_total\{method="POST",path="/chat/index",status="200"\} [1-9]', exposition)
+    for line in exposition.splitlines():  # every sample line is `name{labels} number`
+        if line and not line.startswith("#"):
+            name, value = line.rsplit(" ", 1)
+            float(value)
+            assert re.fullmatch(r'[a-zA-Z_:][\w:]*(\{.*\})?', name), line
+
+
+def test_batched_query_embedding_charges_the_rate_limiter_once():
+    from langchain_community.embeddings import DeterministicFakeEmbedding
+    from src.document_chat.retrieval import embed_queries
+    from utils.rate_limiter import RateLimitedEmbeddings, RateLimiter
+
+    class Limiter(RateLimiter):
+        charged = []
+
+        def acquire(self, tokens=0, block=True):
+            self.charged.append(tokens)
+            return super().acquire(tokens, block)
+
+    limiter = Limiter("test", "embed", rpm=600, tpm=100000)
+    embeddings = RateLimitedEmbeddings(DeterministicFakeEmbedding(size=8), limiter)  # no task_type keyword
+    vectors = embed_queries(embeddings, ["first question", "second question"])
+    assert len(vectors) == 2 and len(limiter.charged) == 1 and limiter.charged[0] > 0
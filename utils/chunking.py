@@ -0,0 +1,137 @@
+from __future__ import annotations
+import os
+from collections import deque
+from concurrent.futures import Executor, ProcessPoolExecutor
+from functools import lru_cache
+from typing import Iterable, Iterator, List, Optional, TYPE_CHECKING
+
+from logger import GLOBAL_LOGGER as log
+
+if TYPE_CHECKING:
+    from langchain.schema import Document
+
+LENGTH_UNITS = {"chars", "tokens"}
+# Documents per pool task: amortizes pickling / IPC over many small pages.
+POOL_BATCH = 64
+
+
+def _approx_tokens(text: str) -> int:
+    """Cheap token estimate (~4 chars/token for English prose)."""
+    return (len(text) + 3) // 4
+
+
+@lru_cache(maxsize=32)
+def _tiktoken_length(encoding: str):
+    try:
+        import tiktoken
+    except ImportError:
+        return None
+    enc = tiktoken.get_encoding(encoding)
+    return lambda text: len(enc.encode(text, disallowed_special=()))
+
+
+@lru_cache(maxsize=32)
+def get_splitter(chunk_size: int, chunk_overlap: int, unit: str = "chars", encoding: str = "cl100k_base"):
+    """Splitters are stateless, so one instance per configuration is shared process-wide."""
+    from langchain_text_splitters import RecursiveCharacterTextSplitter
+
+    if unit not in LENGTH_UNITS:
+        raise ValueError(f"Unsupported chunk length unit: {unit}")
+    length_function = len
+    if unit == "tokens":
+        length_function = _tiktoken_length(encoding) or _approx_tokens
+    return RecursiveCharacterTextSplitter(
+        chunk_size=chunk_size,
+        chunk_overlap=chunk_overlap,
+        length_function=length_function,
+    )
+
+
+def _split_batch(args) -> List["Document"]:
+    docs, chunk_size, chunk_overlap, unit, encoding = args
+    splitter = get_splitter(chunk_size, chunk_overlap, unit, encoding)
+    out: List["Document"] = []
+    for doc in docs:
+        chunks = splitter.split_documents([doc])
+        # the splitter's own add_start_index assumes the overlap is in characters; with
+        # token sizes it misses every other chunk, so offsets are located here instead
+        pos = 0
+        for i, c in enumerate(chunks):
+            start = doc.page_content.find(c.page_content, pos)
+            c.metadata["chunk_index"] = i
+            c.metadata["start_index"] = start
+            pos = start + 1 if start >= 0 else pos
+        out.extend(chunks)
+    return out
+
+
+class Chunker:
+    """
+    Streaming document chunker.
+
+    Yields chunks document by document (page / source metadata preserved, plus
+    `chunk_index` and `start_index`), sized in characters or tokens. With workers > 1
+    documents are split in a process pool with a bounded number in flight, so input is
+    consumed lazily and output order matches input order.
+    """
+    def __init__(
+        self,
+        chunk_size: int = 1000,
+        chunk_overlap: int = 200,
+        unit: str = "chars",
+        encoding: str = "cl100k_base",
+        workers: int = 1,
+    ):
+        if unit not in LENGTH_UNITS:
+            raise ValueError(f"Unsupported chunk length unit: {unit}")
+        self.chunk_size = chunk_size
+        self.chunk_overlap = chunk_overlap
+        self.unit = unit
+        self.encoding = encoding
+        self.workers = max(1, int(workers))
+        if unit == "tokens" and _tiktoken_length(encoding) is None:
+            log.warning("tiktoken not installed; token sizes are approximated", encoding=encoding)
+
+    @classmethod
+    def from_config(cls, config, chunk_size: int = 1000, chunk_overlap: int = 200) -> "Chunker":
+        block = (config or {}).get("chunking") or {}
+        return cls(
+            chunk_size=chunk_size,
+            chunk_overlap=chunk_overlap,
+            unit=block.get("unit", "chars"),
+            encoding=block.get("encoding", "cl100k_base"),
+            workers=int(os.getenv("CHUNK_WORKERS", block.get("workers", 1))),
+        )
+
+    def _args(self, docs):
+        return (docs, self.chunk_size, self.chunk_overlap, self.unit, self.encoding)
+
+    def iter_chunks(self, docs: Iterable["Document"], executor: Optional[Executor] = None) -> Iterator["Document"]:
+        if self.workers == 1 and executor is None:
+            for doc in docs:
+                yield from _split_batch(self._args([doc]))
+            return
+
+        own = executor is None
+        pool = executor or ProcessPoolExecutor(max_workers=self.workers)
+        try:
+            pending = deque()
+            batch: List["Document"] = []
+            for doc in docs:
+                batch.append(doc)
+                if len(batch) < POOL_BATCH:
+                    continue
+                pending.append(pool.submit(_split_batch, self._args(batch)))
+                batch = []
+                if len(pending) >= self.workers * 2:
+                    yield from pending.popleft().result()
+            if batch:
+                pending.append(pool.submit(_split_batch, self._args(batch)))
+            while pending:
+                yield from pending.popleft().result()
+        finally:
+            if own:
+                pool.shutdown(cancel_futures=True)
+
+    def split(self, docs: Iterable["Document"]) -> List["Document"]:
+        return list(self.iter_chunks(docs))
@@ -1,15 +1,33 @@
 from pathlib import Path
 import os
+import time
+import hashlib
+import threading
+from types import MappingProxyType
+from typing import Any, Callable, List, Mapping, Optional, Set
 import yaml
 from logger import GLOBAL_LOGGER as log
 
 #from logger.custom_logger import CustomLogger
-#logger = CustomLogger().get_logger(__name__)  
+#logger = CustomLogger().get_logger(__name__)
 
 def _project_root() -> Path:
     # .../utils/config_loader.py -> parents[1] == project root
     return Path(__file__).resolve().parents[1]
 
+def _resolve_path(config_path: str | None = None) -> Path:
+    env_path = os.getenv("CONFIG_PATH")
+    if config_path is None:
+        config_path = env_path or str(_project_root() / "config" / "config.yaml")
+
+    path = Path(config_path)
+    if not path.is_absolute():
+        path = _project_root() / path
+
+    if not path.exists():
+        raise FileNotFoundError(f"Config file not found: {path}")
+    return path
+
 def load_config(config_path: str | None = None) -> dict:
     """Load a YAML configuration file and return its contents as a dictionary.
 
@@ -21,22 +39,134 @@ def load_config(config_path: str | None = None) -> dict:
 
         config_path defaults to 'config.yaml'.
     """
-
-    env_path = os.getenv("CONFIG_PATH")
-    if config_path is None:
-        config_path = env_path or str(_project_root() / "config" / "config.yaml")
-
-    path = Path(config_path)
-    if not path.is_absolute():
-        path = _project_root() / path
-
-    if not path.exists():
-        raise FileNotFoundError(f"Config file not found: {path}")
-    
+    path = _resolve_path(config_path)
     with open(path, 'r', encoding="utf-8") as f:
         config = yaml.safe_load(f) or {}
     return config
 
+
+# ---------- Process-wide snapshot with hot reload ----------
+def _freeze(value: Any) -> Any:
+    if isinstance(value, dict):
+        return MappingProxyType({k: _freeze(v) for k, v in value.items()})
+    if isinstance(value, list):
+        return tuple(_freeze(v) for v in value)
+    return value
+
+
+def thaw(value: Any) -> Any:
+    """Plain dict/list copy of a frozen snapshot value (for clients that mutate or serialize it)."""
+    if isinstance(value, Mapping):
+        return {k: thaw(v) for k, v in value.items()}
+    if isinstance(value, tuple):
+        return [thaw(v) for v in value]
+    return value
+
+
+def _changed_sections(old: Mapping, new: Mapping, prefix: str = "", depth: int = 2) -> Set[str]:
+    """Dotted keys that differ between two configs, down to `depth` levels (e.g. 'llm.groq')."""
+    changed: Set[str] = set()
+    for key in set(old) | set(new):
+        a, b = old.get(key), new.get(key)
+        if a == b:
+            continue
+        name = f"{prefix}{key}"
+        changed.add(name)
+        if depth > 1 and isinstance(a, Mapping) and isinstance(b, Mapping):
+            changed |= _changed_sections(a, b, prefix=f"{name}.", depth=depth - 1)
+    return changed
+
+
+class ConfigSnapshot(Mapping):
+    """Immutable view of config.yaml plus the content hash and mtime it was loaded from."""
+    def __init__(self, data: dict, path: Path, digest: str, mtime: float):
+        self._data = _freeze(data)
+        self.path = path
+        self.version = digest[:12]
+        self.mtime = mtime
+
+    def __getitem__(self, key):
+        return self._data[key]
+
+    def __iter__(self):
+        return iter(self._data)
+
+    def __len__(self):
+        return len(self._data)
+
+    def __repr__(self):
+        return f"ConfigSnapshot(path={str(self.path)!r}, version={self.version!r})"
+
+
+ConfigListener = Callable[[ConfigSnapshot, ConfigSnapshot, Set[str]], None]
+
+_snapshot: Optional[ConfigSnapshot] = None
+_last_check = 0.0
+_lock = threading.Lock()
+_listeners: List[tuple] = []
+CHECK_INTERVAL = float(os.getenv("CONFIG_CHECK_INTERVAL", "2"))
+
+
+def _read_snapshot(path: Path) -> ConfigSnapshot:
+    raw = path.read_bytes()
+    data = yaml.safe_load(raw) or {}
+    return ConfigSnapshot(data, path, hashlib.sha256(raw).hexdigest(), path.stat().st_mtime)
+
+
+def subscribe(listener: ConfigListener, sections: Optional[Set[str]] = None):
+    """
+    Call `listener(old, new, changed)` after a reload that touches any of `sections`
+    (dotted prefixes such as {"llm", "embedding_model"}); all changes if sections is None.
+    """
+    _listeners.append((listener, set(sections) if sections else None))
+
+
+def _notify(old: ConfigSnapshot, new: ConfigSnapshot, changed: Set[str]):
+    for listener, sections in list(_listeners):
+        if sections is not None and not any(c == s or c.startswith(f"{s}.") for c in changed for s in sections):
+            continue
+        try:
+            listener(old, new, changed)
+        except Exception as e:
+            log.error("Config listener failed", listener=getattr(listener, "__name__", str(listener)), error=str(e))
+
+
+def get_config(force_check: bool = False) -> ConfigSnapshot:
+    """
+    Return the current config snapshot. The file is parsed once; afterwards its mtime is
+    checked at most every CONFIG_CHECK_INTERVAL seconds and the snapshot is swapped only
+    when the content hash changes.
+    """
+    global _snapshot, _last_check
+    now = time.monotonic()
+    current = _snapshot
+    if current is not None and not force_check and now - _last_check < CHECK_INTERVAL:
+        return current
+
+    with _lock:
+        current = _snapshot
+        if current is not None and not force_check and now - _last_check < CHECK_INTERVAL:
+            return current
+        _last_check = now
+        path = _resolve_path()
+        if current is not None and current.path == path and path.stat().st_mtime == current.mtime:
+            return current
+
+        fresh = _read_snapshot(path)
+        if current is not None and fresh.version == current.version:
+            current.mtime = fresh.mtime  # touched but unchanged
+            return current
+        _snapshot = fresh
+
+    if current is None:
+        log.info("Config snapshot loaded", path=str(fresh.path), version=fresh.version)
+    else:
+        changed = _changed_sections(current, fresh)
+        log.info("Config reloaded", path=str(fresh.path), old_version=current.version,
+                 version=fresh.version, changed=sorted(changed))
+        _notify(current, fresh, changed)
+    return fresh
+
 # if __name__ == "__main__":
 #     load_config("config\config.yaml")
 #     log.info("Configuration file loaded successfully", config_path="config\config.yaml")
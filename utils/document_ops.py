@@ -1,41 +1,156 @@
 from __future__ import annotations
+import codecs
+import zipfile
 from pathlib import Path
-from typing import Iterable, List
-from fastapi import UploadFile
-from langchain.schema import Document
-from langchain_community.document_loaders import PyPDFLoader, Docx2txtLoader, TextLoader
+from typing import Iterable, Iterator, List, TYPE_CHECKING
+from xml.etree import ElementTree as ET
 from logger import GLOBAL_LOGGER as log
 from exception.custom_exception import CustomException
+from utils.metrics import stage, timed
+
+if TYPE_CHECKING:
+    from fastapi import UploadFile
+    from langchain.schema import Document
 
 SUPPORTED_EXTENSIONS = {".pdf", ".docx", ".txt"}
+DEFAULT_SEGMENT_CHARS = 64_000
 
+_W = "{http://schemas.openxmlformats.org/wordprocessingml/2006/main}"
 
-def load_documents(paths: Iterable[Path]) -> List[Document]:
+
+# ---------- Streaming loaders (TXT / DOCX) ----------
+class StreamingTextLoader:
     """
-    Load docs using appropriate loader based on extension.
+    Read a text file incrementally and yield Documents of about `segment_chars` bytes,
+    cut at line ends. Metadata carries `segment`, `byte_start` and `byte_end`, so memory
+    stays bounded by one segment however large the file is.
+    """
+    def __init__(self, path: str, segment_chars: int = DEFAULT_SEGMENT_CHARS, encoding: str = "utf-8"):
+        self.path = path
+        self.segment_chars = max(1, int(segment_chars))
+        self.encoding = encoding
+
+    def lazy_load(self) -> Iterator[Document]:
+        from langchain_core.documents import Document
+
+        # a multi-byte character split across segments is completed by the incremental decoder
+        decoder = codecs.getincrementaldecoder(self.encoding)(errors="replace")
+        segment, start, pos = 0, 0, 0
+        parts: List[bytes] = []
+        size = 0
+        with open(self.path, "rb") as f:
+            while True:
+                line = f.readline(self.segment_chars)  # bounded, even without newlines
+                if line:
+                    parts.append(line)
+                    size += len(line)
+                    pos += len(line)
+                if parts and (not line or size >= self.segment_chars):
+                    text = decoder.decode(b"".join(parts), final=not line)
+                    yield Document(page_content=text, metadata={
+                        "source": self.path, "segment": segment, "byte_start": start, "byte_end": pos})
+                    segment, start, parts, size = segment + 1, pos, [], 0
+                if not line:
+                    return
+
+
+def _paragraph_text(p: ET.Element) -> str:
+    out = []
+    for el in p.iter():
+        if el.tag == _W + "t" and el.text:
+            out.append(el.text)
+        elif el.tag == _W + "tab":
+            out.append("\t")
+        elif el.tag in (_W + "br", _W + "cr"):
+            out.append("\n")
+    return "".join(out)
+
+
+class StreamingDocxLoader:
+    """
+    Stream paragraphs out of a DOCX body part (word/document.xml) with iterparse and yield
+    Documents of about `segment_chars` characters. Metadata carries `segment`,
+    `paragraph_start` and `paragraph_end` (end exclusive). Headers, footers and notes are
+    not read.
+    """
+    def __init__(self, path: str, segment_chars: int = DEFAULT_SEGMENT_CHARS):
+        self.path = path
+        self.segment_chars = max(1, int(segment_chars))
+
+    def lazy_load(self) -> Iterator[Document]:
+        from langchain_core.documents import Document
+
+        segment, first, index = 0, 0, 0
+        paras: List[str] = []
+        size = 0
+
+        def _emit():
+            return Document(page_content="\n\n".join(paras), metadata={
+                "source": self.path, "segment": segment, "paragraph_start": first, "paragraph_end": index})
+
+        with zipfile.ZipFile(self.path) as zf, zf.open("word/document.xml") as xml:
+            for _, el in ET.iterparse(xml, events=("end",)):
+                if el.tag != _W + "p":
+                    continue
+                text = _paragraph_text(el)
+                el.clear()  # parsed paragraphs are dropped as we go
+                index += 1
+                if text.strip():
+                    paras.append(text)
+                    size += len(text) + 2
+                if size >= self.segment_chars:
+                    yield _emit()
+                    segment, first, paras, size = segment + 1, index, [], 0
+        if paras:
+            yield _emit()
+
+
+def _loader_for(p: Path):
+    from langchain_community.document_loaders import PyPDFLoader
+    from utils.config_loader import get_config
+
+    segment_chars = (get_config().get("ingestion") or {}).get("segment_chars", DEFAULT_SEGMENT_CHARS)
+    ext = p.suffix.lower()
+    if ext == ".pdf":
+        return PyPDFLoader(str(p))
+    if ext == ".docx":
+        return StreamingDocxLoader(str(p), segment_chars)
+    if ext == ".txt":
+        return StreamingTextLoader(str(p), segment_chars)
+    return None
+
+
+def iter_documents(paths: Iterable[Path]) -> Iterator[Document]:
+    """
+    Lazily yield documents (one per PDF page, one per bounded TXT/DOCX segment) file by
+    file, so callers can start processing before the whole upload is parsed.
     Supported: PDF, DOCX, TXT
     """
-    docs: List[Document] = []
+    count = 0
     try:
         for p in paths:
-            ext = p.suffix.lower()
-            if ext == ".pdf":
-                loader = PyPDFLoader(str(p))
-            elif ext == ".docx":
-                loader = Docx2txtLoader(str(p))
-            elif ext == ".txt":
-                loader = TextLoader(str(p), encoding="utf-8")
-            else:
+            loader = _loader_for(p)
+            if loader is None:
                 log.warning("Unsupported extension skipped", path=str(p))
                 continue
-            docs.extend(loader.load())
-        log.info("Documents loaded", count=len(docs))
-        return docs
-    
+            for doc in loader.lazy_load():
+                count += 1
+                yield doc
+        log.info("Documents loaded", count=count)
+
     except Exception as e:
         log.error("Failed loading documents", error=str(e))
         raise CustomException("Error loading documents", e) from e
 
+
+@timed("docs.load")
+def load_documents(paths: Iterable[Path]) -> List[Document]:
+    """
+    Load docs using appropriate loader based on extension.
+    Supported: PDF, DOCX, TXT
+    """
+    return list(iter_documents(paths))
+
 def concat_for_analysis(docs: List[Document]) -> str:
     """ 
     Concatenate documents with source markers for analysis.
@@ -62,12 +177,19 @@ class FastAPIFileAdapter:
         self._uf = uf
         self.name = uf.filename
     def getbuffer(self) -> bytes:
-        self._uf.file.seek(0)
-        return self._uf.file.read()
-
-def read_pdf_via_handler(handler, path: str) -> str:
-    if hasattr(handler, "read_pdf"):
-        return handler.read_pdf(path)  # type: ignore
-    if hasattr(handler, "read_"):
-        return handler.read_(path)  # type: ignore
-    raise RuntimeError("DocHandler has neither read_pdf nor read_ method.")
\ No newline at end of file
+        with stage("upload.read"):  # whole-file buffering
+            self._uf.file.seek(0)
+            return self._uf.file.read()
+
+class InMemoryUpload:
+    """
+    Upload held in memory (.name + .getbuffer()): parsed without touching disk and, when
+    retained, saved later with the same save_* methods as a file adapter.
+    """
+    def __init__(self, name: str, data: bytes):
+        self.name = name
+        self.data = data
+    def getbuffer(self) -> bytes:
+        return self.data
+    def __str__(self) -> str:
+        return self.name
@@ -0,0 +1,167 @@
+from __future__ import annotations
+from dataclasses import dataclass, asdict
+from typing import Any, Dict, List, Optional, Sequence
+
+import faiss
+import numpy as np
+
+from logger import GLOBAL_LOGGER as log
+from exception.custom_exception import CustomException
+
+# codec name -> faiss index_factory component ("{m}" is filled for PQ)
+CODECS = {
+    "flat": "Flat",      # float32, 4 bytes / dim
+    "fp16": "SQfp16",    # float16, 2 bytes / dim
+    "sq8": "SQ8",        # 8-bit scalar quantizer, 1 byte / dim
+    "pq": "PQ{m}",       # product quantizer, m bytes / vector
+}
+REDUCERS = {"truncate", "pca"}
+
+# Minimum number of training vectors before a trained codec is worth building.
+PQ_MIN_TRAIN = 1024
+
+
+@dataclass(frozen=True)
+class VectorStorageSpec:
+    """
+    How vectors of a FAISS index are stored: codec + optional dimensionality reduction.
+    """
+    codec: str = "flat"
+    pq_m: int = 16
+    reduce: Optional[str] = None
+    target_dim: Optional[int] = None
+
+    def __post_init__(self):
+        if self.codec not in CODECS:
+            raise ValueError(f"Unsupported vector codec: {self.codec}. Use one of {sorted(CODECS)}")
+        if self.reduce is not None and self.reduce not in REDUCERS:
+            raise ValueError(f"Unsupported reduction: {self.reduce}. Use one of {sorted(REDUCERS)}")
+        if self.reduce and not self.target_dim:
+            raise ValueError("target_dim is required when reduce is set")
+
+    @classmethod
+    def from_config(cls, config: Optional[Dict[str, Any]]) -> "VectorStorageSpec":
+        """Build a spec from the `faiss_db.storage` block of config.yaml."""
+        block = ((config or {}).get("faiss_db") or {}).get("storage") or {}
+        return cls(
+            codec=block.get("codec", "flat"),
+            pq_m=int(block.get("pq_m", 16)),
+            reduce=block.get("reduce") or None,
+            target_dim=block.get("target_dim") or None,
+        )
+
+    @property
+    def is_default(self) -> bool:
+        return self.codec == "flat" and self.reduce is None
+
+    def to_dict(self) -> Dict[str, Any]:
+        return asdict(self)
+
+    def label(self) -> str:
+        codec = f"pq{self.pq_m}" if self.codec == "pq" else self.codec
+        return f"{self.reduce}{self.target_dim}+{codec}" if self.reduce else codec
+
+    def output_dim(self, dim: int) -> int:
+        return min(self.target_dim, dim) if self.reduce and self.target_dim else dim
+
+    def _codec_factory(self, dim: int) -> str:
+        if self.codec != "pq":
+            return CODECS[self.codec]
+        # PQ needs m to divide the (possibly reduced) dimension
+        m = max(1, min(self.pq_m, dim))
+        while dim % m:
+            m -= 1
+        return CODECS["pq"].format(m=m)
+
+    def min_train_size(self, dim: int) -> int:
+        n = 0
+        if self.codec == "pq":
+            n = PQ_MIN_TRAIN
+        if self.reduce == "pca":
+            n = max(n, self.output_dim(dim))
+        return n
+
+    def for_vectors(self, n: int, dim: int) -> "VectorStorageSpec":
+        """The spec an index built from `n` vectors of `dim` actually uses (fp16 if the codec cannot be trained)."""
+        if n < self.min_train_size(dim):
+            log.warning("Too few vectors to train codec; falling back to fp16",
+                        codec=self.label(), vectors=n, required=self.min_train_size(dim))
+            return VectorStorageSpec(codec="fp16")
+        return self
+
+    def build_index(self, vectors: np.ndarray):
+        """
+        Create (and train if needed) an empty FAISS index for `vectors`.
+        Falls back to float16 storage when there are too few vectors to train the codec
+        (see `for_vectors` for the spec that was built).
+        """
+        vectors = np.ascontiguousarray(vectors, dtype=np.float32)
+        n, dim = vectors.shape
+        spec = self.for_vectors(n, dim)
+
+        out_dim = spec.output_dim(dim)
+        codec = spec._codec_factory(out_dim)
+
+        if spec.reduce == "pca" and out_dim < dim:
+            index = faiss.index_factory(dim, f"PCA{out_dim},{codec}")
+        elif spec.reduce == "truncate" and out_dim < dim:
+            sub = faiss.index_factory(out_dim, codec)
+            index = faiss.IndexPreTransform(faiss.RemapDimensionsTransform(dim, out_dim, False), sub)
+        else:
+            index = faiss.index_factory(dim, codec)
+
+        if not index.is_trained:
+            index.train(vectors)
+        log.info("FAISS storage index built", storage=spec.label(), dim=dim, out_dim=out_dim, train_vectors=n)
+        return index
+
+
+def index_nbytes(index) -> int:
+    """Serialized size of a FAISS index in bytes."""
+    return int(faiss.serialize_index(index).nbytes)
+
+
+def recall_size_report(
+    vectors: np.ndarray,
+    queries: np.ndarray,
+    specs: Sequence[VectorStorageSpec],
+    k: int = 10,
+) -> List[Dict[str, Any]]:
+    """
+    Compare storage specs against an exact float32 index.
+
+    Returns one row per spec with serialized size, bytes per vector,
+    compression ratio and recall@k of the exact top-k neighbours.
+    """
+    try:
+        vectors = np.ascontiguousarray(vectors, dtype=np.float32)
+        queries = np.ascontiguousarray(queries, dtype=np.float32)
+        k = min(k, len(vectors))
+
+        exact = faiss.IndexFlatL2(vectors.shape[1])
+        exact.add(vectors)
+        _, truth = exact.search(queries, k)
+        baseline = index_nbytes(exact)
+
+        rows = []
+        for spec in specs:
+            spec = spec.for_vectors(*vectors.shape)  # report what was measured
+            index = spec.build_index(vectors)
+            index.add(vectors)
+            _, got = index.search(queries, k)
+            hits = sum(len(set(t) & set(g)) for t, g in zip(truth, got))
+            size = index_nbytes(index)
+            rows.append({
+                "storage": spec.label(),
+                "spec": spec.to_dict(),
+                "index_bytes": size,
+                "bytes_per_vector": round(size / len(vectors), 2),
+                "compression": round(baseline / size, 2),
+                f"recall@{k}": round(hits / (len(queries) * k), 4),
+            })
+        log.info("Recall/size report computed", vectors=len(vectors), queries=len(queries), specs=len(specs))
+        return rows
+
+    except Exception as e:
+        log.error("Failed to compute recall/size report", error=str(e))
+        raise CustomException("Failed to compute recall/size report", e) from e
@@ -8,6 +8,7 @@ import uuid
 from typing import Iterable, List
 from logger import GLOBAL_LOGGER as log
 from exception.custom_exception import CustomException
+from utils.metrics import timed
 
 SUPPORTED_EXTENSIONS = {".pdf", ".docx", ".txt"}
 
@@ -17,6 +18,7 @@ SUPPORTED_EXTENSIONS = {".pdf", ".docx", ".txt"}
 def generate_session_id(prefix: str = "session") -> str:
     return f"{prefix}_{datetime.now().strftime('%Y%m%d_%H%M%S')}_{uuid.uuid4().hex[:8]}"
 
+@timed("upload.save")
 def save_uploaded_files(uploaded_files: Iterable, target_dir: Path) -> List[Path]:
     """Save uploaded files (Streamlit-like) and return local paths."""
     try:
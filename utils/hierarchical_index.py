@@ -0,0 +1,154 @@
+from __future__ import annotations
+import json
+from pathlib import Path
+from typing import Any, Dict, Iterable, List, Mapping, Optional, Sequence, Tuple
+
+import numpy as np
+
+from logger import GLOBAL_LOGGER as log
+from utils.metrics import REGISTRY
+
+HIERARCHY_JSON = "hierarchy.json"
+HIERARCHY_NPZ = "hierarchy.npz"
+
+VECTORS_SCORED = REGISTRY.histogram(
+    "docportal_retrieval_vectors_scored", "Vectors scored per query (centroids + candidate chunks)",
+    buckets=(10, 50, 100, 500, 1000, 5000, 10000, 50000, 100000, 500000),
+)
+
+
+def _unit(m: np.ndarray) -> np.ndarray:
+    norms = np.linalg.norm(m, axis=-1, keepdims=True)
+    return m / np.where(norms == 0, 1, norms)
+
+
+class HierarchicalIndex:
+    """
+    Document- and section-level centroid layer over a session's chunk vectors.
+
+    A section is a run of pages or streamed segments (`pages_per_section`) or, otherwise, a run of
+    chunks (`chunks_per_section`) of one document. Each section keeps the running sum of its
+    chunk vectors and the positions of those chunks in the FAISS index; document centroids
+    are derived from their sections. Search picks the top documents, then their top sections,
+    and scores only the chunks of those sections.
+    """
+    def __init__(self, pages_per_section: int = 4, chunks_per_section: int = 16):
+        self.pages_per_section = max(1, int(pages_per_section))
+        self.chunks_per_section = max(1, int(chunks_per_section))
+        self.docs: List[str] = []
+        self.sections: List[Dict[str, Any]] = []  # {"doc": int, "key": str, "ids": [positions]}
+        self.sums: Optional[np.ndarray] = None
+        self.counts = np.zeros(0, dtype=np.int64)
+        self._doc_pos: Dict[str, int] = {}
+        self._section_pos: Dict[Tuple[int, str], int] = {}
+        self._centroids: Optional[Tuple[np.ndarray, np.ndarray]] = None
+
+    @classmethod
+    def from_config(cls, config: Optional[Mapping]) -> "HierarchicalIndex":
+        block = (config or {}).get("hierarchical_retrieval") or {}
+        return cls(block.get("pages_per_section", 4), block.get("chunks_per_section", 16))
+
+    @property
+    def size(self) -> int:
+        return int(self.counts.sum())
+
+    def _section_key(self, md: Mapping[str, Any]) -> str:
+        if md.get("page") is not None:
+            return f"p{int(md['page']) // self.pages_per_section}"
+        if md.get("segment") is not None:  # streamed TXT/DOCX segments play the role of pages
+            return f"s{int(md['segment']) // self.pages_per_section}"
+        return f"c{int(md.get('chunk_index', 0)) // self.chunks_per_section}"
+
+    def add(self, metadatas: Sequence[Mapping[str, Any]], vectors, positions: Iterable[int]):
+        vectors = np.asarray(vectors, dtype=np.float32)
+        if self.sums is None:
+            self.sums = np.zeros((0, vectors.shape[1]), dtype=np.float32)
+        new_rows = []
+        for md, vec, pos in zip(metadatas, vectors, positions):
+            source = str(md.get("source") or md.get("file_path") or "unknown")
+            d = self._doc_pos.get(source)
+            if d is None:
+                d = self._doc_pos[source] = len(self.docs)
+                self.docs.append(source)
+            key = (d, self._section_key(md))
+            s = self._section_pos.get(key)
+            if s is None:
+                s = self._section_pos[key] = len(self.sections)
+                new_rows.append(np.zeros(vectors.shape[1], dtype=np.float32))
+                self.sections.append({"doc": d, "key": key[1], "ids": []})
+            self.sections[s]["ids"].append(int(pos))
+            if s >= len(self.sums):
+                new_rows[s - len(self.sums)] += vec
+            else:
+                self.sums[s] += vec
+        if new_rows:
+            self.sums = np.vstack([self.sums, np.stack(new_rows)])
+        self.counts = np.array([len(sec["ids"]) for sec in self.sections], dtype=np.int64)
+        self._centroids = None
+
+    # ---------- persistence ----------
+    def save(self, folder: Path, prefix: str = ""):
+        """Write `<prefix>hierarchy.npz/.json` (prefix names the index generation)."""
+        folder = Path(folder)
+        if self.sums is None:
+            return
+        with open(folder / f"{prefix}{HIERARCHY_NPZ}", "wb") as fh:
+            np.savez(fh, sums=self.sums)
+        (folder / f"{prefix}{HIERARCHY_JSON}").write_text(json.dumps({
+            "pages_per_section": self.pages_per_section,
+            "chunks_per_section": self.chunks_per_section,
+            "docs": self.docs,
+            "sections": self.sections,
+        }), encoding="utf-8")
+
+    @classmethod
+    def load(cls, folder: Path, prefix: str = "") -> Optional["HierarchicalIndex"]:
+        folder = Path(folder)
+        meta_path, npz_path = folder / f"{prefix}{HIERARCHY_JSON}", folder / f"{prefix}{HIERARCHY_NPZ}"
+        if not (meta_path.exists() and npz_path.exists()):
+            return None
+        meta = json.loads(meta_path.read_text(encoding="utf-8"))
+        h = cls(meta["pages_per_section"], meta["chunks_per_section"])
+        h.docs = meta["docs"]
+        h.sections = meta["sections"]
+        with np.load(npz_path) as data:
+            h.sums = data["sums"]
+        h.counts = np.array([len(sec["ids"]) for sec in h.sections], dtype=np.int64)
+        h._doc_pos = {src: i for i, src in enumerate(h.docs)}
+        h._section_pos = {(sec["doc"], sec["key"]): i for i, sec in enumerate(h.sections)}
+        return h
+
+    # ---------- search ----------
+    def _centroid_matrices(self) -> Tuple[np.ndarray, np.ndarray]:
+        if self._centroids is None:
+            doc_sums = np.zeros((len(self.docs), self.sums.shape[1]), dtype=np.float32)
+            np.add.at(doc_sums, np.array([sec["doc"] for sec in self.sections]), self.sums)
+            self._centroids = (_unit(doc_sums), _unit(self.sums))
+        return self._centroids
+
+    def candidates(self, query: np.ndarray, top_docs: int, top_sections: int, min_ids: int) -> Tuple[List[int], int]:
+        """Chunk positions under the best sections of the best documents, and the centroids scored."""
+        doc_c, sec_c = self._centroid_matrices()
+        q = _unit(np.asarray(query, dtype=np.float32))
+        best_docs = np.argsort(-(doc_c @ q))[:top_docs]
+        in_docs = np.flatnonzero(np.isin([sec["doc"] for sec in self.sections], best_docs))
+        ranked = in_docs[np.argsort(-(sec_c[in_docs] @ q))]
+        ids: List[int] = []
+        for n, s in enumerate(ranked):
+            if n >= top_sections and len(ids) >= min_ids:
+                break
+            ids.extend(self.sections[s]["ids"])
+        return ids, len(doc_c) + len(in_docs)
+
+    def search(self, index, queries, k: int, top_docs: int = 5, top_sections: int = 20) -> List[List[Tuple[int, float]]]:
+        """Per query: [(faiss position, L2 distance)] of the k nearest chunks among the candidates."""
+        results = []
+        for q in np.asarray(queries, dtype=np.float32):
+            ids, scored = self.candidates(q, top_docs, top_sections, min_ids=k)
+            vecs = index.reconstruct_batch(np.asarray(ids, dtype=np.int64))
+            dist = ((vecs - q) ** 2).sum(axis=1)
+            top = np.argsort(dist)[:k]
+            VECTORS_SCORED.observe(scored + len(ids), mode="hierarchical")
+            results.append([(ids[i], float(dist[i])) for i in top])
+        log.debug("Hierarchical search", queries=len(results), docs=len(self.docs), sections=len(self.sections))
+        return results
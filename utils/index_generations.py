@@ -0,0 +1,131 @@
+from __future__ import annotations
+import json
+import os
+import re
+import threading
+import time
+import uuid
+from contextlib import contextmanager, nullcontext
+from pathlib import Path
+from typing import Dict, Iterator, Optional
+
+try:
+    import fcntl
+except ImportError:  # non-POSIX: the writer lock only covers threads of this process
+    fcntl = None
+
+from logger import GLOBAL_LOGGER as log
+from utils.metrics import REGISTRY
+
+CURRENT = "CURRENT"
+LOCK_FILE = ".write.lock"
+
+INDEX_LOCK_WAIT = REGISTRY.histogram("docportal_index_lock_wait_seconds", "Time spent waiting for a session index write lock")
+INDEX_GENERATIONS = REGISTRY.counter("docportal_index_generations_total", "Index generations published")
+
+_THREAD_LOCKS: Dict[str, threading.Lock] = {}
+_THREAD_LOCKS_GUARD = threading.Lock()
+
+
+@contextmanager
+def folder_lock(folder, shared: bool = False) -> Iterator[None]:
+    """
+    flock on `folder`/.write.lock, so it spans worker processes: exclusive for writers,
+    shared for readers that must not see a half-written folder. Exclusive holders in this
+    process are also serialized by a thread lock.
+    """
+    folder = Path(folder)
+    folder.mkdir(parents=True, exist_ok=True)
+    thread_lock = nullcontext()
+    if not shared:
+        with _THREAD_LOCKS_GUARD:
+            thread_lock = _THREAD_LOCKS.setdefault(str(folder.resolve()), threading.Lock())
+    start = time.monotonic()
+    with thread_lock, open(folder / LOCK_FILE, "a+") as fh:
+        if fcntl is not None:
+            fcntl.flock(fh, fcntl.LOCK_SH if shared else fcntl.LOCK_EX)
+        INDEX_LOCK_WAIT.observe(time.monotonic() - start)
+        try:
+            yield
+        finally:
+            if fcntl is not None:
+                fcntl.flock(fh, fcntl.LOCK_UN)
+
+
+class Generation:
+    """One immutable snapshot of a session index: every file shares the generation's prefix."""
+    def __init__(self, folder: Path, number: int, prefix: str):
+        self.folder = folder
+        self.number = number
+        self.prefix = prefix  # FAISS index_name, e.g. "index.g000003"
+
+    @property
+    def meta_path(self) -> Path:
+        # generation 0 is the pre-generation layout
+        return self.folder / ("ingested_meta.json" if self.number == 0 else f"{self.prefix}.meta.json")
+
+    @property
+    def hierarchy_prefix(self) -> str:
+        return "" if self.number == 0 else f"{self.prefix}."
+
+    def exists(self) -> bool:
+        return all((self.folder / f"{self.prefix}{ext}").exists() for ext in (".faiss", ".pkl"))
+
+
+class IndexGenerations:
+    """
+    Versioned generations of one session index folder.
+
+    A writer holds `write_lock()` (an flock on the folder, so it spans worker processes),
+    writes a complete new generation under fresh file names, then `publish()`es it by
+    atomically replacing the CURRENT pointer. Readers resolve CURRENT once and open that
+    generation's files, which are never modified afterwards, so a reader always sees a
+    consistent snapshot while a writer appends. The newest `keep` generations are kept so
+    a reader that resolved an older pointer can still finish loading. A folder without
+    CURRENT (written before generations existed) is read as generation 0.
+    """
+    def __init__(self, folder, index_name: str = "index", keep: int = 3):
+        self.folder = Path(folder)
+        self.index_name = index_name
+        self.keep = max(2, int(keep))
+        self._pattern = re.compile(rf"^{re.escape(index_name)}\.g(\d+)\.")
+
+    def _prefix(self, number: int) -> str:
+        return f"{self.index_name}.g{number:06d}"
+
+    def current(self) -> Optional[Generation]:
+        try:
+            pointer = json.loads((self.folder / CURRENT).read_text(encoding="utf-8"))
+            return Generation(self.folder, int(pointer["generation"]), pointer["prefix"])
+        except FileNotFoundError:
+            legacy = Generation(self.folder, 0, self.index_name)
+            return legacy if legacy.exists() else None
+
+    def next(self) -> Generation:
+        cur = self.current()
+        n = (cur.number if cur else 0) + 1
+        return Generation(self.folder, n, self._prefix(n))
+
+    def write_lock(self):
+        return folder_lock(self.folder)
+
+    def publish(self, gen: Generation):
+        """Point readers at `gen` (atomic rename), then drop generations beyond `keep`."""
+        tmp = self.folder / f".tmp-{uuid.uuid4().hex}"
+        tmp.write_text(json.dumps({"generation": gen.number, "prefix": gen.prefix}), encoding="utf-8")
+        os.replace(tmp, self.folder / CURRENT)
+        INDEX_GENERATIONS.inc()
+        self.prune(gen.number)
+        log.info("Index generation published", folder=str(self.folder), generation=gen.number)
+
+    def prune(self, current: int):
+        """Delete older generations (and leftovers of aborted writes) outside the kept window."""
+        for p in self.folder.iterdir():
+            m = self._pattern.match(p.name)
+            if m and not current - self.keep < int(m.group(1)) <= current:
+                p.unlink(missing_ok=True)
+        if current >= self.keep:  # the pre-generation files are older than any generation
+            legacy = Generation(self.folder, 0, self.index_name)
+            for p in (self.folder / f"{self.index_name}.faiss", self.folder / f"{self.index_name}.pkl",
+                      legacy.meta_path, self.folder / "hierarchy.json", self.folder / "hierarchy.npz"):
+                p.unlink(missing_ok=True)
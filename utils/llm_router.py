@@ -0,0 +1,362 @@
+from __future__ import annotations
+import asyncio
+import threading
+import time
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, Future, ThreadPoolExecutor, wait
+from contextvars import copy_context
+from typing import Any, Callable, Dict, List, Mapping, Optional, Tuple
+
+from langchain_core.language_models.chat_models import BaseChatModel
+from langchain_core.outputs import ChatResult
+
+from logger import GLOBAL_LOGGER as log
+from utils.metrics import REGISTRY
+from utils.rate_limiter import RateLimitedChatModel, RateLimitExceeded
+
+LLM_CALL_SECONDS = REGISTRY.histogram("docportal_llm_call_seconds", "LLM call latency by provider and outcome")
+LLM_HEDGES = REGISTRY.counter("docportal_llm_hedges_total", "Hedged LLM requests by primary and winner")
+LLM_FAILOVERS = REGISTRY.counter("docportal_llm_failovers_total", "Requests moved to the next provider after a failure")
+LLM_BREAKER_STATE = REGISTRY.gauge("docportal_llm_breaker_state", "Circuit breaker state (0 closed, 1 half-open, 2 open)")
+
+_BREAKER_CODES = {"closed": 0, "half_open": 1, "open": 2}
+# Threads for hedged sync calls: a losing call cannot be interrupted and finishes in the background.
+# Only provider calls run here; rate-limit budget is taken by the caller before submitting.
+_HEDGE_POOL = ThreadPoolExecutor(max_workers=32, thread_name_prefix="llm-hedge")
+
+
+class ProvidersUnavailable(RuntimeError):
+    """Every provider's circuit breaker is open."""
+
+
+# ---------- Latency tracking ----------
+class LatencyTracker:
+    """Rolling window of successful call latencies for one provider."""
+    def __init__(self, window: int = 200):
+        self._samples: deque = deque(maxlen=window)
+        self._lock = threading.Lock()
+
+    def observe(self, seconds: float):
+        with self._lock:
+            self._samples.append(seconds)
+
+    def percentile(self, q: float, min_samples: int = 20) -> Optional[float]:
+        with self._lock:
+            samples = sorted(self._samples)
+        if len(samples) < max(1, min_samples):
+            return None
+        return samples[min(len(samples) - 1, int(round(q / 100.0 * (len(samples) - 1))))]
+
+
+# ---------- Circuit breaker ----------
+class CircuitBreaker:
+    """
+    closed -> open after `failure_threshold` consecutive failures; after `reset_seconds` one
+    trial call is let through (half-open) and its outcome closes or re-opens the circuit.
+    """
+    def __init__(self, name: str, failure_threshold: int = 3, reset_seconds: float = 30.0,
+                 clock: Callable[[], float] = time.monotonic):
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.reset_seconds = reset_seconds
+        self.clock = clock
+        self.state = "closed"
+        self.failures = 0
+        self.opened_at = 0.0
+        self._trial = False
+        self._lock = threading.Lock()
+
+    def _set(self, state: str):
+        if state != self.state:
+            log.warning("LLM circuit breaker state changed", provider=self.name, old=self.state, new=state)
+        self.state = state
+        LLM_BREAKER_STATE.set(_BREAKER_CODES[state], provider=self.name)
+
+    def allow(self) -> bool:
+        with self._lock:
+            if self.state == "closed":
+                return True
+            if self.state == "open" and self.clock() - self.opened_at >= self.reset_seconds:
+                self._set("half_open")
+            if self.state == "half_open" and not self._trial:
+                self._trial = True
+                return True
+            return False
+
+    def record_success(self):
+        with self._lock:
+            self.failures = 0
+            self._trial = False
+            self._set("closed")
+
+    def record_failure(self):
+        with self._lock:
+            self.failures += 1
+            self._trial = False
+            if self.state == "half_open" or self.failures >= self.failure_threshold:
+                self.opened_at = self.clock()
+                self._set("open")
+
+    def release(self):
+        """A trial call was cancelled before it finished; let another one through."""
+        with self._lock:
+            self._trial = False
+
+
+# Trackers and breakers outlive client rebuilds (config reloads), so history is kept.
+_TRACKERS: Dict[str, LatencyTracker] = {}
+_BREAKERS: Dict[str, CircuitBreaker] = {}
+_STATE_LOCK = threading.Lock()
+
+
+def _provider_state(name: str, failure_threshold: int, reset_seconds: float):
+    with _STATE_LOCK:
+        tracker = _TRACKERS.setdefault(name, LatencyTracker())
+        breaker = _BREAKERS.get(name)
+        if breaker is None:
+            breaker = _BREAKERS[name] = CircuitBreaker(name, failure_threshold, reset_seconds)
+        breaker.failure_threshold, breaker.reset_seconds = failure_threshold, reset_seconds
+        return tracker, breaker
+
+
+class _Provider:
+    def __init__(self, name: str, llm, tracker: LatencyTracker, breaker: CircuitBreaker):
+        self.name = name
+        self.llm = llm
+        self.tracker = tracker
+        self.breaker = breaker
+
+    @property
+    def limited(self) -> bool:
+        return isinstance(self.llm, RateLimitedChatModel)
+
+    def admit(self, messages, block: bool = True) -> Optional[int]:
+        """Local rate-limit budget for one call (0 when unlimited); None if block=False and none is free."""
+        return self.llm.reserve(messages, block=block) if self.limited else 0
+
+    async def aadmit(self, messages) -> int:
+        return await self.llm.areserve(messages) if self.limited else 0
+
+    def generate(self, reserved: int, messages, stop, run_manager, kwargs) -> ChatResult:
+        if self.limited:
+            return self.llm.generate_reserved(reserved, messages, stop=stop, run_manager=run_manager, **kwargs)
+        return self.llm._generate(messages, stop=stop, run_manager=run_manager, **kwargs)
+
+    async def agenerate(self, reserved: int, messages, stop, run_manager, kwargs) -> ChatResult:
+        if self.limited:
+            return await self.llm.agenerate_reserved(reserved, messages, stop=stop, run_manager=run_manager, **kwargs)
+        return await self.llm._agenerate(messages, stop=stop, run_manager=run_manager, **kwargs)
+
+    def succeeded(self, seconds: float):
+        self.tracker.observe(seconds)
+        self.breaker.record_success()
+        LLM_CALL_SECONDS.observe(seconds, provider=self.name, outcome="ok")
+
+    def failed(self, seconds: float, error: BaseException):
+        LLM_CALL_SECONDS.observe(seconds, provider=self.name, outcome="error")
+        if isinstance(error, RateLimitExceeded):
+            self.breaker.release()  # our own budget, not a provider fault
+            return
+        self.breaker.record_failure()
+        log.warning("LLM provider call failed", provider=self.name, error=str(error))
+
+
+# ---------- Router ----------
+class HedgedChatModel(BaseChatModel):
+    """
+    Chat model over an ordered list of providers (primary first).
+
+    If the active call has not finished after the provider's latency percentile
+    (`hedge_percentile`, clamped to `hedge_min_delay`), the same request is sent to the next
+    provider and the first successful response wins; the other call is cancelled (async) or
+    ignored (sync). A failed call fails over to the next provider immediately, and providers
+    whose circuit breaker is open are skipped.
+
+    Local rate-limit budget is taken before a provider call starts, so the hedge delay and the
+    latency samples measure the provider only: the primary and failovers wait for budget, a
+    hedge is only sent to a provider with budget free right now.
+    """
+    providers: List[Any]
+    hedge: bool = True
+    hedge_percentile: float = 95.0
+    hedge_min_delay: float = 0.5
+    hedge_default_delay: float = 8.0
+    min_samples: int = 20
+
+    @property
+    def _llm_type(self) -> str:
+        return "hedged-" + "+".join(p.name for p in self.providers)
+
+    @property
+    def _identifying_params(self) -> Dict[str, Any]:
+        return {"providers": [p.name for p in self.providers], "hedge": self.hedge}
+
+    def _hedge_delay(self, provider: _Provider) -> Optional[float]:
+        if not self.hedge:
+            return None
+        p = provider.tracker.percentile(self.hedge_percentile, self.min_samples)
+        return max(self.hedge_min_delay, p if p is not None else self.hedge_default_delay)
+
+    def _next(self, remaining: List[_Provider]) -> Optional[_Provider]:
+        while remaining:
+            p = remaining.pop(0)
+            if p.breaker.allow():
+                return p
+        return None
+
+    def _admitted(self, remaining: List[_Provider], messages) -> Tuple[Optional[_Provider], int, Optional[BaseException]]:
+        """Next provider with its budget (waiting for it), skipping those whose budget times out."""
+        error = None
+        while True:
+            p = self._next(remaining)
+            if p is None:
+                return None, 0, error
+            try:
+                return p, p.admit(messages), error
+            except RateLimitExceeded as e:
+                p.failed(0.0, e)
+                error = e
+
+    def _hedge_backup(self, remaining: List[_Provider], messages) -> Tuple[Optional[_Provider], int]:
+        """Next provider whose budget is free right now; a provider without it stays available for failover."""
+        p = self._next(remaining)
+        if p is None:
+            return None, 0
+        reserved = p.admit(messages, block=False)
+        if reserved is None:
+            p.breaker.release()
+            remaining.insert(0, p)
+            log.info("Hedge skipped: no local rate-limit budget", provider=p.name)
+            return None, 0
+        return p, reserved
+
+    def _call(self, p: _Provider, reserved: int, messages, stop, run_manager, kwargs) -> ChatResult:
+        start = time.monotonic()
+        try:
+            result = p.generate(reserved, messages, stop, run_manager, kwargs)
+        except BaseException as e:
+            p.failed(time.monotonic() - start, e)
+            raise
+        p.succeeded(time.monotonic() - start)
+        return result
+
+    async def _acall(self, p: _Provider, reserved: int, messages, stop, run_manager, kwargs) -> ChatResult:
+        start = time.monotonic()
+        try:
+            result = await p.agenerate(reserved, messages, stop, run_manager, kwargs)
+        except asyncio.CancelledError:
+            p.breaker.release()
+            raise
+        except BaseException as e:
+            p.failed(time.monotonic() - start, e)
+            raise
+        p.succeeded(time.monotonic() - start)
+        return result
+
+    def _submit(self, p: _Provider, reserved: int, messages, stop, run_manager, kwargs) -> Future:
+        # each call runs in its own copy of the request context (Server-Timing stages, request tags)
+        return _HEDGE_POOL.submit(copy_context().run, self._call, p, reserved, messages, stop, run_manager, kwargs)
+
+    def _finish(self, winner: _Provider, primary: _Provider, hedged: bool, result: ChatResult) -> ChatResult:
+        if hedged:
+            LLM_HEDGES.inc(primary=primary.name, winner=winner.name)
+        result.llm_output = {**(result.llm_output or {}), "provider": winner.name}
+        return result
+
+    def _generate(self, messages, stop=None, run_manager=None, **kwargs) -> ChatResult:
+        remaining = list(self.providers)
+        primary, reserved, last_error = self._admitted(remaining, messages)
+        if primary is None:
+            raise last_error or ProvidersUnavailable("All LLM providers are unavailable (circuit breakers open)")
+        pending = {self._submit(primary, reserved, messages, stop, run_manager, kwargs): primary}
+        hedged = False
+        try:
+            while pending:
+                timeout = self._hedge_delay(primary) if not hedged and remaining else None
+                done, _ = wait(pending, timeout=timeout, return_when=FIRST_COMPLETED)
+                if not done:
+                    hedged = True
+                    backup, reserved = self._hedge_backup(remaining, messages)
+                    if backup is not None:
+                        log.info("Hedging LLM request", primary=primary.name, secondary=backup.name,
+                                 after_seconds=round(timeout or 0, 3))
+                        pending[self._submit(backup, reserved, messages, stop, run_manager, kwargs)] = backup
+                    continue
+                for fut in done:
+                    p = pending.pop(fut)
+                    if fut.exception() is None:
+                        return self._finish(p, primary, hedged, fut.result())
+                    last_error = fut.exception()
+                if not pending:
+                    backup, reserved, _ = self._admitted(remaining, messages)
+                    if backup is not None:
+                        LLM_FAILOVERS.inc(to=backup.name)
+                        pending[self._submit(backup, reserved, messages, stop, run_manager, kwargs)] = backup
+            raise last_error or ProvidersUnavailable("No LLM provider available")
+        finally:
+            for fut in pending:
+                fut.cancel()
+
+    async def _agenerate(self, messages, stop=None, run_manager=None, **kwargs) -> ChatResult:
+        def start(p: _Provider, reserved: int) -> asyncio.Task:
+            return asyncio.ensure_future(self._acall(p, reserved, messages, stop, run_manager, kwargs))
+
+        async def admitted() -> Tuple[Optional[_Provider], int, Optional[BaseException]]:
+            error = None
+            while True:
+                p = self._next(remaining)
+                if p is None:
+                    return None, 0, error
+                try:
+                    return p, await p.aadmit(messages), error
+                except RateLimitExceeded as e:
+                    p.failed(0.0, e)
+                    error = e
+
+        remaining = list(self.providers)
+        primary, reserved, last_error = await admitted()
+        if primary is None:
+            raise last_error or ProvidersUnavailable("All LLM providers are unavailable (circuit breakers open)")
+        pending = {start(primary, reserved): primary}
+        hedged = False
+        try:
+            while pending:
+                timeout = self._hedge_delay(primary) if not hedged and remaining else None
+                done, _ = await asyncio.wait(pending, timeout=timeout, return_when=asyncio.FIRST_COMPLETED)
+                if not done:
+                    hedged = True
+                    backup, reserved = self._hedge_backup(remaining, messages)
+                    if backup is not None:
+                        log.info("Hedging LLM request", primary=primary.name, secondary=backup.name,
+                                 after_seconds=round(timeout or 0, 3))
+                        pending[start(backup, reserved)] = backup
+                    continue
+                for task in done:
+                    p = pending.pop(task)
+                    if task.exception() is None:
+                        return self._finish(p, primary, hedged, task.result())
+                    last_error = task.exception()
+                if not pending:
+                    backup, reserved, _ = await admitted()
+                    if backup is not None:
+                        LLM_FAILOVERS.inc(to=backup.name)
+                        pending[start(backup, reserved)] = backup
+            raise last_error or ProvidersUnavailable("No LLM provider available")
+        finally:
+            for task in pending:
+                task.cancel()  # the losing request is aborted
+
+
+def hedged_llm(llms: Mapping[str, Any], routing: Mapping) -> HedgedChatModel:
+    """Build the router from {provider_key: client} in priority order and the llm_routing block."""
+    threshold = int(routing.get("breaker_failures", 3))
+    reset = float(routing.get("breaker_reset_seconds", 30))
+    providers = [_Provider(name, llm, *_provider_state(name, threshold, reset)) for name, llm in llms.items()]
+    return HedgedChatModel(
+        providers=providers,
+        hedge=bool(routing.get("hedge", True)),
+        hedge_percentile=float(routing.get("hedge_percentile", 95)),
+        hedge_min_delay=float(routing.get("hedge_min_delay_seconds", 0.5)),
+        hedge_default_delay=float(routing.get("hedge_default_delay_seconds", 8)),
+        min_samples=int(routing.get("min_samples", 20)),
+    )
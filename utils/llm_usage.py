@@ -0,0 +1,377 @@
+from __future__ import annotations
+import atexit
+import os
+import sqlite3
+import threading
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from datetime import datetime, timedelta, timezone
+from pathlib import Path
+from typing import Any, Dict, List, Mapping, Optional, Tuple
+from uuid import UUID
+
+from langchain_core.callbacks import BaseCallbackHandler
+from langchain_core.outputs import LLMResult
+
+from logger import GLOBAL_LOGGER as log
+from utils.config_loader import get_config
+from utils.metrics import REGISTRY, request_path, tag_request
+from utils.rate_limiter import RateLimitExceeded, estimate_tokens
+
+LLM_TOKENS = REGISTRY.counter("docportal_llm_tokens_total", "LLM tokens by feature, provider and kind (prompt/completion)")
+LLM_LATENCY = REGISTRY.histogram("docportal_llm_latency_seconds", "LLM call latency by feature and provider")
+LLM_TTFT = REGISTRY.histogram("docportal_llm_ttft_seconds", "Time to first token by feature and provider")
+LLM_BUDGET_ACTIONS = REGISTRY.counter("docportal_llm_budget_actions_total", "Requests degraded or rejected by token budgets")
+
+_session: ContextVar[Optional[str]] = ContextVar("llm_usage_session", default=None)
+
+
+def set_usage_session(session_id: Optional[str]):
+    """Attribute the LLM calls of the current request to `session_id`."""
+    _session.set(session_id)
+    tag_request(session_id=session_id)
+
+
+def _today() -> str:
+    return datetime.now(timezone.utc).strftime("%Y-%m-%d")
+
+
+# ---------- Ledger ----------
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS llm_usage (
+    day               TEXT NOT NULL,
+    session_id        TEXT NOT NULL,
+    endpoint          TEXT NOT NULL,
+    feature           TEXT NOT NULL,
+    provider          TEXT NOT NULL,
+    calls             INTEGER NOT NULL DEFAULT 0,
+    errors            INTEGER NOT NULL DEFAULT 0,
+    prompt_tokens     INTEGER NOT NULL DEFAULT 0,
+    completion_tokens INTEGER NOT NULL DEFAULT 0,
+    latency_seconds   REAL NOT NULL DEFAULT 0,
+    PRIMARY KEY (day, session_id, endpoint, feature, provider)
+);
+CREATE INDEX IF NOT EXISTS idx_llm_usage_session ON llm_usage (session_id);
+"""
+
+
+_UPSERT = (
+    "INSERT INTO llm_usage VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?) "
+    "ON CONFLICT(day, session_id, endpoint, feature, provider) DO UPDATE SET "
+    "calls = calls + excluded.calls, errors = errors + excluded.errors, "
+    "prompt_tokens = prompt_tokens + excluded.prompt_tokens, "
+    "completion_tokens = completion_tokens + excluded.completion_tokens, "
+    "latency_seconds = latency_seconds + excluded.latency_seconds"
+)
+_SCOPE_IDLE_SECONDS = 3600  # in-memory totals dropped after this long without use
+
+
+class UsageLedger:
+    """
+    SQLite totals of LLM usage per UTC day, session, endpoint, feature and provider.
+    Shared by uvicorn workers, so budgets hold across processes.
+
+    `record` only updates in-memory state: records are aggregated in a buffer that a
+    background thread writes every `flush_seconds`, so LLM callbacks (which run on the event
+    loop in the async paths) never wait on SQLite. Budget reads come from in-memory session /
+    day totals, which the flusher re-reads from the database for the scopes in use, picking
+    up other workers' usage within one flush interval.
+    """
+    def __init__(self, db_path: Optional[str] = None, flush_seconds: float = 1.0):
+        self.db_path = Path(db_path or os.getenv("LLM_USAGE_DB_PATH", os.path.join("data", "llm_usage.db")))
+        self.db_path.parent.mkdir(parents=True, exist_ok=True)
+        with self._conn() as conn:
+            conn.executescript(_SCHEMA)
+        self.flush_seconds = flush_seconds
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._pending: Dict[Tuple[str, str, str, str, str], List[float]] = {}  # calls, errors, prompt, completion, latency
+        self._totals: Dict[Tuple[str, str], int] = {}  # ("session", id) / ("day", day) -> tokens
+        self._used: Dict[Tuple[str, str], float] = {}  # scope -> last record or read (monotonic)
+        self._flusher: Optional[threading.Thread] = None
+
+    @contextmanager
+    def _conn(self):
+        conn = sqlite3.connect(str(self.db_path), timeout=10)
+        try:
+            conn.execute("PRAGMA journal_mode=WAL")
+            yield conn
+            conn.commit()
+        finally:
+            conn.close()
+
+    def record(self, session_id: str, endpoint: str, feature: str, provider: str,
+               prompt_tokens: int, completion_tokens: int, latency: float, error: bool = False):
+        """Buffer one call's usage; written by the background flusher."""
+        key = (_today(), session_id, endpoint, feature, provider)
+        tokens = int(prompt_tokens) + int(completion_tokens)
+        with self._lock:
+            row = self._pending.setdefault(key, [0, 0, 0, 0, 0.0])
+            row[0] += 1
+            row[1] += int(error)
+            row[2] += int(prompt_tokens)
+            row[3] += int(completion_tokens)
+            row[4] += float(latency)
+            for scope in (("session", session_id), ("day", key[0])):
+                if scope in self._totals:
+                    self._totals[scope] += tokens
+            if self._flusher is None:
+                self._flusher = threading.Thread(target=self._run, name="llm-usage-flush", daemon=True)
+                self._flusher.start()
+                atexit.register(self._flush_quietly)
+
+    def _run(self):
+        while True:
+            time.sleep(self.flush_seconds)
+            self._flush_quietly()
+
+    def _flush_quietly(self):
+        try:
+            self.flush()
+        except Exception as e:  # accounting must never fail the worker; the records stay buffered
+            log.warning("LLM usage flush failed", error=str(e), buffered=len(self._pending))
+
+    def _pending_tokens(self, scope: Tuple[str, str]) -> int:
+        """Buffered tokens in `scope`; caller holds the lock."""
+        col = 1 if scope[0] == "session" else 0
+        return sum(int(row[2] + row[3]) for key, row in self._pending.items() if key[col] == scope[1])
+
+    def _read_scope(self, scope: Tuple[str, str]) -> int:
+        col = "session_id" if scope[0] == "session" else "day"
+        with self._conn() as conn:
+            row = conn.execute(f"SELECT SUM(prompt_tokens + completion_tokens) FROM llm_usage WHERE {col} = ?",
+                               (scope[1],)).fetchone()
+        return int(row[0] or 0)
+
+    def flush(self):
+        """Write the buffered records in one transaction, then refresh the in-memory totals in use."""
+        with self._flush_lock:
+            with self._lock:
+                batch, self._pending = self._pending, {}
+            if batch:
+                try:
+                    with self._conn() as conn:
+                        conn.executemany(_UPSERT, [(*key, *row) for key, row in batch.items()])
+                except Exception:
+                    with self._lock:  # put them back for the next attempt
+                        for key, row in batch.items():
+                            merged = self._pending.setdefault(key, [0, 0, 0, 0, 0.0])
+                            for i, value in enumerate(row):
+                                merged[i] += value
+                    raise
+            now = time.monotonic()
+            with self._lock:
+                for scope, used in list(self._used.items()):
+                    if now - used > _SCOPE_IDLE_SECONDS:
+                        self._used.pop(scope)
+                        self._totals.pop(scope, None)
+                scopes = list(self._totals)
+            # only the flusher writes this worker's records, so the database now holds every
+            # record that left the buffer; the buffer holds the rest
+            fresh = {scope: self._read_scope(scope) for scope in scopes}
+            with self._lock:
+                for scope, tokens in fresh.items():
+                    if scope in self._totals:
+                        self._totals[scope] = tokens + self._pending_tokens(scope)
+
+    def _scope_tokens(self, scope: Tuple[str, str]) -> int:
+        with self._lock:
+            self._used[scope] = time.monotonic()
+            if scope in self._totals:
+                return self._totals[scope]
+        tokens = self._read_scope(scope)  # first use of the scope in this worker
+        with self._lock:
+            return self._totals.setdefault(scope, tokens + self._pending_tokens(scope))
+
+    def session_tokens(self, session_id: str) -> int:
+        return self._scope_tokens(("session", session_id))
+
+    def day_tokens(self, day: Optional[str] = None) -> int:
+        if day is None or day == _today():
+            return self._scope_tokens(("day", _today()))
+        self.flush()
+        return self._read_scope(("day", day))
+
+    def summary(self, session_id: Optional[str] = None, day: Optional[str] = None) -> List[Dict[str, Any]]:
+        """Totals grouped by session, endpoint and feature (optionally for one session / day)."""
+        where, args = [], []
+        for col, val in (("session_id", session_id), ("day", day)):
+            if val:
+                where.append(f"{col} = ?")
+                args.append(val)
+        self.flush()
+        sql = ("SELECT session_id, endpoint, feature, group_concat(DISTINCT provider), SUM(calls), SUM(errors), "
+               "SUM(prompt_tokens), SUM(completion_tokens), SUM(latency_seconds) FROM llm_usage "
+               + (f"WHERE {' AND '.join(where)} " if where else "")
+               + "GROUP BY session_id, endpoint, feature ORDER BY session_id, endpoint, feature")
+        with self._conn() as conn:
+            rows = conn.execute(sql, args).fetchall()
+        keys = ("session_id", "endpoint", "feature", "providers", "calls", "errors",
+                "prompt_tokens", "completion_tokens", "latency_seconds")
+        return [dict(zip(keys, r)) for r in rows]
+
+
+_ledger: Optional[UsageLedger] = None
+_ledger_lock = threading.Lock()
+
+
+def get_ledger() -> UsageLedger:
+    global _ledger
+    with _ledger_lock:
+        if _ledger is None:
+            block = get_config().get("llm_budgets") or {}
+            _ledger = UsageLedger(flush_seconds=float(block.get("flush_seconds", 1.0)))
+        return _ledger
+
+
+# ---------- Budgets (config: llm_budgets) ----------
+class BudgetExceeded(RateLimitExceeded):
+    """A session or daily token budget is spent (mapped to HTTP 429 like provider limits)."""
+    def __init__(self, scope: str, used: int, limit: int, retry_after: float):
+        super().__init__("budget", scope, retry_after)
+        self.args = (f"Token budget for {scope} exhausted ({used}/{limit} tokens)",)
+        self.scope = scope
+
+
+def _seconds_to_utc_midnight() -> float:
+    now = datetime.now(timezone.utc)
+    return ((now + timedelta(days=1)).replace(hour=0, minute=0, second=0, microsecond=0) - now).total_seconds()
+
+
+def _budgets(session_id: Optional[str]) -> List[Tuple[str, int, int]]:
+    """(scope, tokens used, limit) for each configured budget that applies; [] when disabled."""
+    block = get_config().get("llm_budgets") or {}
+    if not block.get("enabled"):
+        return []
+    ledger = get_ledger()
+    budgets = []
+    if block.get("daily_tokens"):
+        budgets.append(("day", ledger.day_tokens(), int(block["daily_tokens"])))
+    if session_id and block.get("session_tokens"):
+        budgets.append((f"session {session_id}", ledger.session_tokens(session_id), int(block["session_tokens"])))
+    return budgets
+
+
+def _reject(scope: str, used: int, limit: int):
+    LLM_BUDGET_ACTIONS.inc(action="reject", scope=scope.split()[0])
+    log.warning("LLM token budget exhausted", scope=scope, used=used, limit=limit)
+    raise BudgetExceeded(scope, used, limit, _seconds_to_utc_midnight())
+
+
+def check_budget(session_id: Optional[str], tokens: int = 0):
+    """Raise BudgetExceeded if a call of about `tokens` prompt tokens would exceed a budget."""
+    for scope, used, limit in _budgets(session_id):
+        if used + tokens > limit:
+            _reject(scope, used, limit)
+
+
+def fit_to_budget(text: str, feature: str, session_id: Optional[str] = None) -> str:
+    """
+    Budget gate for a call's large input (document, combined docs, retrieved context):
+    raises when a budget is spent, and trims `text` to `degrade_max_input_tokens` once usage
+    is past `degrade_at` or the full text would not fit. `session_id` defaults to the
+    request's usage session.
+    """
+    session_id = session_id or _session.get()
+    block = get_config().get("llm_budgets") or {}
+    degrade_at = float(block.get("degrade_at", 0.8))
+    tokens = estimate_tokens(text)
+    degrade = False
+    for scope, used, limit in _budgets(session_id):
+        if used >= limit:
+            _reject(scope, used, limit)
+        degrade = degrade or used >= degrade_at * limit or used + tokens > limit
+    max_chars = int(block.get("degrade_max_input_tokens", 4000)) * 4
+    if not degrade or len(text) <= max_chars:
+        return text
+    LLM_BUDGET_ACTIONS.inc(action="degrade", scope="session" if session_id else "day")
+    log.info("LLM input trimmed by token budget", feature=feature, session_id=session_id,
+             chars=len(text), kept=max_chars)
+    return text[:max_chars]
+
+
+# ---------- Callback ----------
+def _usage(response: LLMResult, prompt_estimate: int) -> Tuple[int, int]:
+    usage = (response.llm_output or {}).get("token_usage") or {}
+    if usage.get("prompt_tokens") is not None:
+        return int(usage["prompt_tokens"]), int(usage.get("completion_tokens") or 0)
+    text = ""
+    for gens in response.generations:
+        for gen in gens:
+            meta = getattr(getattr(gen, "message", None), "usage_metadata", None)
+            if meta:
+                return int(meta.get("input_tokens") or 0), int(meta.get("output_tokens") or 0)
+            text += gen.text
+    return prompt_estimate, estimate_tokens(text)  # provider did not report usage
+
+
+class UsageCallback(BaseCallbackHandler):
+    """
+    Records tokens, latency, time to first token and provider for every LLM call of one
+    feature, attributed to the request's session and endpoint, and enforces the token
+    budgets before the call reaches the provider.
+    """
+    raise_error = True  # a budget rejection must stop the call
+
+    def __init__(self, feature: str, session_id: Optional[str] = None):
+        self.feature = feature
+        self.session_id = session_id  # else the request's usage session
+        self._runs: Dict[UUID, Dict[str, Any]] = {}
+
+    def _start(self, run_id: UUID, text_tokens: int, invocation_params: Optional[Mapping]):
+        session_id = self.session_id or _session.get()
+        check_budget(session_id, text_tokens)
+        params = invocation_params or {}
+        self._runs[run_id] = {
+            "start": time.perf_counter(), "first_token": None, "prompt": text_tokens,
+            "session_id": session_id or "-", "endpoint": request_path() or "-",
+            "provider": str(params.get("_type", "unknown")).replace("rate-limited-", ""),
+        }
+
+    def on_chat_model_start(self, serialized, messages, *, run_id: UUID, invocation_params=None, **kwargs):
+        tokens = sum(estimate_tokens(str(m.content)) for batch in messages for m in batch)
+        self._start(run_id, tokens, invocation_params)
+
+    def on_llm_start(self, serialized, prompts, *, run_id: UUID, invocation_params=None, **kwargs):
+        self._start(run_id, sum(estimate_tokens(p) for p in prompts), invocation_params)
+
+    def on_llm_new_token(self, token: str, *, run_id: UUID, **kwargs):
+        run = self._runs.get(run_id)
+        if run is not None and run["first_token"] is None:
+            run["first_token"] = time.perf_counter()
+
+    def _finish(self, run_id: UUID, prompt: int, completion: int, provider: Optional[str], error: bool):
+        run = self._runs.pop(run_id, None)
+        if run is None:
+            return
+        latency = time.perf_counter() - run["start"]
+        provider = provider or run["provider"]
+        labels = {"feature": self.feature, "provider": provider}
+        LLM_LATENCY.observe(latency, **labels)
+        # without streaming the first token arrives with the whole response
+        LLM_TTFT.observe((run["first_token"] or run["start"] + latency) - run["start"], **labels)
+        LLM_TOKENS.inc(prompt, kind="prompt", **labels)
+        LLM_TOKENS.inc(completion, kind="completion", **labels)
+        try:
+            get_ledger().record(run["session_id"], run["endpoint"], self.feature, provider,
+                                prompt, completion, latency, error)
+        except Exception as e:  # accounting must never fail the request
+            log.warning("LLM usage not recorded", error=str(e), feature=self.feature)
+
+    def on_llm_end(self, response: LLMResult, *, run_id: UUID, **kwargs):
+        run = self._runs.get(run_id)
+        if run is None:
+            return
+        prompt, completion = _usage(response, run["prompt"])
+        self._finish(run_id, prompt, completion, (response.llm_output or {}).get("provider"), error=False)
+
+    def on_llm_error(self, error: BaseException, *, run_id: UUID, **kwargs):
+        run = self._runs.get(run_id)
+        if run is not None:
+            self._finish(run_id, run["prompt"], 0, None, error=True)
+
+
+def with_usage(llm, feature: str, session_id: Optional[str] = None):
+    """`llm` with usage accounting and budget checks for `feature` attached to every call."""
+    return llm.with_config(callbacks=[UsageCallback(feature, session_id)])
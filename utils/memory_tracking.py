@@ -0,0 +1,199 @@
+from __future__ import annotations
+import os
+import threading
+import tracemalloc
+from contextlib import contextmanager
+from typing import Any, Iterator, List, Mapping, Optional
+
+from logger import GLOBAL_LOGGER as log
+from utils.config_loader import subscribe
+from utils.metrics import REGISTRY, add_stage_hook, remove_stage_hook
+
+_MB = 2**20
+BYTE_BUCKETS = tuple(m * _MB for m in (1, 4, 16, 64, 128, 256, 512, 1024, 2048, 4096, 8192))
+
+PEAK_RSS_GROWTH = REGISTRY.histogram("docportal_memory_peak_rss_growth_bytes",
+                                     "Peak RSS above the start of a stage / request", BYTE_BUCKETS)
+PEAK_ALLOC_GROWTH = REGISTRY.histogram("docportal_memory_peak_alloc_bytes",
+                                       "Peak traced Python allocations above the start of a stage / request", BYTE_BUCKETS)
+PROCESS_RSS = REGISTRY.gauge("docportal_process_rss_bytes", "Resident set size of this worker")
+PROCESS_RSS_PEAK = REGISTRY.gauge("docportal_process_rss_peak_bytes", "Highest RSS of this worker seen by the sampler")
+THRESHOLD_CROSSED = REGISTRY.counter("docportal_memory_threshold_crossed_total", "Stages / requests above the memory threshold")
+
+
+def current_rss() -> Optional[int]:
+    """Resident set size in bytes (/proc on Linux, psutil elsewhere if installed)."""
+    try:
+        with open("/proc/self/statm", "rb") as fh:
+            return int(fh.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError, IndexError):
+        pass
+    try:
+        import psutil
+        return psutil.Process().memory_info().rss
+    except ImportError:
+        return None
+
+
+# import machinery (module code objects) and tracemalloc's own bookkeeping
+_IGNORED_SITES = [tracemalloc.Filter(False, "<frozen importlib._bootstrap>"),
+                  tracemalloc.Filter(False, "<frozen importlib._bootstrap_external>"),
+                  tracemalloc.Filter(False, tracemalloc.__file__)]
+
+
+def _traced() -> int:
+    return tracemalloc.get_traced_memory()[0] if tracemalloc.is_tracing() else 0
+
+
+class _Window:
+    """Memory seen between opening and closing one stage or request."""
+    __slots__ = ("kind", "name", "start_rss", "peak_rss", "start_alloc", "peak_alloc", "top_sites")
+
+    def __init__(self, kind: str, name: str, rss: int, alloc: int):
+        self.kind, self.name = kind, name
+        self.start_rss = self.peak_rss = rss
+        self.start_alloc = self.peak_alloc = alloc
+        self.top_sites: Optional[List[str]] = None  # set when the threshold is first crossed
+
+    def update(self, rss: int, alloc: int):
+        self.peak_rss = max(self.peak_rss, rss)
+        self.peak_alloc = max(self.peak_alloc, alloc)
+
+    def growth(self):
+        return self.peak_rss - self.start_rss, self.peak_alloc - self.start_alloc
+
+
+class MemoryTracker:
+    """
+    High-water marks of RSS and (with tracemalloc) Python allocations per pipeline stage and
+    per request. A sampler thread polls both every `interval` seconds and raises the peak of
+    every open window, so a stage's peak counts whatever else the worker was doing at the
+    time. The first time a window grows past `threshold_bytes`, the top allocation sites are
+    captured at that moment and logged when the window closes.
+    """
+    def __init__(self, interval: float = 0.02, threshold_bytes: int = 512 * _MB, top_n: int = 10):
+        self.interval = interval
+        self.threshold_bytes = threshold_bytes
+        self.top_n = top_n
+        self._windows: set = set()
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="memory-sampler", daemon=True)
+        self.peak_rss = 0
+
+    def start(self) -> "MemoryTracker":
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._stop.set()
+        self._thread.join()
+
+    def _top_sites(self) -> List[str]:
+        if not tracemalloc.is_tracing():
+            return []
+        snapshot = tracemalloc.take_snapshot().filter_traces(_IGNORED_SITES)
+        stats = snapshot.statistics("lineno")[: self.top_n]
+        return [f"{s.traceback[0].filename}:{s.traceback[0].lineno} {s.size / _MB:.1f}MB x{s.count}" for s in stats]
+
+    def _sample(self):
+        rss, alloc = current_rss() or 0, _traced()
+        self.peak_rss = max(self.peak_rss, rss)
+        PROCESS_RSS.set(rss)
+        PROCESS_RSS_PEAK.set(self.peak_rss)
+        top = None
+        with self._lock:
+            windows = list(self._windows)
+        for w in windows:
+            w.update(rss, alloc)
+            if w.top_sites is None and max(w.growth()) >= self.threshold_bytes:
+                top = self._top_sites() if top is None else top  # one snapshot per tick
+                w.top_sites = top
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            try:
+                self._sample()
+            except Exception as e:  # keep sampling; tracking must never break the worker
+                log.warning("Memory sample failed", error=str(e))
+
+    def open(self, kind: str, name: str) -> _Window:
+        w = _Window(kind, name, current_rss() or 0, _traced())
+        with self._lock:
+            self._windows.add(w)
+        return w
+
+    def close(self, w: _Window, tags: Optional[Mapping[str, str]] = None):
+        with self._lock:
+            self._windows.discard(w)
+        w.update(current_rss() or 0, _traced())
+        rss_growth, alloc_growth = w.growth()
+        PEAK_RSS_GROWTH.observe(rss_growth, kind=w.kind, name=w.name)
+        if tracemalloc.is_tracing():
+            PEAK_ALLOC_GROWTH.observe(alloc_growth, kind=w.kind, name=w.name)
+        if max(rss_growth, alloc_growth) < self.threshold_bytes:
+            return
+        THRESHOLD_CROSSED.inc(kind=w.kind, name=w.name)
+        log.warning("Memory threshold crossed", kind=w.kind, name=w.name,
+                    rss_growth_mb=round(rss_growth / _MB, 1), alloc_growth_mb=round(alloc_growth / _MB, 1),
+                    peak_rss_mb=round(w.peak_rss / _MB, 1), top_sites=w.top_sites or self._top_sites(),
+                    **dict(tags or {}))
+
+
+# ---------- Process-wide switch (config: memory_tracking) ----------
+_tracker: Optional[MemoryTracker] = None
+_switch_lock = threading.Lock()
+
+
+@contextmanager
+def _stage_window(name: str) -> Iterator[None]:
+    tracker = _tracker
+    if tracker is None:
+        yield
+        return
+    w = tracker.open("stage", name)
+    try:
+        yield
+    finally:
+        tracker.close(w)
+
+
+def open_request_window(name: str) -> Optional[_Window]:
+    tracker = _tracker
+    return tracker.open("request", name) if tracker is not None else None
+
+
+def close_request_window(w: Optional[_Window], route: str, tags: Optional[Mapping[str, str]] = None):
+    """Close a request window, labelled by route template (bounded metric cardinality)."""
+    tracker = _tracker
+    if w is not None and tracker is not None:
+        w.name = route
+        tracker.close(w, tags)
+
+
+def configure(config: Mapping[str, Any]):
+    """Start, reconfigure or stop tracking from the `memory_tracking` block (hot-reloadable)."""
+    global _tracker
+    block = config.get("memory_tracking") or {}
+    with _switch_lock:
+        if _tracker is not None:
+            remove_stage_hook(_stage_window)
+            _tracker.stop()
+            _tracker = None
+        if block.get("tracemalloc") and block.get("enabled"):
+            if not tracemalloc.is_tracing():
+                tracemalloc.start(int(block.get("tracemalloc_frames", 1)))
+        elif tracemalloc.is_tracing():
+            tracemalloc.stop()
+        if not block.get("enabled"):
+            return
+        _tracker = MemoryTracker(
+            interval=float(block.get("sample_interval_ms", 20)) / 1000,
+            threshold_bytes=int(float(block.get("threshold_mb", 512)) * _MB),
+            top_n=int(block.get("top_n", 10)),
+        ).start()
+        add_stage_hook(_stage_window)
+    log.info("Memory tracking enabled", tracemalloc=tracemalloc.is_tracing(), threshold_mb=block.get("threshold_mb", 512))
+
+
+subscribe(lambda old, new, changed: configure(new), {"memory_tracking"})
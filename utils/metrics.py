@@ -0,0 +1,268 @@
+from __future__ import annotations
+import time
+import threading
+import functools
+from contextlib import ExitStack, contextmanager
+from contextvars import ContextVar
+from typing import Callable, ContextManager, Dict, Iterable, List, Optional, Tuple
+
+# Default latency buckets (seconds): 5ms .. 2min
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120)
+
+LabelKey = Tuple[Tuple[str, str], ...]
+
+
+def _key(labels: Dict[str, str]) -> LabelKey:
+    return tuple(sorted((k, str(v)) for k, v in labels.items()))
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _fmt_labels(key: LabelKey, extra: Optional[Tuple[str, str]] = None) -> str:
+    items = list(key) + ([extra] if extra else [])
+    if not items:
+        return ""
+    return "{" + ",".join(f'{k}="{_escape(v)}"' for k, v in items) + "}"
+
+
+# ---------- Metric types ----------
+class _Metric:
+    kind = "untyped"
+
+    def __init__(self, name: str, help_text: str):
+        self.name = name
+        self.help = help_text
+        self._lock = threading.Lock()
+
+    def samples(self) -> Iterable[str]:
+        raise NotImplementedError
+
+    def render(self) -> str:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.kind}"]
+        lines.extend(self.samples())
+        return "\n".join(lines)
+
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def __init__(self, name: str, help_text: str):
+        super().__init__(name, help_text)
+        self._values: Dict[LabelKey, float] = {}
+
+    def inc(self, amount: float = 1.0, **labels):
+        k = _key(labels)
+        with self._lock:
+            self._values[k] = self._values.get(k, 0.0) + amount
+
+    def value(self, **labels) -> float:
+        return self._values.get(_key(labels), 0.0)
+
+    def samples(self):
+        with self._lock:
+            items = list(self._values.items())
+        return [f"{self.name}{_fmt_labels(k)} {v}" for k, v in items]
+
+
+class Gauge(_Metric):
+    kind = "gauge"
+
+    def __init__(self, name: str, help_text: str):
+        super().__init__(name, help_text)
+        self._values: Dict[LabelKey, float] = {}
+
+    def inc(self, amount: float = 1.0, **labels):
+        k = _key(labels)
+        with self._lock:
+            self._values[k] = self._values.get(k, 0.0) + amount
+
+    def dec(self, amount: float = 1.0, **labels):
+        self.inc(-amount, **labels)
+
+    def set(self, value: float, **labels):
+        with self._lock:
+            self._values[_key(labels)] = value
+
+    def value(self, **labels) -> float:
+        return self._values.get(_key(labels), 0.0)
+
+    def samples(self):
+        with self._lock:
+            items = list(self._values.items())
+        return [f"{self.name}{_fmt_labels(k)} {v}" for k, v in items]
+
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(self, name: str, help_text: str, buckets: Tuple[float, ...] = DEFAULT_BUCKETS):
+        super().__init__(name, help_text)
+        self.buckets = tuple(sorted(buckets))
+        self._values: Dict[LabelKey, List[float]] = {}  # bucket counts..., +Inf count, sum
+
+    def observe(self, value: float, **labels):
+        k = _key(labels)
+        with self._lock:
+            row = self._values.get(k)
+            if row is None:
+                row = self._values[k] = [0.0] * (len(self.buckets) + 2)
+            for i, b in enumerate(self.buckets):
+                if value <= b:
+                    row[i] += 1
+            row[-2] += 1
+            row[-1] += value
+
+    def count(self, **labels) -> float:
+        row = self._values.get(_key(labels))
+        return row[-2] if row else 0.0
+
+    def samples(self):
+        out = []
+        with self._lock:
+            items = [(k, list(v)) for k, v in self._values.items()]
+        for k, row in items:
+            for b, c in zip(self.buckets, row):
+                out.append(f"{self.name}_bucket{_fmt_labels(k, ('le', repr(float(b))))} {c}")
+            out.append(f"{self.name}_bucket{_fmt_labels(k, ('le', '+Inf'))} {row[-2]}")
+            out.append(f"{self.name}_count{_fmt_labels(k)} {row[-2]}")
+            out.append(f"{self.name}_sum{_fmt_labels(k)} {row[-1]}")
+        return out
+
+
+class Registry:
+    """Process-local metric registry rendered in the Prometheus text format."""
+    def __init__(self):
+        self._metrics: Dict[str, _Metric] = {}
+        self._lock = threading.Lock()
+
+    def _get(self, cls, name: str, help_text: str, **kwargs):
+        with self._lock:
+            metric = self._metrics.get(name)
+            if metric is None:
+                metric = self._metrics[name] = cls(name, help_text, **kwargs)
+            return metric
+
+    def counter(self, name: str, help_text: str) -> Counter:
+        return self._get(Counter, name, help_text)
+
+    def gauge(self, name: str, help_text: str) -> Gauge:
+        return self._get(Gauge, name, help_text)
+
+    def histogram(self, name: str, help_text: str, buckets: Tuple[float, ...] = DEFAULT_BUCKETS) -> Histogram:
+        return self._get(Histogram, name, help_text, buckets=buckets)
+
+    def render(self) -> str:
+        with self._lock:
+            metrics = list(self._metrics.values())
+        return "\n".join(m.render() for m in metrics) + "\n"
+
+
+REGISTRY = Registry()
+
+STAGE_SECONDS = REGISTRY.histogram("docportal_stage_duration_seconds", "Duration of pipeline stages")
+STAGE_TOTAL = REGISTRY.counter("docportal_stage_total", "Pipeline stage executions by status")
+STAGE_IN_FLIGHT = REGISTRY.gauge("docportal_stage_in_flight", "Pipeline stages currently running")
+HTTP_SECONDS = REGISTRY.histogram("docportal_http_request_duration_seconds", "HTTP request latency")
+HTTP_TOTAL = REGISTRY.counter("docportal_http_requests_total", "HTTP requests by status code")
+HTTP_IN_FLIGHT = REGISTRY.gauge("docportal_http_requests_in_flight", "HTTP requests currently being served")
+
+
+# ---------- Per-request stage timings (Server-Timing) ----------
+_request_timings: ContextVar[Optional[List[Tuple[str, float]]]] = ContextVar("request_timings", default=None)
+_request_path: ContextVar[Optional[str]] = ContextVar("request_path", default=None)
+_request_tags: ContextVar[Optional[Dict[str, str]]] = ContextVar("request_tags", default=None)
+
+
+def start_request_timings(path: Optional[str] = None) -> List[Tuple[str, float]]:
+    """Begin collecting stage timings for the current request; returns the shared list."""
+    timings: List[Tuple[str, float]] = []
+    _request_timings.set(timings)
+    _request_path.set(path)
+    _request_tags.set({})
+    return timings
+
+
+def request_path() -> Optional[str]:
+    """Path of the request being served (None outside a request)."""
+    return _request_path.get()
+
+
+def tag_request(**tags: Optional[str]):
+    """Attach tags (e.g. session_id) to the current request; visible to the middleware afterwards."""
+    current = _request_tags.get()
+    if current is not None:
+        current.update({k: str(v) for k, v in tags.items() if v})
+
+
+def request_tags() -> Dict[str, str]:
+    """The current request's tags (live: tags added later, e.g. while streaming, show up)."""
+    tags = _request_tags.get()
+    return tags if tags is not None else {}
+
+
+def server_timing_header(timings: List[Tuple[str, float]], total: Optional[float] = None) -> str:
+    """Render `Server-Timing` (durations in ms, repeated stages summed, in first-seen order)."""
+    agg: Dict[str, float] = {}
+    for name, seconds in timings:
+        agg[name] = agg.get(name, 0.0) + seconds
+    parts = [f"{name};dur={seconds * 1000:.1f}" for name, seconds in agg.items()]
+    if total is not None:
+        parts.append(f"total;dur={total * 1000:.1f}")
+    return ", ".join(parts)
+
+
+# Extra per-stage instrumentation (e.g. memory high-water marks): hook(name) -> context manager
+_STAGE_HOOKS: List[Callable[[str], ContextManager]] = []
+
+
+def add_stage_hook(hook: Callable[[str], ContextManager]):
+    if hook not in _STAGE_HOOKS:
+        _STAGE_HOOKS.append(hook)
+
+
+def remove_stage_hook(hook: Callable[[str], ContextManager]):
+    if hook in _STAGE_HOOKS:
+        _STAGE_HOOKS.remove(hook)
+
+
+@contextmanager
+def stage(name: str):
+    """
+    Time a pipeline stage: histogram + counter + in-flight gauge, and an entry
+    in the current request's Server-Timing header.
+    """
+    STAGE_IN_FLIGHT.inc(stage=name)
+    start = time.perf_counter()
+    status = "ok"
+    try:
+        if _STAGE_HOOKS:
+            with ExitStack() as hooks:
+                for hook in list(_STAGE_HOOKS):
+                    hooks.enter_context(hook(name))
+                yield
+        else:
+            yield
+    except BaseException:
+        status = "error"
+        raise
+    finally:
+        elapsed = time.perf_counter() - start
+        STAGE_IN_FLIGHT.dec(stage=name)
+        STAGE_SECONDS.observe(elapsed, stage=name)
+        STAGE_TOTAL.inc(stage=name, status=status)
+        timings = _request_timings.get()
+        if timings is not None:
+            timings.append((name, elapsed))
+
+
+def timed(name: str):
+    """Decorator form of `stage`."""
+    def decorator(fn):
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            with stage(name):
+                return fn(*args, **kwargs)
+        return wrapper
+    return decorator
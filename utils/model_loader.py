@@ -1,17 +1,55 @@
 import os
 import sys
 import json
+import threading
 from dotenv import load_dotenv
-from utils.config_loader import load_config
-
-from langchain_google_genai import ChatGoogleGenerativeAI, GoogleGenerativeAIEmbeddings
-from langchain_groq import ChatGroq
+from utils.config_loader import get_config, subscribe, thaw
 
 from logger import GLOBAL_LOGGER as log
 from exception.custom_exception import CustomException
 
 #load_dotenv()
 
+# Provider SDKs are imported lazily inside the load_* methods (they dominate import time).
+# Built clients are cached process-wide, keyed by everything that affects their construction.
+_CLIENT_CACHE: dict = {}
+_CLIENT_LOCK = threading.RLock()  # reentrant: the LLM router builds provider clients inside its factory
+
+
+def _cached_client(key: tuple, factory):
+    with _CLIENT_LOCK:
+        client = _CLIENT_CACHE.get(key)
+        if client is None:
+            client = _CLIENT_CACHE[key] = factory()
+        return client
+
+
+def clear_client_cache(kind: str | None = None, name: str | None = None):
+    """Drop cached clients, optionally only one kind ("llm"/"embeddings") and config block name."""
+    with _CLIENT_LOCK:
+        for key in list(_CLIENT_CACHE):
+            if (kind is None or key[0] == kind) and (name is None or key[1] == name):
+                del _CLIENT_CACHE[key]
+
+
+def _on_config_change(old, new, changed):
+    """Rebuild only the clients whose config section changed."""
+    llm_blocks = {c.split(".")[1] for c in changed if c.startswith("llm.")}
+    if "llm" in changed:
+        for block in llm_blocks or [None]:
+            clear_client_cache("llm", block)
+    if "llm" in changed or "llm_routing" in changed:
+        clear_client_cache("llm", "routing")  # the router holds per-provider clients
+    if "embedding_model" in changed:
+        clear_client_cache("embeddings")
+    if "rate_limits" in changed:
+        # limiters are resized in place; rebuild so newly limited providers get wrapped
+        clear_client_cache()
+    log.info("Model clients invalidated after config change", changed=sorted(changed))
+
+
+subscribe(_on_config_change, {"llm", "embedding_model", "rate_limits", "llm_routing"})
+
 class ApiKeyManager:
     REQUIRED_KEYS = ["GROQ_API_KEY", "GOOGLE_API_KEY"]
 
@@ -64,7 +102,7 @@ class ModelLoader:
             log.info("Running in PRODUCTION mode")
 
         self.api_key_mgr = ApiKeyManager()
-        self.config = load_config()
+        self.config = get_config()
         log.info("YAML config loaded", config_keys=list(self.config.keys()))
 
 
@@ -74,21 +112,48 @@ class ModelLoader:
         """
         try:
             embedding_model = self.config["embedding_model"]["model_name"]
+            api_key = self.api_key_mgr.get("GOOGLE_API_KEY")
+
+            def _build():
+                from langchain_google_genai import GoogleGenerativeAIEmbeddings
+                from utils.rate_limiter import rate_limited_embeddings
+                embeddings = GoogleGenerativeAIEmbeddings(model=embedding_model, google_api_key=api_key) #type: ignore
+                return rate_limited_embeddings(embeddings, "google", embedding_model)
+
+            embeddings = _cached_client(("embeddings", "embedding_model", embedding_model, api_key), _build)
             log.info("Embedding model loaded successfully", model=embedding_model)
-            return GoogleGenerativeAIEmbeddings(model=embedding_model, google_api_key=self.api_key_mgr.get("GOOGLE_API_KEY")) #type: ignore
+            return embeddings
                
         except Exception as e:
             log.error("Error loading embedding model", error=str(e))
             raise CustomException("Failed to load embedding model", sys)
 
 
-    def load_llm(self):
+    def load_llm(self, json_mode: bool = False):
         """
         Load and return the LLM model.
+        With `llm_routing.enabled`, returns a router that hedges and fails over across providers.
+        With `json_mode`, providers that declare a `json_mode` block are asked for JSON output
+        natively (the others are returned unchanged).
         """
+        provider_key = os.getenv("LLM_PROVIDER", "groq")   # default groq
+        routing = self.config.get("llm_routing") or {}
+        if not routing.get("enabled"):
+            return self._load_provider_llm(provider_key, json_mode)
+
+        # LLM_PROVIDER stays the primary; the remaining configured providers follow in order
+        order = [provider_key] + [p for p in routing.get("providers", self.config["llm"]) if p != provider_key]
+
+        def _build():
+            from utils.llm_router import hedged_llm
+            return hedged_llm({p: self._load_provider_llm(p, json_mode) for p in order}, routing)
+        llm = _cached_client(("llm", "routing", tuple(order), json_mode), _build)
+        log.info("LLM router loaded", providers=order, hedge=routing.get("hedge", True))
+        return llm
+
+    def _load_provider_llm(self, provider_key: str, json_mode: bool = False):
         llm_block = self.config["llm"]
         #model_name = llm_block["grok"]["model_name"]
-        provider_key = os.getenv("LLM_PROVIDER", "groq")   # default groq
 
         if provider_key not in llm_block:
             log.error("LLM provider not found in config", provider_key=provider_key)
@@ -99,25 +164,46 @@ class ModelLoader:
         model_name = llm_config.get("model_name")
         temperature = llm_config.get("temperature", 0.2)
         max_tokens = llm_config.get("max_output_tokens", 2048)
+        native = thaw(llm_config.get("json_mode") or {}) if json_mode else {}
 
         log.info("Loading LLM model", provider=provider, model=model_name, temperature=temperature, max_tokens=max_tokens)
+        reserve = int((self.config.get("rate_limits") or {}).get("reserve_output_tokens", 512))
 
         if provider == "google":
-            llm = ChatGoogleGenerativeAI(
-                model=model_name,
-                google_api_key=self.api_key_mgr.get("GOOGLE_API_KEY"),
-                temperature=temperature,
-                max_output_tokens=max_tokens
-            )
-            return llm
+            api_key = self.api_key_mgr.get("GOOGLE_API_KEY")
+
+            def _build():
+                from langchain_google_genai import ChatGoogleGenerativeAI
+                from utils.rate_limiter import rate_limited_llm
+                llm = ChatGoogleGenerativeAI(
+                    model=model_name,
+                    google_api_key=api_key,
+                    temperature=temperature,
+                    max_output_tokens=max_tokens,
+                    **native,  # e.g. response_mime_type="application/json"
+                )
+                return rate_limited_llm(llm, provider, model_name, reserve)
+            return _cached_client(("llm", provider_key, model_name, temperature, max_tokens, api_key,
+                                   json.dumps(native, sort_keys=True)), _build)
 
         elif provider == "groq":
-            llm = ChatGroq(
-                model=model_name,
-                api_key=self.api_key_mgr.get("GROQ_API_KEY"), #type: ignore
-                temperature=temperature,
-            )
-            return llm
+            api_key = self.api_key_mgr.get("GROQ_API_KEY")
+
+            def _build():
+                from langchain_groq import ChatGroq
+                from utils.rate_limiter import rate_limited_llm
+                options = dict(native)
+                if "response_format" in options:  # request body parameter, not a client field
+                    options["model_kwargs"] = {"response_format": options.pop("response_format")}
+                llm = ChatGroq(
+                    model=model_name,
+                    api_key=api_key, #type: ignore
+                    temperature=temperature,
+                    **options,
+                )
+                return rate_limited_llm(llm, provider, model_name, reserve)
+            return _cached_client(("llm", provider_key, model_name, temperature, api_key,
+                                   json.dumps(native, sort_keys=True)), _build)
         
         else:
             log.error("Unsupported LLM provider", provider=provider)
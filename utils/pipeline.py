@@ -0,0 +1,191 @@
+from __future__ import annotations
+import contextvars
+import queue
+import threading
+import time
+from typing import Any, Callable, Dict, Iterable, Iterator, List, Optional, Sequence, Tuple
+
+from logger import GLOBAL_LOGGER as log
+from utils.metrics import REGISTRY, stage
+
+PIPELINE_QUEUE_DEPTH = REGISTRY.gauge("docportal_pipeline_queue_depth", "Items waiting in a pipeline queue")
+PIPELINE_ITEMS = REGISTRY.counter("docportal_pipeline_items_total", "Items emitted by a pipeline stage")
+PIPELINE_BLOCKED = REGISTRY.counter(
+    "docportal_pipeline_blocked_seconds_total",
+    "Seconds a stage spent waiting: op=put is backpressure from downstream, op=get is starvation",
+)
+
+StageFn = Callable[[Iterable[Any]], Iterable[Any]]
+
+_DONE = object()
+_POLL = 0.1
+
+
+class PipelineAborted(RuntimeError):
+    """Raised inside a stage when another stage failed and the pipeline is shutting down."""
+
+
+class _Channel:
+    """Bounded queue between two stages that records depth and blocking time."""
+    def __init__(self, pipeline: str, name: str, maxsize: int, stop: threading.Event):
+        self.q: "queue.Queue[Any]" = queue.Queue(maxsize=max(1, maxsize))
+        self.pipeline = pipeline
+        self.name = name
+        self.stop = stop
+        self.max_depth = 0
+
+    def _depth(self):
+        depth = self.q.qsize()
+        self.max_depth = max(self.max_depth, depth)
+        PIPELINE_QUEUE_DEPTH.set(depth, pipeline=self.pipeline, queue=self.name)
+
+    def put(self, item, stats: Dict[str, float]):
+        start = time.perf_counter()
+        while True:
+            if self.stop.is_set():
+                raise PipelineAborted(self.pipeline)
+            try:
+                self.q.put(item, timeout=_POLL)
+                break
+            except queue.Full:
+                continue
+        stats["blocked_put"] += time.perf_counter() - start
+        self._depth()
+
+    def iter(self, stats: Optional[Dict[str, float]]) -> Iterator[Any]:
+        while True:
+            start = time.perf_counter()
+            while True:
+                try:
+                    item = self.q.get(timeout=_POLL)
+                    break
+                except queue.Empty:
+                    if self.stop.is_set():
+                        raise PipelineAborted(self.pipeline) from None
+            if stats is not None:
+                stats["blocked_get"] += time.perf_counter() - start
+            self._depth()
+            if item is _DONE:
+                return
+            yield item
+
+
+class StagedPipeline:
+    """
+    Run a source and a chain of streaming stages concurrently, connected by bounded queues.
+
+    Each stage is `fn(iterable) -> iterable` running in its own thread, so stages overlap in
+    time; a full queue blocks the producer (backpressure), which caps the number of items in
+    flight at roughly `queue_size` per edge regardless of input size. The last stage runs in
+    the calling thread and its outputs are returned by `run()`. The first failure stops
+    every stage and is re-raised from `run()`.
+
+    Per-stage item counts, put/get blocking time and queue depths are exported as metrics
+    and logged when the run ends.
+    """
+    def __init__(self, name: str, source: Iterable[Any], stages: Sequence[Tuple[str, StageFn]],
+                 queue_size: int = 8):
+        if not stages:
+            raise ValueError("A pipeline needs at least one stage")
+        self.name = name
+        self.source = source
+        self.stages = list(stages)
+        self.queue_size = queue_size
+        self.stats: Dict[str, Dict[str, float]] = {}
+        self._error: Optional[BaseException] = None
+        self._error_lock = threading.Lock()
+
+    def _fail(self, error: BaseException, stop: threading.Event):
+        with self._error_lock:
+            if self._error is None:
+                self._error = error
+        stop.set()
+
+    def _new_stats(self, stage_name: str) -> Dict[str, float]:
+        stats = {"items": 0, "seconds": 0.0, "blocked_put": 0.0, "blocked_get": 0.0}
+        self.stats[stage_name] = stats
+        return stats
+
+    def _pump(self, stage_name: str, produce: Callable[[Dict[str, float]], Iterable[Any]],
+              out: _Channel, stop: threading.Event):
+        stats = self._new_stats(stage_name)
+        start = time.perf_counter()
+        try:
+            with stage(f"{self.name}.{stage_name}"):
+                for item in produce(stats):
+                    out.put(item, stats)
+                    stats["items"] += 1
+                    PIPELINE_ITEMS.inc(pipeline=self.name, stage=stage_name)
+            out.put(_DONE, stats)
+        except PipelineAborted:
+            pass
+        except BaseException as e:
+            self._fail(e, stop)
+        finally:
+            stats["seconds"] = time.perf_counter() - start
+            PIPELINE_BLOCKED.inc(stats["blocked_put"], pipeline=self.name, stage=stage_name, op="put")
+            PIPELINE_BLOCKED.inc(stats["blocked_get"], pipeline=self.name, stage=stage_name, op="get")
+
+    def run(self) -> List[Any]:
+        stop = threading.Event()
+        names = ["source"] + [n for n, _ in self.stages]
+        channels = [_Channel(self.name, f"{names[i]}->{names[i + 1]}", self.queue_size, stop)
+                    for i in range(len(self.stages))]
+
+        threads = []
+        producers: List[Tuple[str, Callable[[Dict[str, float]], Iterable[Any]]]] = [("source", lambda _s: self.source)]
+        for i, (stage_name, fn) in enumerate(self.stages[:-1]):
+            producers.append((stage_name, lambda s, fn=fn, ch=channels[i]: fn(ch.iter(s))))
+        for i, (stage_name, produce) in enumerate(producers):
+            # copy_context keeps request-scoped state (Server-Timing list, log context) in worker threads
+            ctx = contextvars.copy_context()
+            t = threading.Thread(target=ctx.run, args=(self._pump, stage_name, produce, channels[i], stop),
+                                 name=f"{self.name}-{stage_name}", daemon=True)
+            threads.append(t)
+            t.start()
+
+        last_name, last_fn = self.stages[-1]
+        stats = self._new_stats(last_name)
+        start = time.perf_counter()
+        results: List[Any] = []
+        try:
+            with stage(f"{self.name}.{last_name}"):
+                for out in last_fn(channels[-1].iter(stats)):
+                    results.append(out)
+                    stats["items"] += 1
+                    PIPELINE_ITEMS.inc(pipeline=self.name, stage=last_name)
+        except PipelineAborted:
+            pass
+        except BaseException as e:
+            self._fail(e, stop)
+        finally:
+            stats["seconds"] = time.perf_counter() - start
+            PIPELINE_BLOCKED.inc(stats["blocked_get"], pipeline=self.name, stage=last_name, op="get")
+            stop.set()
+            for t in threads:
+                t.join()
+            self._log(channels)
+        if self._error is not None:
+            raise self._error
+        return results
+
+    def _log(self, channels: List[_Channel]):
+        log.info(
+            "Pipeline finished",
+            pipeline=self.name,
+            stages={n: {k: round(v, 3) if isinstance(v, float) else v for k, v in s.items()}
+                    for n, s in self.stats.items()},
+            max_queue_depth={c.name: c.max_depth for c in channels},
+            queue_size=self.queue_size,
+        )
+
+
+def batched(items: Iterable[Any], size: int) -> Iterator[List[Any]]:
+    batch: List[Any] = []
+    for item in items:
+        batch.append(item)
+        if len(batch) >= size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
@@ -0,0 +1,177 @@
+from __future__ import annotations
+import os
+import re
+import sys
+import threading
+import time
+import uuid
+from collections import Counter
+from pathlib import Path
+from typing import Any, Dict, List, Optional
+
+from logger import GLOBAL_LOGGER as log
+from utils.config_loader import get_config
+from utils.metrics import REGISTRY
+
+PROFILES_TOTAL = REGISTRY.counter("docportal_profiles_total", "Request profiles captured by trigger")
+PROFILE_SAMPLES = REGISTRY.histogram("docportal_profile_samples", "Stack samples per request profile")
+
+PROJECT_ROOT = str(Path(__file__).resolve().parent.parent)
+_SITE = ("site-packages", "dist-packages")
+_active = 0
+_active_lock = threading.Lock()
+_sampler_threads: set = set()  # profilers never sample each other
+
+
+def _frame_label(code) -> str:
+    path = code.co_filename
+    if path.startswith(PROJECT_ROOT):
+        path = os.path.relpath(path, PROJECT_ROOT)
+    else:
+        path = os.path.basename(path)
+    return f"{code.co_name} ({path}:{code.co_firstlineno})".replace(";", ":")
+
+
+def _in_project(path: str) -> bool:
+    return path.startswith(PROJECT_ROOT) and not any(s in path for s in _SITE)
+
+
+class SamplingProfiler:
+    """
+    Wall-clock sampling profiler: a daemon thread snapshots every thread's Python stack each
+    `interval` seconds and counts folded stacks (root;...;leaf). Only stacks that pass through
+    project code are kept, so idle pool workers and the idle event loop drop out, while stages
+    running on pipeline/executor threads are captured. Work of concurrent requests in the
+    same process shows up too; it is attributed by its own frames.
+    """
+    def __init__(self, interval: float = 0.005):
+        self.interval = interval
+        self.stacks: Counter = Counter()
+        self.samples = 0
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="request-profiler", daemon=True)
+        self.started = self.stopped = 0.0
+
+    def _run(self):
+        _sampler_threads.add(threading.get_ident())
+        try:
+            self._sample_until_stopped()
+        finally:
+            _sampler_threads.discard(threading.get_ident())
+
+    def _sample_until_stopped(self):
+        while not self._stop.wait(self.interval):
+            self.samples += 1
+            for tid, frame in sys._current_frames().items():
+                if tid in _sampler_threads:
+                    continue
+                labels, project = [], False
+                while frame is not None:
+                    labels.append(_frame_label(frame.f_code))
+                    project = project or _in_project(frame.f_code.co_filename)
+                    frame = frame.f_back
+                if project:
+                    self.stacks[";".join(reversed(labels))] += 1
+
+    def start(self) -> "SamplingProfiler":
+        self.started = time.perf_counter()
+        self._thread.start()
+        return self
+
+    def stop(self) -> "SamplingProfiler":
+        self._stop.set()
+        self._thread.join()
+        self.stopped = time.perf_counter()
+        return self
+
+    def folded(self) -> str:
+        """Brendan Gregg's folded format (flamegraph.pl, speedscope, inferno)."""
+        return "".join(f"{stack} {count}\n" for stack, count in self.stacks.most_common())
+
+
+# ---------- On-disk ring ----------
+class ProfileRing:
+    """Folder of profiles bounded by count and total size; the oldest are deleted first."""
+    def __init__(self, folder, max_profiles: int = 50, max_mb: float = 100):
+        self.folder = Path(folder)
+        self.max_profiles = max(1, int(max_profiles))
+        self.max_bytes = int(float(max_mb) * 2**20)
+
+    def save(self, name: str, content: str) -> Path:
+        self.folder.mkdir(parents=True, exist_ok=True)
+        path = self.folder / name
+        tmp = self.folder / f".tmp-{uuid.uuid4().hex}"
+        tmp.write_text(content, encoding="utf-8")
+        os.replace(tmp, path)
+        self._trim()
+        return path
+
+    def list(self) -> List[Dict[str, Any]]:
+        if not self.folder.is_dir():
+            return []
+        files = sorted((p for p in self.folder.glob("*.folded")), key=lambda p: p.stat().st_mtime, reverse=True)
+        return [{"name": p.name, "bytes": p.stat().st_size, "created": p.stat().st_mtime} for p in files]
+
+    def path(self, name: str) -> Optional[Path]:
+        p = self.folder / Path(name).name  # no traversal out of the ring
+        return p if p.suffix == ".folded" and p.is_file() else None
+
+    def _trim(self):
+        files = sorted(self.folder.glob("*.folded"), key=lambda p: p.stat().st_mtime, reverse=True)
+        total = 0
+        for i, p in enumerate(files):
+            total += p.stat().st_size
+            if i >= self.max_profiles or (total > self.max_bytes and i > 0):
+                p.unlink(missing_ok=True)
+
+
+def profile_ring() -> ProfileRing:
+    block = get_config().get("profiling") or {}
+    return ProfileRing(os.getenv("PROFILE_DIR", block.get("dir", "profiles")),
+                       block.get("max_profiles", 50), block.get("max_mb", 100))
+
+
+# ---------- Per-request hook ----------
+def _slug(value: str) -> str:
+    return re.sub(r"[^A-Za-z0-9_.-]+", "-", value).strip("-") or "none"
+
+
+class RequestProfile:
+    """A sampling profile of one request, saved to the ring when the response body finishes."""
+    def __init__(self, trigger: str, interval: float):
+        self.trigger = trigger
+        self.id = f"{time.strftime('%Y%m%dT%H%M%S')}-{uuid.uuid4().hex[:8]}"
+        self.profiler = SamplingProfiler(interval).start()
+        self._done = False
+
+    def finish(self, endpoint: str, tags: Dict[str, str]) -> Optional[Path]:
+        global _active
+        if self._done:
+            return None
+        self._done = True
+        self.profiler.stop()
+        with _active_lock:
+            _active -= 1
+        name = f"{self.id}_{_slug(endpoint)}_{_slug(tags.get('session_id', 'none'))}.folded"
+        try:
+            path = profile_ring().save(name, self.profiler.folded())
+        except OSError as e:  # profiling must never fail the request
+            log.warning("Request profile not saved", error=str(e), endpoint=endpoint)
+            return None
+        PROFILES_TOTAL.inc(trigger=self.trigger)
+        PROFILE_SAMPLES.observe(self.profiler.samples)
+        log.info("Request profile saved", profile=name, endpoint=endpoint, trigger=self.trigger,
+                 session_id=tags.get("session_id"), samples=self.profiler.samples,
+                 seconds=round(self.profiler.stopped - self.profiler.started, 3))
+        return path
+
+
+def start_request_profile(trigger: str) -> Optional[RequestProfile]:
+    """A running profile, or None when `profiling.max_concurrent` profiles are already running."""
+    global _active
+    block = get_config().get("profiling") or {}
+    with _active_lock:
+        if _active >= int(block.get("max_concurrent", 2)):
+            return None
+        _active += 1
+    return RequestProfile(trigger, float(block.get("interval_ms", 5)) / 1000)
@@ -0,0 +1,356 @@
+from __future__ import annotations
+import asyncio
+import threading
+import time
+from collections import deque
+from typing import Any, Callable, Dict, List, Mapping, Optional, Tuple
+
+from langchain_core.embeddings import Embeddings
+from langchain_core.language_models.chat_models import BaseChatModel
+from langchain_core.outputs import ChatResult
+
+from logger import GLOBAL_LOGGER as log
+from utils.config_loader import get_config, subscribe
+from utils.metrics import REGISTRY
+
+RATE_QUEUE_DEPTH = REGISTRY.gauge("docportal_ratelimit_queue_depth", "Callers waiting for provider budget")
+RATE_WAIT_SECONDS = REGISTRY.histogram("docportal_ratelimit_wait_seconds", "Time spent waiting for provider budget")
+RATE_REJECTED = REGISTRY.counter("docportal_ratelimit_rejected_total", "Calls rejected after the queue timeout")
+RATE_TOKENS = REGISTRY.counter("docportal_ratelimit_tokens_total", "Tokens charged against provider budgets")
+
+_POLL = 0.05
+
+
+class RateLimitExceeded(Exception):
+    """Provider budget not available within the queue timeout (mapped to HTTP 429)."""
+    def __init__(self, provider: str, model: str, retry_after: float):
+        super().__init__(f"Rate limit for {provider}:{model} exceeded; retry after {retry_after:.1f}s")
+        self.provider = provider
+        self.model = model
+        self.retry_after = retry_after
+
+
+def estimate_tokens(text: str) -> int:
+    return len(text) // 4 + 1
+
+
+# ---------- Token bucket limiter ----------
+def _on_event_loop() -> bool:
+    try:
+        asyncio.get_running_loop()
+        return True
+    except RuntimeError:
+        return False
+
+
+def _refuse_on_loop(caller: str):
+    """Sync client calls may queue for budget; on the event loop that would stall every request."""
+    if _on_event_loop():
+        raise RuntimeError(f"{caller} called on the event loop; use the async API or run_in_threadpool")
+
+
+class _Bucket:
+    def __init__(self, per_minute: float, now: float):
+        self.capacity = float(per_minute)
+        self.rate = self.capacity / 60.0
+        self.level = self.capacity
+        self.stamp = now
+
+    def refill(self, now: float):
+        self.level = min(self.capacity, self.level + (now - self.stamp) * self.rate)
+        self.stamp = now
+
+    def wait_for(self, amount: float) -> float:
+        # a request larger than the whole budget waits for a full bucket, then runs into debt
+        need = min(amount, self.capacity) - self.level
+        return 0.0 if need <= 0 else need / self.rate
+
+    def resize(self, per_minute: float):
+        self.capacity = float(per_minute)
+        self.rate = self.capacity / 60.0
+        self.level = min(self.level, self.capacity)
+
+
+class RateLimiter:
+    """
+    Requests-per-minute and tokens-per-minute budget for one provider/model.
+
+    Callers queue in FIFO order (sync and async alike); only the head of the queue may take
+    budget, so a large request is not starved by a stream of small ones. A caller that cannot
+    be served within `timeout` seconds gets RateLimitExceeded. Token charges are estimates and
+    are corrected with `settle()` once the provider reports actual usage.
+
+    The sync `acquire` never blocks an event-loop thread: called on a running loop it takes
+    budget only if it is available right away and is rejected otherwise (a blocked loop could
+    never let the async waiters ahead of it move). Async code uses `aacquire`.
+    """
+    def __init__(self, provider: str, model: str, rpm: Optional[float] = None, tpm: Optional[float] = None,
+                 timeout: float = 30.0, clock: Callable[[], float] = time.monotonic):
+        self.provider = provider
+        self.model = model
+        self.timeout = timeout
+        self.clock = clock
+        self.requests = _Bucket(rpm, clock()) if rpm else None
+        self.tokens = _Bucket(tpm, clock()) if tpm else None
+        self._cond = threading.Condition()
+        self._waiters: deque = deque()
+
+    @property
+    def labels(self) -> Dict[str, str]:
+        return {"provider": self.provider, "model": self.model}
+
+    def configure(self, rpm: Optional[float], tpm: Optional[float], timeout: float):
+        with self._cond:
+            for attr, value in (("requests", rpm), ("tokens", tpm)):
+                bucket = getattr(self, attr)
+                if not value:
+                    setattr(self, attr, None)
+                elif bucket is None:
+                    setattr(self, attr, _Bucket(value, self.clock()))
+                else:
+                    bucket.resize(value)
+            self.timeout = timeout
+            self._cond.notify_all()
+
+    def _try_take(self, ticket, tokens: int) -> float:
+        """Seconds until `ticket` could be served; 0 means budget was taken. Caller holds the lock."""
+        if self._waiters[0] is not ticket:
+            return _POLL
+        now = self.clock()
+        wait = 0.0
+        for bucket, amount in ((self.requests, 1), (self.tokens, tokens)):
+            if bucket is not None:
+                bucket.refill(now)
+                wait = max(wait, bucket.wait_for(amount))
+        if wait > 0:
+            return wait
+        if self.requests is not None:
+            self.requests.level -= 1
+        if self.tokens is not None:
+            self.tokens.level -= tokens
+        self._waiters.popleft()
+        self._cond.notify_all()
+        return 0.0
+
+    def _enter(self):
+        ticket = object()
+        with self._cond:
+            self._waiters.append(ticket)
+        RATE_QUEUE_DEPTH.inc(**self.labels)
+        return ticket, self.clock()
+
+    def _leave(self, ticket, start: float, outcome: str, tokens: int):
+        with self._cond:
+            if ticket in self._waiters:
+                self._waiters.remove(ticket)
+                self._cond.notify_all()
+        RATE_QUEUE_DEPTH.dec(**self.labels)
+        RATE_WAIT_SECONDS.observe(self.clock() - start, **self.labels)
+        if outcome == "ok":
+            RATE_TOKENS.inc(tokens, **self.labels)
+        elif outcome == "rejected":
+            RATE_REJECTED.inc(**self.labels)
+
+    def _reject(self, wait: float):
+        log.warning("Provider rate limit queue timeout", provider=self.provider, model=self.model,
+                    retry_after=round(wait, 2))
+        raise RateLimitExceeded(self.provider, self.model, wait)
+
+    def acquire(self, tokens: int = 0, block: bool = True) -> bool:
+        """Take budget, waiting in the queue; with block=False, only if it is available now."""
+        ticket, start = self._enter()
+        outcome = "rejected"
+        try:
+            with self._cond:
+                while True:
+                    wait = self._try_take(ticket, tokens)
+                    if wait == 0:
+                        outcome = "ok"
+                        return True
+                    if not block:
+                        outcome = "skipped"
+                        return False
+                    remaining = start + self.timeout - self.clock()
+                    if wait > remaining:
+                        self._reject(wait)
+                    self._cond.wait(min(wait, remaining))
+        finally:
+            self._leave(ticket, start, outcome, tokens)
+
+    async def aacquire(self, tokens: int = 0):
+        ticket, start = self._enter()
+        outcome = "rejected"
+        try:
+            while True:
+                with self._cond:
+                    wait = self._try_take(ticket, tokens)
+                if wait == 0:
+                    outcome = "ok"
+                    return
+                remaining = start + self.timeout - self.clock()
+                if wait > remaining:
+                    self._reject(wait)
+                await asyncio.sleep(min(wait, remaining, _POLL * 4))
+        finally:
+            self._leave(ticket, start, outcome, tokens)
+
+    def settle(self, reserved: int, actual: int):
+        """Refund (or charge) the difference between the estimated and the reported token usage."""
+        if self.tokens is None or actual == reserved:
+            return
+        with self._cond:
+            self.tokens.level = min(self.tokens.capacity, self.tokens.level + reserved - actual)
+            self._cond.notify_all()
+        RATE_TOKENS.inc(actual - reserved, **self.labels)
+
+
+# ---------- Shared limiter registry (config: rate_limits) ----------
+_LIMITERS: Dict[Tuple[str, str], RateLimiter] = {}
+_LIMITERS_LOCK = threading.Lock()
+
+
+def _limits_for(config: Mapping, provider: str, model: str) -> Tuple[Optional[Mapping], float]:
+    block = config.get("rate_limits") or {}
+    timeout = float(block.get("queue_timeout_seconds", 30))
+    models = block.get(provider) or {}
+    return models.get(model) or models.get("*"), timeout
+
+
+def get_limiter(provider: str, model: str, config: Optional[Mapping] = None) -> Optional[RateLimiter]:
+    """Process-wide limiter for provider/model, or None when no budget is configured."""
+    limits, timeout = _limits_for(config or get_config(), provider, model)
+    if not limits:
+        return None
+    with _LIMITERS_LOCK:
+        limiter = _LIMITERS.get((provider, model))
+        if limiter is None:
+            limiter = _LIMITERS[(provider, model)] = RateLimiter(
+                provider, model, rpm=limits.get("rpm"), tpm=limits.get("tpm"), timeout=timeout)
+            log.info("Provider rate limiter created", provider=provider, model=model,
+                     rpm=limits.get("rpm"), tpm=limits.get("tpm"), timeout=timeout)
+        return limiter
+
+
+def _on_limits_change(old, new, changed):
+    with _LIMITERS_LOCK:
+        items = list(_LIMITERS.items())
+    for (provider, model), limiter in items:
+        limits, timeout = _limits_for(new, provider, model)
+        limits = limits or {}
+        limiter.configure(limits.get("rpm"), limits.get("tpm"), timeout)
+    log.info("Provider rate limits updated", limiters=len(items))
+
+
+subscribe(_on_limits_change, {"rate_limits"})
+
+
+# ---------- Client wrappers ----------
+def _used_tokens(result: ChatResult, default: int) -> int:
+    usage = (result.llm_output or {}).get("token_usage") or {}
+    if usage.get("total_tokens"):
+        return int(usage["total_tokens"])
+    for gen in result.generations:
+        meta = getattr(getattr(gen, "message", None), "usage_metadata", None)
+        if meta and meta.get("total_tokens"):
+            return int(meta["total_tokens"])
+    return default
+
+
+class RateLimitedChatModel(BaseChatModel):
+    """Chat model that takes provider budget from a shared RateLimiter before every call."""
+    inner: Any
+    limiter: Any
+    reserve_output_tokens: int = 0
+
+    @property
+    def _llm_type(self) -> str:
+        return f"rate-limited-{self.inner._llm_type}"
+
+    @property
+    def _identifying_params(self) -> Dict[str, Any]:
+        return {"inner": getattr(self.inner, "_identifying_params", {}), **self.limiter.labels}
+
+    def _estimate(self, messages) -> int:
+        return sum(estimate_tokens(str(m.content)) for m in messages) + self.reserve_output_tokens
+
+    # reserve -> generate_reserved split: callers such as the hedging router take budget
+    # before handing the provider call to another thread
+    def reserve(self, messages, block: bool = True) -> Optional[int]:
+        """Take budget for one call; the reserved tokens, or None if block=False and none is free."""
+        reserved = self._estimate(messages)
+        return reserved if self.limiter.acquire(reserved, block=block) else None
+
+    async def areserve(self, messages) -> int:
+        reserved = self._estimate(messages)
+        await self.limiter.aacquire(reserved)
+        return reserved
+
+    def generate_reserved(self, reserved: int, messages, stop=None, run_manager=None, **kwargs) -> ChatResult:
+        result = self.inner._generate(messages, stop=stop, run_manager=run_manager, **kwargs)
+        self.limiter.settle(reserved, _used_tokens(result, reserved))
+        return result
+
+    async def agenerate_reserved(self, reserved: int, messages, stop=None, run_manager=None, **kwargs) -> ChatResult:
+        result = await self.inner._agenerate(messages, stop=stop, run_manager=run_manager, **kwargs)
+        self.limiter.settle(reserved, _used_tokens(result, reserved))
+        return result
+
+    def _generate(self, messages, stop=None, run_manager=None, **kwargs) -> ChatResult:
+        _refuse_on_loop("RateLimitedChatModel.invoke")
+        reserved = self.reserve(messages)
+        return self.generate_reserved(reserved, messages, stop=stop, run_manager=run_manager, **kwargs)
+
+    async def _agenerate(self, messages, stop=None, run_manager=None, **kwargs) -> ChatResult:
+        reserved = await self.areserve(messages)
+        return await self.agenerate_reserved(reserved, messages, stop=stop, run_manager=run_manager, **kwargs)
+
+
+class RateLimitedEmbeddings(Embeddings):
+    """Embeddings client that charges one request and the estimated input tokens per call."""
+    def __init__(self, inner: Embeddings, limiter: RateLimiter):
+        self.inner = inner
+        self.limiter = limiter
+
+    def __getattr__(self, name):
+        return getattr(self.inner, name)
+
+    def embed_documents(self, texts: List[str], **kwargs) -> List[List[float]]:
+        _refuse_on_loop("RateLimitedEmbeddings.embed_documents")
+        self.limiter.acquire(sum(estimate_tokens(t) for t in texts))
+        return self.inner.embed_documents(texts, **kwargs)
+
+    def embed_query(self, text: str, **kwargs) -> List[float]:
+        _refuse_on_loop("RateLimitedEmbeddings.embed_query")
+        self.limiter.acquire(estimate_tokens(text))
+        return self.inner.embed_query(text, **kwargs)
+
+    async def aembed_documents(self, texts: List[str]) -> List[List[float]]:
+        await self.limiter.aacquire(sum(estimate_tokens(t) for t in texts))
+        return await self.inner.aembed_documents(texts)
+
+    async def aembed_query(self, text: str) -> List[float]:
+        await self.limiter.aacquire(estimate_tokens(text))
+        return await self.inner.aembed_query(text)
+
+
+def rate_limited_llm(llm, provider: str, model: str, reserve_output_tokens: int = 0):
+    limiter = get_limiter(provider, model)
+    if limiter is None:
+        return llm
+    return RateLimitedChatModel(inner=llm, limiter=limiter, reserve_output_tokens=reserve_output_tokens)
+
+
+def rate_limited_embeddings(embeddings, provider: str, model: str):
+    limiter = get_limiter(provider, model)
+    return embeddings if limiter is None else RateLimitedEmbeddings(embeddings, limiter)
+
+
+def find_rate_limit_error(error: BaseException) -> Optional[RateLimitExceeded]:
+    """RateLimitExceeded anywhere in an exception's cause/context chain (errors get re-wrapped)."""
+    seen = set()
+    while error is not None and id(error) not in seen:
+        if isinstance(error, RateLimitExceeded):
+            return error
+        seen.add(id(error))
+        error = error.__cause__ or error.__context__
+    return None
@@ -0,0 +1,298 @@
+from __future__ import annotations
+import os
+import shutil
+import sqlite3
+import threading
+import time
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Callable, Dict, Iterable, List, Optional
+
+try:
+    import fcntl
+except ImportError:  # non-POSIX: every worker's collector runs
+    fcntl = None
+
+from logger import GLOBAL_LOGGER as log
+
+# Features whose session folders are tracked
+FEATURES = {"analysis", "compare", "chat"}
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS session_paths (
+    feature       TEXT NOT NULL,
+    session_id    TEXT NOT NULL,
+    path          TEXT NOT NULL,
+    bytes         INTEGER NOT NULL DEFAULT 0,
+    created_at    REAL NOT NULL,
+    last_accessed REAL NOT NULL,
+    PRIMARY KEY (feature, session_id, path)
+);
+CREATE INDEX IF NOT EXISTS idx_session_paths_access ON session_paths (last_accessed);
+"""
+
+
+class SessionCatalog:
+    """
+    SQLite catalog of session folders across analysis, compare and chat.
+
+    One row per (feature, session_id, path) with its on-disk bytes, creation time and
+    last access time. Writers report the bytes they write, so the collector never
+    has to walk the data directories. Safe to share between uvicorn workers.
+    """
+    def __init__(self, db_path: Optional[str] = None):
+        self.db_path = Path(db_path or os.getenv("SESSION_CATALOG_PATH", os.path.join("data", "session_catalog.db")))
+        self.db_path.parent.mkdir(parents=True, exist_ok=True)
+        with self._conn() as conn:
+            conn.executescript(_SCHEMA)
+
+    @contextmanager
+    def _conn(self):
+        conn = sqlite3.connect(str(self.db_path), timeout=10)
+        try:
+            conn.execute("PRAGMA journal_mode=WAL")
+            yield conn
+            conn.commit()
+        finally:
+            conn.close()
+
+    # ---------- writers ----------
+    def register(self, feature: str, session_id: str, path, nbytes: int = 0):
+        """Record a session folder (no-op if already known) and add `nbytes` to it."""
+        now = time.time()
+        with self._conn() as conn:
+            conn.execute(
+                "INSERT INTO session_paths (feature, session_id, path, bytes, created_at, last_accessed) "
+                "VALUES (?, ?, ?, ?, ?, ?) "
+                "ON CONFLICT(feature, session_id, path) DO UPDATE SET "
+                "bytes = bytes + excluded.bytes, last_accessed = excluded.last_accessed",
+                (feature, session_id, str(path), int(nbytes), now, now),
+            )
+
+    def set_bytes(self, feature: str, session_id: str, path, nbytes: int):
+        """Replace the byte count of a folder that is rewritten in place (e.g. a FAISS index)."""
+        self.register(feature, session_id, path)
+        with self._conn() as conn:
+            conn.execute(
+                "UPDATE session_paths SET bytes = ? WHERE feature = ? AND session_id = ? AND path = ?",
+                (int(nbytes), feature, session_id, str(path)),
+            )
+
+    def touch(self, feature: str, session_id: str):
+        with self._conn() as conn:
+            conn.execute(
+                "UPDATE session_paths SET last_accessed = ? WHERE feature = ? AND session_id = ?",
+                (time.time(), feature, session_id),
+            )
+
+    def remove(self, feature: str, session_id: str):
+        with self._conn() as conn:
+            conn.execute("DELETE FROM session_paths WHERE feature = ? AND session_id = ?", (feature, session_id))
+
+    def claim(self, feature: str, session_id: str, idle_before: float) -> bool:
+        """Remove a session's rows only if it was last accessed before `idle_before` (atomic check-and-delete)."""
+        with self._conn() as conn:
+            conn.execute("BEGIN IMMEDIATE")
+            (last,) = conn.execute(
+                "SELECT MAX(last_accessed) FROM session_paths WHERE feature = ? AND session_id = ?",
+                (feature, session_id),
+            ).fetchone()
+            if last is None or last >= idle_before:
+                return False
+            conn.execute("DELETE FROM session_paths WHERE feature = ? AND session_id = ?", (feature, session_id))
+            return True
+
+    # ---------- readers ----------
+    def sessions(self, feature: Optional[str] = None) -> List[Dict]:
+        """Per-session aggregates ordered least recently used first."""
+        sql = ("SELECT feature, session_id, SUM(bytes), MIN(created_at), MAX(last_accessed), GROUP_CONCAT(path, '|') "
+               "FROM session_paths {where} GROUP BY feature, session_id ORDER BY MAX(last_accessed) ASC")
+        args: tuple = ()
+        where = ""
+        if feature:
+            where, args = "WHERE feature = ?", (feature,)
+        with self._conn() as conn:
+            rows = conn.execute(sql.format(where=where), args).fetchall()
+        return [
+            {"feature": f, "session_id": s, "bytes": b or 0, "created_at": c, "last_accessed": a,
+             "paths": p.split("|") if p else []}
+            for f, s, b, c, a, p in rows
+        ]
+
+    def total_bytes(self) -> int:
+        with self._conn() as conn:
+            (total,) = conn.execute("SELECT COALESCE(SUM(bytes), 0) FROM session_paths").fetchone()
+        return int(total)
+
+    def expired(self, ttl_seconds: float) -> List[Dict]:
+        cutoff = time.time() - ttl_seconds
+        return [s for s in self.sessions() if s["last_accessed"] < cutoff]
+
+
+def dir_bytes(path) -> int:
+    """Size of the files directly inside one session folder (non-recursive)."""
+    p = Path(path)
+    if not p.is_dir():
+        return 0
+    return sum(f.stat().st_size for f in p.iterdir() if f.is_file())
+
+
+def files_bytes(paths: Iterable) -> int:
+    return sum(Path(p).stat().st_size for p in paths if Path(p).exists())
+
+
+_catalog: Optional[SessionCatalog] = None
+_catalog_lock = threading.Lock()
+
+
+def get_catalog() -> SessionCatalog:
+    """Process-wide catalog instance."""
+    global _catalog
+    with _catalog_lock:
+        if _catalog is None:
+            _catalog = SessionCatalog()
+        return _catalog
+
+
+def record_session(feature: str, session_id: str, path, nbytes: int = 0, replace: bool = False):
+    """Best-effort catalog update; never fails the request that wrote the files."""
+    try:
+        cat = get_catalog()
+        if replace:
+            cat.set_bytes(feature, session_id, path, nbytes)
+        else:
+            cat.register(feature, session_id, path, nbytes)
+    except Exception as e:
+        log.warning("Session catalog update failed", feature=feature, session_id=session_id, error=str(e))
+
+
+def touch_session(feature: str, session_id: Optional[str]):
+    if not session_id:
+        return
+    try:
+        get_catalog().touch(feature, session_id)
+    except Exception as e:
+        log.warning("Session catalog touch failed", feature=feature, session_id=session_id, error=str(e))
+
+
+# ---------- Garbage collector ----------
+class SessionCollector:
+    """
+    Background thread that evicts sessions by TTL, then least-recently-used first
+    until the catalogued bytes fit under the global disk quota.
+
+    Every worker starts one, but only the worker holding the catalog's collector lock
+    (`<catalog>.gc.lock`) collects; the others retry each interval and take over if it exits.
+    Sessions accessed within the last `min_idle_seconds` are never evicted, and the idle check
+    is repeated atomically in the catalog just before a session's folders are deleted.
+
+    `hooks` lets a feature release state that is not a plain folder
+    (e.g. vectors in the consolidated chat index) before its paths are deleted.
+    """
+    def __init__(
+        self,
+        catalog: Optional[SessionCatalog] = None,
+        ttl_seconds: Optional[float] = None,
+        max_bytes: Optional[int] = None,
+        interval_seconds: float = 300,
+        hooks: Optional[Dict[str, Callable[[str], None]]] = None,
+        min_idle_seconds: float = 900,
+    ):
+        self.catalog = catalog or get_catalog()
+        self.ttl_seconds = ttl_seconds
+        self.max_bytes = max_bytes
+        self.interval_seconds = interval_seconds
+        self.hooks = hooks or {}
+        self.min_idle_seconds = min_idle_seconds
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+        self._leader_fh = None
+
+    @classmethod
+    def from_config(cls, config: Dict, hooks: Optional[Dict[str, Callable[[str], None]]] = None) -> "SessionCollector":
+        block = config.get("session_gc") or {}
+        ttl_hours = block.get("ttl_hours")
+        max_gb = block.get("max_disk_gb")
+        return cls(
+            ttl_seconds=float(ttl_hours) * 3600 if ttl_hours else None,
+            max_bytes=int(float(max_gb) * 1024 ** 3) if max_gb else None,
+            interval_seconds=float(block.get("interval_seconds", 300)),
+            hooks=hooks,
+            min_idle_seconds=float(block.get("min_idle_seconds", 900)),
+        )
+
+    def evict(self, session: Dict, reason: str, idle_before: Optional[float] = None) -> bool:
+        """Delete a session that is still idle; False if it was accessed since it was picked."""
+        if idle_before is None:
+            idle_before = time.time() - self.min_idle_seconds
+        try:
+            if not self.catalog.claim(session["feature"], session["session_id"], idle_before):
+                log.info("Session eviction skipped: in use", feature=session["feature"],
+                         session_id=session["session_id"], reason=reason)
+                return False
+            hook = self.hooks.get(session["feature"])
+            if hook:
+                hook(session["session_id"])
+            for p in session["paths"]:
+                shutil.rmtree(p, ignore_errors=True)
+            log.info("Session evicted", feature=session["feature"], session_id=session["session_id"],
+                     bytes=session["bytes"], reason=reason)
+            return True
+        except Exception as e:
+            log.error("Session eviction failed", session_id=session["session_id"], error=str(e))
+            return False
+
+    def collect(self) -> int:
+        """Run one pass; returns the number of evicted sessions."""
+        evicted = 0
+        now = time.time()
+        idle_before = now - self.min_idle_seconds
+        if self.ttl_seconds:
+            cutoff = min(now - self.ttl_seconds, idle_before)
+            for s in self.catalog.expired(self.ttl_seconds):
+                evicted += self.evict(s, reason="ttl", idle_before=cutoff)
+        if self.max_bytes:
+            total = self.catalog.total_bytes()
+            if total > self.max_bytes:
+                for s in self.catalog.sessions():
+                    if total <= self.max_bytes or s["last_accessed"] >= idle_before:
+                        break  # least recently used first: the rest are newer still
+                    if self.evict(s, reason="quota", idle_before=idle_before):
+                        total -= s["bytes"]
+                        evicted += 1
+        return evicted
+
+    def lead(self) -> bool:
+        """Try to become (or confirm being) the node's only collecting worker."""
+        if self._leader_fh is not None or fcntl is None:
+            return True
+        fh = open(self.catalog.db_path.with_name(self.catalog.db_path.name + ".gc.lock"), "a+")
+        try:
+            fcntl.flock(fh, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except OSError:
+            fh.close()
+            return False
+        self._leader_fh = fh  # held until stop() or process exit
+        log.info("Session collector elected", pid=os.getpid())
+        return True
+
+    def _run(self):
+        while not self._stop.wait(self.interval_seconds):
+            try:
+                if self.lead():
+                    self.collect()
+            except Exception as e:
+                log.error("Session collector pass failed", error=str(e))
+
+    def start(self):
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, name="session-gc", daemon=True)
+            self._thread.start()
+            log.info("Session collector started", ttl_seconds=self.ttl_seconds, max_bytes=self.max_bytes,
+                     interval_seconds=self.interval_seconds)
+
+    def stop(self):
+        self._stop.set()
+        if self._leader_fh is not None:
+            self._leader_fh.close()  # releases the flock
+            self._leader_fh = None
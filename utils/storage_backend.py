@@ -0,0 +1,399 @@
+from __future__ import annotations
+import json
+import os
+import shutil
+import threading
+import time
+import uuid
+from collections import Counter, OrderedDict
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Dict, Iterator, Mapping, Optional
+
+from logger import GLOBAL_LOGGER as log
+from utils.config_loader import get_config, subscribe
+from utils.metrics import REGISTRY
+
+MANIFEST = ".storage.json"
+# pointer files that name other files: uploaded and downloaded last, so nobody sees a
+# pointer before the files it points at (see utils/index_generations.py)
+COMMIT_MARKERS = {"CURRENT"}
+
+
+def _markers_last(names):
+    return sorted(names, key=lambda n: Path(n).name in COMMIT_MARKERS)
+
+STORAGE_CACHE = REGISTRY.counter("docportal_storage_cache_total", "Session folder lookups by cache result")
+STORAGE_BYTES = REGISTRY.counter("docportal_storage_bytes_total", "Bytes moved to/from the storage backend")
+STORAGE_CACHE_BYTES = REGISTRY.gauge("docportal_storage_cache_bytes", "Bytes of remote-backed folders cached on this node")
+
+
+# ---------- Backends ----------
+class StorageBackend:
+    """
+    Shared object storage for session folders. Keys are POSIX paths relative to the working
+    directory (e.g. "faiss_index/<session>/index.faiss"); a version is any string that
+    changes whenever the object does.
+    """
+    name = "base"
+
+    def list(self, prefix: str) -> Dict[str, str]:
+        """{key: version} of the objects directly under `prefix/` (session folders are flat)."""
+        raise NotImplementedError
+
+    def download(self, key: str, dest: Path):
+        raise NotImplementedError
+
+    def upload(self, src: Path, key: str) -> str:
+        """Store `src` under `key` and return the new version."""
+        raise NotImplementedError
+
+    def delete(self, key: str):
+        raise NotImplementedError
+
+    def delete_prefix(self, prefix: str):
+        raise NotImplementedError
+
+
+class LocalBackend(StorageBackend):
+    """A folder every task can reach (EFS/NFS mount), or a stand-in for S3 in tests."""
+    name = "local"
+
+    def __init__(self, root: str):
+        self.root = Path(root)
+        self.root.mkdir(parents=True, exist_ok=True)
+
+    @staticmethod
+    def _version(p: Path) -> str:
+        st = p.stat()
+        return f"{st.st_mtime_ns:x}-{st.st_size:x}"
+
+    def list(self, prefix: str) -> Dict[str, str]:
+        base = self.root / prefix
+        if not base.is_dir():
+            return {}
+        return {p.relative_to(self.root).as_posix(): self._version(p)
+                for p in base.iterdir() if p.is_file() and not p.name.startswith(".")}
+
+    def download(self, key: str, dest: Path):
+        shutil.copyfile(self.root / key, dest)
+
+    def upload(self, src: Path, key: str) -> str:
+        out = self.root / key
+        out.parent.mkdir(parents=True, exist_ok=True)
+        tmp = out.with_name(f".tmp-{uuid.uuid4().hex}")
+        shutil.copyfile(src, tmp)
+        os.replace(tmp, out)  # readers never see a partial object
+        return self._version(out)
+
+    def delete(self, key: str):
+        (self.root / key).unlink(missing_ok=True)
+
+    def delete_prefix(self, prefix: str):
+        shutil.rmtree(self.root / prefix, ignore_errors=True)
+
+
+class S3Backend(StorageBackend):
+    """S3 or an S3-compatible service (MinIO via `endpoint_url`); ETags are the versions."""
+    name = "s3"
+
+    def __init__(self, bucket: str, prefix: str = "", endpoint_url: Optional[str] = None,
+                 region: Optional[str] = None):
+        try:
+            import boto3
+        except ImportError as e:
+            raise RuntimeError("storage.backend=s3 requires boto3 (pip install boto3)") from e
+        self.bucket = bucket
+        self.prefix = prefix.strip("/")
+        self.client = boto3.client("s3", endpoint_url=endpoint_url, region_name=region)
+
+    def _obj(self, key: str) -> str:
+        return f"{self.prefix}/{key}" if self.prefix else key
+
+    def list(self, prefix: str) -> Dict[str, str]:
+        out: Dict[str, str] = {}
+        strip = len(self.prefix) + 1 if self.prefix else 0
+        paginator = self.client.get_paginator("list_objects_v2")
+        for page in paginator.paginate(Bucket=self.bucket, Prefix=self._obj(prefix.rstrip("/") + "/"), Delimiter="/"):
+            for obj in page.get("Contents", []):
+                out[obj["Key"][strip:]] = obj["ETag"].strip('"')
+        return out
+
+    def download(self, key: str, dest: Path):
+        self.client.download_file(self.bucket, self._obj(key), str(dest))
+
+    def upload(self, src: Path, key: str) -> str:
+        self.client.upload_file(str(src), self.bucket, self._obj(key))
+        return self.client.head_object(Bucket=self.bucket, Key=self._obj(key))["ETag"].strip('"')
+
+    def delete(self, key: str):
+        self.client.delete_object(Bucket=self.bucket, Key=self._obj(key))
+
+    def delete_prefix(self, prefix: str):
+        keys = [{"Key": self._obj(k)} for k in self.list(prefix)]
+        for i in range(0, len(keys), 1000):
+            self.client.delete_objects(Bucket=self.bucket, Delete={"Objects": keys[i:i + 1000]})
+
+
+# ---------- Node-local read-through cache ----------
+def _local_version(p: Path) -> str:
+    st = p.stat()
+    return f"{st.st_mtime_ns:x}-{st.st_size:x}"
+
+
+class NodeCache:
+    """
+    Mirrors backend folders at their usual working paths, so FAISS and the loaders keep
+    reading local files. A folder's manifest (`.storage.json`) records the remote version
+    and local stamp of every file; `fetch` downloads only what changed remotely (checked at
+    most every `revalidate_seconds`), `publish` uploads only what changed locally.
+    Folders this node fetched or published are evicted least recently used first once
+    they exceed `max_bytes`, unless they hold unpublished changes, are pinned by a reader
+    (`pinned`) or were used within the last `min_idle_seconds`.
+    """
+    def __init__(self, backend: StorageBackend, max_bytes: int = 2 << 30,
+                 revalidate_seconds: float = 5.0, workdir: Optional[str] = None,
+                 min_idle_seconds: float = 60.0):
+        self.backend = backend
+        self.max_bytes = max_bytes
+        self.revalidate_seconds = revalidate_seconds
+        self.min_idle_seconds = min_idle_seconds
+        self.workdir = Path(workdir or os.getcwd())
+        self._lru: "OrderedDict[str, int]" = OrderedDict()  # key -> cached bytes
+        self._checked: Dict[str, float] = {}
+        self._used: Dict[str, float] = {}
+        self._pins: Counter = Counter()
+        self._locks: Dict[str, threading.Lock] = {}
+        self._lock = threading.Lock()
+
+    def _key(self, local_dir) -> str:
+        return Path(os.path.relpath(Path(local_dir).resolve(), self.workdir.resolve())).as_posix()
+
+    def _dir_lock(self, key: str) -> threading.Lock:
+        with self._lock:
+            return self._locks.setdefault(key, threading.Lock())
+
+    @staticmethod
+    def _read_manifest(folder: Path) -> Dict[str, Dict[str, str]]:
+        try:
+            return json.loads((folder / MANIFEST).read_text(encoding="utf-8"))
+        except (OSError, ValueError):
+            return {}
+
+    @staticmethod
+    def _write_manifest(folder: Path, manifest: Mapping):
+        tmp = folder / f".tmp-{uuid.uuid4().hex}"
+        tmp.write_text(json.dumps(manifest), encoding="utf-8")
+        os.replace(tmp, folder / MANIFEST)
+
+    @staticmethod
+    def _local_files(folder: Path) -> Dict[str, Path]:
+        if not folder.is_dir():
+            return {}
+        # dotfiles (manifest, temp files, lock files) are node-local
+        return {p.name: p for p in folder.iterdir() if p.is_file() and not p.name.startswith(".")}
+
+    def fetch(self, local_dir) -> bool:
+        """Bring `local_dir` up to date with the backend; False if neither side has it."""
+        folder = Path(local_dir)
+        key = self._key(folder)
+        with self._dir_lock(key):
+            now = time.monotonic()
+            if now - self._checked.get(key, float("-inf")) < self.revalidate_seconds and folder.is_dir():
+                STORAGE_CACHE.inc(result="hit")
+                self._touch(key, folder)
+                return True
+            remote = self.backend.list(key)
+            if not remote:
+                self._checked[key] = now
+                return folder.is_dir()
+            manifest = self._read_manifest(folder)
+            local = self._local_files(folder)
+            stale = [k for k, version in remote.items()
+                     if manifest.get(k[len(key) + 1:], {}).get("remote") != version
+                     or k[len(key) + 1:] not in local]
+            if stale:
+                folder.mkdir(parents=True, exist_ok=True)
+                for k in _markers_last(stale):
+                    rel = k[len(key) + 1:]
+                    dest = folder / rel
+                    tmp = dest.with_name(f".tmp-{uuid.uuid4().hex}")
+                    self.backend.download(k, tmp)
+                    os.replace(tmp, dest)
+                    STORAGE_BYTES.inc(dest.stat().st_size, op="download", backend=self.backend.name)
+                    manifest[rel] = {"remote": remote[k], "local": _local_version(dest)}
+                self._write_manifest(folder, manifest)
+                log.info("Storage folder fetched", key=key, files=len(stale), backend=self.backend.name)
+            STORAGE_CACHE.inc(result="miss" if stale else "revalidated")
+            self._checked[key] = now
+            self._touch(key, folder)
+        self._evict(keep=key)
+        return True
+
+    def publish(self, local_dir):
+        """
+        Upload the files of `local_dir` that changed since they were last fetched or published,
+        and delete the remote copies of tracked files that were removed locally (old index
+        generations).
+        """
+        folder = Path(local_dir)
+        key = self._key(folder)
+        with self._dir_lock(key):
+            manifest = self._read_manifest(folder)
+            uploaded = 0
+            local = self._local_files(folder)
+            for rel in _markers_last(local):
+                p = local[rel]
+                stamp = _local_version(p)
+                if manifest.get(rel, {}).get("local") == stamp:
+                    continue
+                manifest[rel] = {"remote": self.backend.upload(p, f"{key}/{rel}"), "local": stamp}
+                STORAGE_BYTES.inc(p.stat().st_size, op="upload", backend=self.backend.name)
+                uploaded += 1
+            for rel in [r for r in manifest if r not in local]:
+                self.backend.delete(f"{key}/{rel}")
+                del manifest[rel]
+                uploaded += 1
+            if uploaded:
+                self._write_manifest(folder, manifest)
+                log.info("Storage folder published", key=key, files=uploaded, backend=self.backend.name)
+            self._checked[key] = time.monotonic()
+            self._touch(key, folder)
+        self._evict(keep=key)
+
+    @contextmanager
+    def pinned(self, local_dir) -> Iterator[bool]:
+        """Fetch `local_dir` and keep it from being evicted until the block ends (e.g. while FAISS loads it)."""
+        key = self._key(local_dir)
+        with self._lock:
+            self._pins[key] += 1
+        try:
+            yield self.fetch(local_dir)
+        finally:
+            with self._lock:
+                self._pins[key] -= 1
+                if self._pins[key] <= 0:
+                    del self._pins[key]
+
+    def _in_use(self, key: str, now: float) -> bool:
+        # caller holds self._lock
+        return self._pins[key] > 0 or now - self._used.get(key, float("-inf")) < self.min_idle_seconds
+
+    def delete(self, local_dir):
+        key = self._key(local_dir)
+        self.backend.delete_prefix(key)
+        with self._lock:
+            self._lru.pop(key, None)
+            self._checked.pop(key, None)
+            self._used.pop(key, None)
+
+    def _touch(self, key: str, folder: Path):
+        size = sum(p.stat().st_size for p in self._local_files(folder).values())
+        with self._lock:
+            self._lru[key] = size
+            self._lru.move_to_end(key)
+            self._used[key] = time.monotonic()
+            STORAGE_CACHE_BYTES.set(sum(self._lru.values()))
+
+    def _published(self, folder: Path) -> bool:
+        manifest = self._read_manifest(folder)
+        local = self._local_files(folder)
+        return all(manifest.get(rel, {}).get("local") == _local_version(p) for rel, p in local.items())
+
+    def _evict(self, keep: str):
+        now = time.monotonic()
+        with self._lock:
+            total = sum(self._lru.values())
+            victims = []
+            for key, size in self._lru.items():
+                if total <= self.max_bytes:
+                    break
+                if key != keep and not self._in_use(key, now):
+                    victims.append(key)
+                    total -= size
+        for key in victims:
+            with self._dir_lock(key):
+                folder = self.workdir / key
+                with self._lock:
+                    if self._in_use(key, now):
+                        continue  # pinned since it was picked; a later fetch waits for this lock
+                if not self._published(folder):
+                    continue  # being written; it is published (and re-measured) when done
+                shutil.rmtree(folder, ignore_errors=True)
+                with self._lock:
+                    self._lru.pop(key, None)
+                    self._checked.pop(key, None)
+                    self._used.pop(key, None)
+                log.info("Storage folder evicted from node cache", key=key)
+        with self._lock:
+            STORAGE_CACHE_BYTES.set(sum(self._lru.values()))
+
+
+# ---------- Process-wide cache (config: storage) ----------
+_CACHE: Optional[NodeCache] = None
+_CACHE_LOCK = threading.Lock()
+_CONFIGURED = False
+
+
+def _build(block: Mapping) -> Optional[NodeCache]:
+    kind = (os.getenv("STORAGE_BACKEND") or block.get("backend") or "none").lower()
+    if kind == "none":
+        return None
+    if kind == "local":
+        backend: StorageBackend = LocalBackend(os.getenv("STORAGE_ROOT") or block["root"])
+    elif kind == "s3":
+        s3 = block.get("s3") or {}
+        backend = S3Backend(os.getenv("STORAGE_BUCKET") or s3["bucket"], s3.get("prefix", ""),
+                            os.getenv("STORAGE_ENDPOINT_URL") or s3.get("endpoint_url"), s3.get("region"))
+    else:
+        raise ValueError(f"Unsupported storage backend: {kind}")
+    log.info("Storage backend configured", backend=kind)
+    return NodeCache(backend, int(block.get("cache_max_mb", 2048)) << 20,
+                     float(block.get("revalidate_seconds", 5)),
+                     min_idle_seconds=float(block.get("cache_min_idle_seconds", 60)))
+
+
+def get_storage() -> Optional[NodeCache]:
+    """Shared-storage cache, or None when session folders live on this node only."""
+    global _CACHE, _CONFIGURED
+    with _CACHE_LOCK:
+        if not _CONFIGURED:
+            _CACHE = _build(get_config().get("storage") or {})
+            _CONFIGURED = True
+        return _CACHE
+
+
+def _on_storage_change(old, new, changed):
+    global _CONFIGURED
+    with _CACHE_LOCK:
+        _CONFIGURED = False
+    log.info("Storage backend will be rebuilt after config change")
+
+
+subscribe(_on_storage_change, {"storage"})
+
+
+def fetch_dir(local_dir) -> bool:
+    """Make a session folder available locally (no-op without a backend); True if it exists."""
+    storage = get_storage()
+    if storage is None:
+        return Path(local_dir).is_dir()
+    return storage.fetch(local_dir)
+
+
+@contextmanager
+def pinned_dir(local_dir) -> Iterator[bool]:
+    """`fetch_dir`, keeping the folder on this node until the block ends (wrap index loads in it)."""
+    storage = get_storage()
+    if storage is None:
+        yield Path(local_dir).is_dir()
+        return
+    with storage.pinned(local_dir) as exists:
+        yield exists
+
+
+def publish_dir(local_dir):
+    """Push a session folder's local changes to the backend (no-op without a backend)."""
+    storage = get_storage()
+    if storage is not None:
+        storage.publish(local_dir)
@@ -0,0 +1,214 @@
+from __future__ import annotations
+import json
+import re
+from typing import Any, Dict, List, Optional, Tuple, Type
+
+from langchain_core.exceptions import OutputParserException
+from langchain_core.output_parsers import BaseOutputParser, JsonOutputParser
+from pydantic import BaseModel, ValidationError
+
+from logger import GLOBAL_LOGGER as log
+from utils.metrics import REGISTRY
+
+STRUCTURED_OUTPUT = REGISTRY.counter(
+    "docportal_structured_output_total",
+    "LLM JSON outputs by feature and path (direct, repaired, llm_fix, failed, native_fallback)",
+)
+
+_THINK = re.compile(r"<think>.*?</think>", re.DOTALL | re.IGNORECASE)
+_FENCE = re.compile(r"```(?:json|JSON)?\s*\n?(.*?)```", re.DOTALL)
+
+
+# ---------- Local repair ----------
+def _drop_trailing_commas(text: str) -> str:
+    """Remove commas directly before } or ] (outside string literals)."""
+    out, in_string, escaped, i = [], False, False, 0
+    while i < len(text):
+        ch = text[i]
+        if in_string:
+            escaped = ch == "\\" and not escaped
+            in_string = not (ch == '"' and not escaped)
+        elif ch == '"':
+            in_string = True
+        elif ch == ",":
+            j = i + 1
+            while j < len(text) and text[j].isspace():
+                j += 1
+            if j < len(text) and text[j] in "}]":
+                i += 1
+                continue
+        out.append(ch)
+        i += 1
+    return "".join(out)
+
+
+def repair_json_text(text: str) -> str:
+    """
+    Best-effort cleanup of an LLM reply into JSON text: drop reasoning (<think> blocks, or
+    everything before a dangling </think>), unwrap a ``` fence, cut any prose around the
+    outermost object/array and remove trailing commas.
+    """
+    text = _THINK.sub("", text)
+    if "</think>" in text.lower():
+        text = text[text.lower().rindex("</think>") + len("</think>"):]
+    fenced = _FENCE.search(text)
+    if fenced:
+        text = fenced.group(1)
+    starts = [i for i in (text.find("{"), text.find("[")) if i >= 0]
+    if starts:
+        start = min(starts)
+        end = text.rfind("}" if text[start] == "{" else "]")
+        if end > start:
+            text = text[start:end + 1]
+    return _drop_trailing_commas(text.strip())
+
+
+def parse_structured(text: str, schema: Type[BaseModel]) -> Tuple[Any, str]:
+    """
+    (validated JSON value, "direct" | "repaired"); raises OutputParserException when the
+    reply is not valid for `schema` even after local repair.
+    """
+    error: Optional[Exception] = None
+    for path, candidate in (("direct", lambda: text.strip()), ("repaired", lambda: repair_json_text(text))):
+        try:
+            return schema.model_validate(json.loads(candidate())).model_dump(), path
+        except (ValueError, ValidationError) as e:  # JSONDecodeError is a ValueError
+            error = e
+    raise OutputParserException(f"Invalid {schema.__name__} JSON: {error}", llm_output=text)
+
+
+class LocalJsonParser(BaseOutputParser[Any]):
+    """Parse + repair + validate against `pydantic_object`, without any LLM call."""
+    pydantic_object: Any
+
+    def parse(self, text: str) -> Any:
+        return parse_structured(text, self.pydantic_object)[0]
+
+    def get_format_instructions(self) -> str:
+        return JsonOutputParser(pydantic_object=self.pydantic_object).get_format_instructions()
+
+    @property
+    def _type(self) -> str:
+        return "local_json"
+
+
+class StructuredOutputParser(LocalJsonParser):
+    """
+    LocalJsonParser that falls back to `fixer` (an OutputFixingParser over a LocalJsonParser:
+    one LLM round-trip) only when local repair fails. Every reply is counted per path.
+    """
+    feature: str = "default"
+    fixer: Any = None
+
+    def parse(self, text: str) -> Any:
+        try:
+            value, path = parse_structured(text, self.pydantic_object)
+        except OutputParserException as e:
+            if self.fixer is None:
+                STRUCTURED_OUTPUT.inc(feature=self.feature, path="failed")
+                raise
+            log.warning("Local JSON repair failed; asking the LLM to fix it", feature=self.feature, error=str(e)[:200])
+            try:
+                value, path = self.fixer.parse(text), "llm_fix"
+            except Exception:
+                STRUCTURED_OUTPUT.inc(feature=self.feature, path="failed")
+                raise
+        STRUCTURED_OUTPUT.inc(feature=self.feature, path=path)
+        return value
+
+    @property
+    def _type(self) -> str:
+        return "structured_json"
+
+
+def structured_parser(schema: Type[BaseModel], feature: str, fixer_llm=None) -> StructuredOutputParser:
+    """Parser for `schema`; with `fixer_llm`, an LLM fix is the last resort."""
+    fixer = None
+    if fixer_llm is not None:
+        from langchain.output_parsers import OutputFixingParser
+        fixer = OutputFixingParser.from_llm(parser=LocalJsonParser(pydantic_object=schema), llm=fixer_llm)
+    return StructuredOutputParser(pydantic_object=schema, feature=feature, fixer=fixer)
+
+
+# ---------- Native JSON mode with fallback ----------
+def native_json_supported(schema: Type[BaseModel]) -> bool:
+    """Provider JSON modes (e.g. Groq's json_object) force a top-level object, not an array."""
+    return schema.model_json_schema().get("type") != "array"
+
+
+def _status_code(error: BaseException) -> Optional[int]:
+    # groq/openai-style APIStatusError.status_code, google.api_core GoogleAPICallError.code
+    for value in (getattr(error, "status_code", None), getattr(error, "code", None),
+                  getattr(getattr(error, "response", None), "status_code", None)):
+        if isinstance(value, int):
+            return value
+    return None
+
+
+def _native_failed(error: BaseException) -> bool:
+    """
+    The provider rejected the JSON-mode request itself (HTTP 400: invalid request or
+    unsupported parameter). Timeouts, network errors, 5xx and rate limits are not retried
+    on the plain client, so an outage does not double the provider calls.
+    """
+    seen = set()
+    while error is not None and id(error) not in seen:  # provider errors may be re-wrapped
+        if _status_code(error) == 400:
+            return True
+        seen.add(id(error))
+        error = error.__cause__ or error.__context__
+    return False
+
+
+class StructuredChain:
+    """
+    prompt | llm | parser, asking the provider for JSON (`json_llm`, its native JSON mode)
+    when available. If the provider rejects a JSON-mode call as a bad request, that call is
+    retried once on the plain model.
+    """
+    def __init__(self, prompt, parser: StructuredOutputParser, llm, json_llm=None):
+        self.feature = parser.feature
+        self.plain = prompt | llm | parser
+        self.native = prompt | json_llm | parser if json_llm is not None else None
+
+    def _fell_back(self, error: BaseException):
+        STRUCTURED_OUTPUT.inc(feature=self.feature, path="native_fallback")
+        log.warning("Native JSON mode failed; retrying without it", feature=self.feature, error=str(error)[:200])
+
+    def invoke(self, inputs: Dict[str, Any]) -> Any:
+        if self.native is None:
+            return self.plain.invoke(inputs)
+        try:
+            return self.native.invoke(inputs)
+        except Exception as e:
+            if not _native_failed(e):
+                raise
+            self._fell_back(e)
+            return self.plain.invoke(inputs)
+
+    async def ainvoke(self, inputs: Dict[str, Any]) -> Any:
+        if self.native is None:
+            return await self.plain.ainvoke(inputs)
+        try:
+            return await self.native.ainvoke(inputs)
+        except Exception as e:
+            if not _native_failed(e):
+                raise
+            self._fell_back(e)
+            return await self.plain.ainvoke(inputs)
+
+    async def abatch(self, inputs: List[Dict[str, Any]], config=None, return_exceptions: bool = False) -> List[Any]:
+        if self.native is None:
+            return await self.plain.abatch(inputs, config=config, return_exceptions=return_exceptions)
+        results = await self.native.abatch(inputs, config=config, return_exceptions=True)
+        retry = [i for i, r in enumerate(results) if isinstance(r, Exception) and _native_failed(r)]
+        if retry:
+            self._fell_back(results[retry[0]])
+            redone = await self.plain.abatch([inputs[i] for i in retry], config=config, return_exceptions=True)
+            for i, r in zip(retry, redone):
+                results[i] = r
+        if not return_exceptions:
+            for r in results:
+                if isinstance(r, Exception):
+                    raise r
+        return results